@@ -0,0 +1,269 @@
+'''
+ASGI front end
+
+Serves the routes of server.py to an asyncio server, e.g. from the top of the
+repository:
+
+    uvicorn --app-dir src asgi:app
+
+Connections are handled by coroutines, so clients that are connected but
+waiting cost no thread. A request is handed to the Flask app in server.py on
+an executor, which keeps the endpoints and JSON shapes the same as the
+threaded server. Requests on SLOW_PATHS wait on other hosts (fetching a
+photo, sending mail) and get an executor of their own, so they can not hold
+up the rest.
+
+A long poll on POLL_PATH is checked by the route first, then waits for updates
+on the event loop, and only goes back to an executor once there are some or
+its time is up.
+'''
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import parse_qs, urlencode
+import asyncio
+import json
+import sys
+import persister
+import scheduler
+import server
+import updates
+import workers
+
+# threads running ordinary requests, which only wait for the data locks
+WORKER_THREADS = 16
+# threads running requests that wait on other hosts
+SLOW_THREADS = 16
+SLOW_PATHS = ['/auth/passwordreset/request', '/user/profile/uploadphoto']
+POLL_PATH = '/channel/messages/poll'
+
+executor = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix='asgi')
+slow_executor = ThreadPoolExecutor(max_workers=SLOW_THREADS, thread_name_prefix='asgi-slow')
+
+def wsgi_environ(scope, body):
+    '''
+    Build the WSGI environ of an ASGI HTTP request.
+
+    Args:
+        scope (dict): ASGI connection scope.
+        body (bytes): request body.
+
+    Return:
+        environ (dict): environ to call the Flask app with.
+    '''
+    (server_name, server_port) = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for (name, value) in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = 'HTTP_' + name
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+def call_app(environ):
+    '''
+    Run a request through the Flask app, on an executor thread.
+
+    Args:
+        environ (dict): WSGI environ of the request.
+
+    Return:
+        (status code, list of (name, value) headers as bytes, body)
+    '''
+    response = {}
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                               for (name, value) in headers]
+    chunks = server.APP.wsgi_app(environ, start_response)
+    try:
+        body = b''.join(chunks)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+    return (response['status'], response['headers'], body)
+
+async def read_body(receive):
+    '''
+    Read the whole body of a request.
+
+    Args:
+        receive (coroutine function): ASGI receive channel.
+
+    Return:
+        body (bytes): request body, None if the client went away.
+    '''
+    chunks = []
+    while True:
+        event = await receive()
+        if event['type'] == 'http.disconnect':
+            return None
+        chunks.append(event.get('body', b''))
+        if not event.get('more_body', False):
+            return b''.join(chunks)
+
+def poll_query(scope):
+    '''
+    Read the query of a long poll.
+
+    Args:
+        scope (dict): ASGI connection scope of the poll.
+
+    Return:
+        (scope of the same poll without the wait, channel_id, cursor,
+        timeout), None if the query is not one the route takes.
+    '''
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    try:
+        channel_id = int(query['channel_id'][0])
+        cursor = query.get('cursor', [''])[0]
+        timeout = min(float(query.get('timeout', [updates.POLL_TIMEOUT])[0]), updates.POLL_TIMEOUT)
+    except (KeyError, ValueError):
+        return None
+    query['timeout'] = ['0']
+    scope = dict(scope, query_string=urlencode(query, doseq=True).encode('latin-1'))
+    return (scope, channel_id, cursor, timeout)
+
+def has_news(answer):
+    '''
+    Tell whether the answer to a poll that did not wait should be sent as it is.
+
+    Args:
+        answer (tuple): (status code, headers, body) from call_app.
+
+    Return:
+        bool: True for an error, or changes to send.
+    '''
+    (status, _, body) = answer
+    if status != 200:
+        return True
+    output = json.loads(body)
+    return output['reset'] or bool(output['messages']) or bool(output['removed'])
+
+async def wait_for_updates(channel_id, cursor, timeout):
+    '''
+    Wait for a channel to have updates after cursor, without taking a thread.
+
+    Args:
+        channel_id (int): channel polled.
+        cursor (str): cursor the client has seen.
+        timeout (float): longest wait in seconds.
+
+    Return:
+        None
+    '''
+    loop = asyncio.get_running_loop()
+    woken = asyncio.Event()
+    def wake():
+        loop.call_soon_threadsafe(woken.set)
+    updates.watch(channel_id, wake)
+    try:
+        deadline = loop.time() + timeout
+        while True:
+            if workers.enabled:
+                await loop.run_in_executor(executor, workers.catch_up)
+            woken.clear()
+            if updates.has_updates(channel_id, cursor):
+                return
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            if workers.enabled:
+                remaining = min(remaining, updates.CATCH_UP_INTERVAL)
+            try:
+                await asyncio.wait_for(woken.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        updates.unwatch(channel_id, wake)
+
+async def respond(send, answer):
+    '''
+    Send the answer of the Flask app to the client.
+
+    Args:
+        send (coroutine function): ASGI send channel.
+        answer (tuple): (status code, headers, body) from call_app.
+
+    Return:
+        None
+    '''
+    (status, headers, body) = answer
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def lifespan(receive, send):
+    '''
+    Answer the start up and shut down of the ASGI server. On shut down the
+    scheduled messages stop and the changes not written yet are flushed.
+
+    Args:
+        receive (coroutine function): ASGI receive channel.
+        send (coroutine function): ASGI send channel.
+
+    Return:
+        None
+    '''
+    while True:
+        event = await receive()
+        if event['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif event['type'] == 'lifespan.shutdown':
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(executor, scheduler.stop)
+            await loop.run_in_executor(executor, persister.stop)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    '''
+    ASGI application serving the Flockr routes.
+
+    Args:
+        scope (dict): ASGI connection scope.
+        receive (coroutine function): ASGI receive channel.
+        send (coroutine function): ASGI send channel.
+
+    Return:
+        None
+    '''
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    body = await read_body(receive)
+    if body is None:
+        return
+    pool = slow_executor if scope['path'] in SLOW_PATHS else executor
+    loop = asyncio.get_running_loop()
+    poll = poll_query(scope) if scope['path'] == POLL_PATH and scope['method'] == 'GET' else None
+    if poll is not None:
+        (scope, channel_id, cursor, timeout) = poll
+        # the route checks the token and the channel before anyone waits
+        answer = await loop.run_in_executor(pool, call_app, wsgi_environ(scope, body))
+        if has_news(answer):
+            await respond(send, answer)
+            return
+        await wait_for_updates(channel_id, cursor, timeout)
+    answer = await loop.run_in_executor(pool, call_app, wsgi_environ(scope, body))
+    await respond(send, answer)
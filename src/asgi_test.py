@@ -0,0 +1,167 @@
+import other
+import asgi
+import server
+import asyncio
+import json
+import pytest
+import threading
+from time import time
+from error import AccessError
+from urllib.parse import urlencode
+
+@pytest.fixture
+def app(monkeypatch):
+    '''
+    serve the routes in this process, without loading the database from disk
+    '''
+
+    other.clear()
+    monkeypatch.setattr(server.APP, 'before_first_request_funcs', [])
+    yield
+    other.clear()
+
+async def call(method, path, payload=None, body_sent=None):
+    '''
+    send one request through the ASGI app, the body is only sent once
+    body_sent is set if it is given
+    Return: (status, decoded JSON body)
+    '''
+
+    if method == 'GET':
+        (query, body) = (urlencode(payload or {}), b'')
+    else:
+        (query, body) = ('', json.dumps(payload or {}).encode())
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': query.encode(),
+        'headers': [(b'content-type', b'application/json')],
+        'server': ('testserver', 80),
+    }
+    async def receive():
+        if body_sent is not None:
+            await body_sent.wait()
+        return {'type': 'http.request', 'body': body}
+    response = {}
+    async def send(event):
+        if event['type'] == 'http.response.start':
+            response['status'] = event['status']
+        else:
+            response['body'] = event['body']
+    await asgi.app(scope, receive, send)
+    return (response['status'], json.loads(response['body']))
+
+def request(method, path, payload=None):
+    return asyncio.run(call(method, path, payload))
+
+def test_asgi_same_responses(app):
+    '''
+    the ASGI app answers like the threaded Flask server
+    '''
+
+    (status, user) = request('POST', '/auth/register', {'email': 'user1@gmail.com',
+        'password': 'password1', 'name_first': 'name_1', 'name_last': 'surname_1'})
+    assert status == 200
+    assert user['u_id'] == 1
+    (_, created) = request('POST', '/channels/create', {'token': user['token'],
+        'name': 'channel1', 'is_public': True})
+    request('POST', '/message/send', {'token': user['token'],
+        'channel_id': created['channel_id'], 'message': 'hello'})
+
+    query = {'token': user['token'], 'channel_id': created['channel_id'], 'start': 0}
+    (status, messages) = request('GET', '/channel/messages', query)
+    assert status == 200
+    assert [m['message'] for m in messages['messages']] == ['hello']
+    flask_response = server.APP.test_client().get('/channel/messages', query_string=query)
+    assert messages == json.loads(flask_response.data)
+
+    (status, error) = request('GET', '/channel/messages', dict(query, token='invalid'))
+    assert status == AccessError.code
+    assert set(error) == {'code', 'name', 'message'}
+
+def test_asgi_idle_clients(app, monkeypatch):
+    '''
+    clients that have not sent their request yet take no thread, and a slow
+    request does not hold up the others
+    '''
+
+    (_, user) = request('POST', '/auth/register', {'email': 'user1@gmail.com',
+        'password': 'password1', 'name_first': 'name_1', 'name_last': 'surname_1'})
+    release = threading.Event()
+    def slow_route():
+        release.wait(10)
+        return {}
+    monkeypatch.setitem(server.APP.view_functions, 'profile_uploadphoto', slow_route)
+    threads = threading.active_count()
+
+    async def clients():
+        body_sent = asyncio.Event()
+        idle = [asyncio.ensure_future(call('GET', '/users/all', {'token': user['token']}, body_sent))
+                for _ in range(1000)]
+        slow = asyncio.ensure_future(call('POST', '/user/profile/uploadphoto', {}))
+        await asyncio.sleep(0.2)
+        assert threading.active_count() <= threads + 1
+        body_sent.set()
+        answers = await asyncio.gather(*idle)
+        assert all(status == 200 for (status, _) in answers)
+        assert not slow.done()
+        release.set()
+        assert await slow == (200, {})
+        assert threading.active_count() <= threads + asgi.WORKER_THREADS + asgi.SLOW_THREADS
+
+    try:
+        asyncio.run(clients())
+    finally:
+        release.set()
+
+def test_asgi_waiting_polls(app):
+    '''
+    long polls waiting for a channel take no thread, and a send wakes them
+    '''
+
+    (_, user) = request('POST', '/auth/register', {'email': 'user1@gmail.com',
+        'password': 'password1', 'name_first': 'name_1', 'name_last': 'surname_1'})
+    (_, created) = request('POST', '/channels/create', {'token': user['token'],
+        'name': 'channel1', 'is_public': True})
+    query = {'token': user['token'], 'channel_id': created['channel_id']}
+    (_, first) = request('GET', '/channel/messages/poll', dict(query, cursor=''))
+    threads = threading.active_count()
+
+    async def clients():
+        polls = [asyncio.ensure_future(call('GET', '/channel/messages/poll',
+                     dict(query, cursor=first['cursor'], timeout=10)))
+                 for _ in range(100)]
+        await asyncio.sleep(0.2)
+        assert not any(poll.done() for poll in polls)
+        assert threading.active_count() <= threads + 1
+        await call('POST', '/message/send', dict(query, message='hello'))
+        answers = await asyncio.wait_for(asyncio.gather(*polls), 5)
+        assert all(status == 200 for (status, _) in answers)
+        assert all([m['message'] for m in changed['messages']] == ['hello'] for (_, changed) in answers)
+
+    asyncio.run(clients())
+
+def test_asgi_poll_checked_first(app):
+    '''
+    a poll the route refuses is answered straight away, not after the wait
+    '''
+
+    (_, user1) = request('POST', '/auth/register', {'email': 'user1@gmail.com',
+        'password': 'password1', 'name_first': 'name_1', 'name_last': 'surname_1'})
+    (_, user2) = request('POST', '/auth/register', {'email': 'user2@gmail.com',
+        'password': 'password2', 'name_first': 'name_2', 'name_last': 'surname_2'})
+    (_, public) = request('POST', '/channels/create', {'token': user1['token'],
+        'name': 'public', 'is_public': True})
+    (_, private) = request('POST', '/channels/create', {'token': user2['token'],
+        'name': 'private', 'is_public': False})
+    request('POST', '/channel/join', {'token': user2['token'], 'channel_id': public['channel_id']})
+    (_, first) = request('GET', '/channel/messages/poll', {'token': user1['token'],
+        'channel_id': public['channel_id'], 'cursor': ''})
+
+    started = time()
+    for token in [user1['token'], 'invalid']:
+        (status, _) = request('GET', '/channel/messages/poll', {'token': token,
+            'channel_id': private['channel_id'], 'cursor': first['cursor'], 'timeout': 10})
+        assert status == AccessError.code
+    assert time() - started < 5
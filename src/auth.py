@@ -58,7 +58,7 @@ def auth_login(email, password):
         'u_id': account['u_id']
     }
 
-    data.sessions.append(new_session)
+    data.new_session(new_session)
 
     # everything good, return an active token and user's id
     return new_session
@@ -82,7 +82,7 @@ def auth_logout(token):
     logout_session = data.session_search("token", token)
     # if token exist and is active, delete the whole session
     if logout_session:
-        data.sessions.remove(logout_session)
+        data.delete_session(logout_session)
         if not data.session_search("token", token):
             return {'is_success': True}
     else:
@@ -144,7 +144,6 @@ def auth_register(email, password, name_first, name_last):
 
     # create account and store info
     new_account = {
-        'u_id': 0,
         'email': email,
         'name_first': name_first,
         'name_last': name_last,
@@ -94,3 +94,18 @@ def test_auth_logout_fail():
     with pytest.raises(AccessError):
         auth.auth_logout("fuwegfiweh")
     clear()
+
+def test_auth_logout_twice():
+    '''
+    a token can not be used again once its session has been logged out
+    '''
+
+    auth.auth_register('jackbrian@gmail.com', 'hf85H4t8Fuhr', 'Jack', 'Brian')
+    token = auth.auth_login('jackbrian@gmail.com', 'hf85H4t8Fuhr')['token']
+    assert(auth.auth_logout(token) == {'is_success': True})
+    with pytest.raises(AccessError):
+        auth.auth_logout(token)
+    # logging back in creates a new session
+    token = auth.auth_login('jackbrian@gmail.com', 'hf85H4t8Fuhr')['token']
+    assert(auth.auth_logout(token) == {'is_success': True})
+    clear()
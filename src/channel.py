@@ -1,6 +1,7 @@
 import sys
 import data
 import channels
+import updates
 from error import AccessError, InputError
 
 def channel_invite(token, channel_id, u_id):
@@ -104,7 +105,7 @@ def channel_details(token, channel_id):
 
     return c_details
 
-def channel_messages(token, channel_id, start):
+def channel_messages(token, channel_id, start, before_message_id=None, after_message_id=None):
     '''
     Given a Channel with ID channel_id that the authorised user is part of, 
     return up to 50 messages between index "start" and "start + 50".
@@ -113,25 +114,36 @@ def channel_messages(token, channel_id, start):
     or, if this function has returned the least recent messages in the channel, 
     returns -1 in "end" to indicate there are no more messages to load after this return.
 
+    Given before_message_id or after_message_id instead, return up to 50
+    messages sent just before or just after that message, newest first, with
+    the message_ids to continue from: "before_message_id" is the oldest message
+    returned (-1 if there are no older messages) and "after_message_id" the
+    newest, to poll for new messages. Messages sent in between do not shift
+    these pages.
+
 
     Args: 
         token(str): token of the user attempting to retrieve the messages in a channel.
         channel_id(int): channel_id of the channel from which the user is trying to 
         retrieve the messages.
         start(int): The start position from which the previous messages should be loaded.
+        before_message_id(int): Load the messages older than this message.
+        after_message_id(int): Load the messages newer than this message.
 
     Return: 
-        {messages, start, end}
+        {messages, start, end} or {messages, before_message_id, after_message_id}
     
     Raises: 
         AccessError: Token is invalid or user is not a member of the channel.
-        InputError: When the start index is greater than total number of messages or
-        an invalid channel_id is provided.
+        InputError: When the start index is greater than total number of messages,
+        an invalid channel_id is provided, or the message to load from is not
+        in the channel.
     '''
 
 
     #check if token is invalid
-    if not data.session_search('token', token):
+    session = data.session_search('token', token)
+    if not session:
         raise AccessError(description='Invalid Token!')
 
 
@@ -140,29 +152,25 @@ def channel_messages(token, channel_id, start):
         raise InputError(description='This Channel Doesn\'t Exist!')
 
     # check to see if the user is a member of the channel
-    u_id = data.session_search('token', token)['u_id']
+    u_id = session['u_id']
     if not (data.is_member(u_id, channel_id)):
         raise AccessError(description='You Cannot Access This Channel!')
 
+    if before_message_id is not None or after_message_id is not None:
+        return channel_messages_from(u_id, channel_id, before_message_id, after_message_id)
+
     #check if start is a valid number
-    channel = data.channels_search('channel_id', channel_id)
-    m_length = len(channel['messages'])
+    m_length = data.message_count(channel_id)
 
     if (start > m_length):
         raise InputError(description='Invalid Message Start Index!')
 
-    all_messages = data.channels_search('channel_id', channel_id)['messages']
-
-
     end = start + 50
+    return_messages = data.messages_page(channel_id, start, 50)
     if (end > m_length):
-        last = m_length
         end = -1
-        return_messages = all_messages[start:last]
-    else:
-        return_messages = all_messages[start:end]
 
-    return_messages = data.set_message_react_status(u_id, return_messages)
+    return_messages = data.message_views(u_id, return_messages)
 
     result = {
         'messages': return_messages,
@@ -198,7 +206,8 @@ def channel_leave(token, channel_id):
     '''
 
     # if token is invalid, raise access error
-    if not data.session_search('token', token):
+    session = data.session_search('token', token)
+    if not session:
         raise AccessError(description='Invalid Token!')
 
     #when user tries to leave a channel that doesn't exist
@@ -206,7 +215,7 @@ def channel_leave(token, channel_id):
     if (data.channels_search('channel_id', channel_id) == {}):
         raise InputError(description='This Channel Doesn\'t Exist!')
     
-    u_id = data.session_search('token', token)['u_id']
+    u_id = session['u_id']
     
     #when user tries to leave a channel that they arent in
     #AccessError
@@ -387,3 +396,108 @@ def channel_removeowner(token, channel_id, u_id):
 
     return {
     }
+
+def channel_messages_from(u_id, channel_id, before_message_id, after_message_id):
+    '''
+    Return the page of messages next to a message of the channel, for
+    channel_messages.
+
+    Args:
+        u_id(int): u_id of the user retrieving the messages.
+        channel_id(int): channel_id of the channel.
+        before_message_id(int): Load the messages older than this message, or None.
+        after_message_id(int): Load the messages newer than this message, or None.
+
+    Return:
+        {messages, before_message_id, after_message_id}
+
+    Raises:
+        InputError: Both or neither message is given, or it is not in the channel.
+        A message removed from the channel is still accepted while its place is
+        kept, which is for the last data.REMOVED_KEPT removals since the server
+        started.
+    '''
+
+    if (before_message_id is None) == (after_message_id is None):
+        raise InputError(description='Give One Of before_message_id And after_message_id!')
+    anchor = before_message_id if after_message_id is None else after_message_id
+    location = data.message_location(anchor)
+    if location is not None and location[0] == channel_id:
+        (older_than, newer_than) = (location[1], location[1])
+    else:
+        # a message removed since the last page keeps its place, so paging
+        # can go on from it
+        position = data.removed_position(channel_id, anchor)
+        if position is None:
+            raise InputError(description='Invalid Message Id!')
+        (older_than, newer_than) = (position, position - 1)
+
+    if after_message_id is None:
+        (return_messages, older) = data.messages_before(channel_id, older_than, 50)
+    else:
+        (return_messages, _) = data.messages_after(channel_id, newer_than, 50)
+        older = True
+
+    result = {
+        'messages': data.message_views(u_id, return_messages),
+        'before_message_id': return_messages[-1]['message_id'] if return_messages else anchor,
+        'after_message_id': return_messages[0]['message_id'] if return_messages else anchor,
+    }
+    if not older:
+        result['before_message_id'] = -1
+    return result
+
+def channel_messages_updates(token, channel_id, cursor):
+    '''
+    Given a Channel with ID channel_id that the authorised user is part of,
+    return the messages that were added, edited, pinned, reacted to or removed
+    since "cursor", and the cursor to ask from next time. Used by the
+    /channel/messages/poll long poll, which waits for there to be some.
+
+    Args:
+        token(str): token of the user polling the channel.
+        channel_id(int): channel_id of the channel.
+        cursor(str): cursor returned by the last call, '' on the first.
+
+    Return:
+        {cursor, reset, messages, removed}: messages is the changed messages
+        as channel_messages returns them, oldest change first, and removed the
+        message_ids of removed messages. If reset is True the changes since
+        cursor are not known (on the first call, or a cursor too old) and the
+        channel should be loaded again with channel_messages.
+
+    Raises:
+        AccessError: Token is invalid or user is not a member of the channel.
+        InputError: An invalid channel_id is provided.
+    '''
+
+    session = data.session_search('token', token)
+    if not session:
+        raise AccessError(description='Invalid Token!')
+    if (data.channels_search('channel_id', channel_id) == {}):
+        raise InputError(description='This Channel Doesn\'t Exist!')
+    u_id = session['u_id']
+    if not (data.is_member(u_id, channel_id)):
+        raise AccessError(description='You Cannot Access This Channel!')
+
+    (message_ids, cursor) = updates.updates_since(channel_id, cursor)
+    result = {
+        'cursor': cursor,
+        'reset': message_ids is None,
+        'messages': [],
+        'removed': [],
+    }
+    # a message changed several times is returned once, at its last change
+    seen = set()
+    for message_id in reversed(message_ids or []):
+        if message_id in seen:
+            continue
+        seen.add(message_id)
+        found = data.message_search(message_id)
+        if not found or found[0]['channel_id'] != channel_id:
+            result['removed'].append(message_id)
+        else:
+            result['messages'].append(data.message_view(u_id, found[1]))
+    result['messages'].reverse()
+    result['removed'].reverse()
+    return result
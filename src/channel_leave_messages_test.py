@@ -4,6 +4,8 @@ import channel
 import channels
 import auth
 import error
+import message
+import data
 import other
 
 
@@ -186,3 +188,95 @@ def test_messages_not_member():
 
     with pytest.raises(error.AccessError):
         channel.channel_messages(user1['token'], channel_id, 0)
+
+def test_messages_before_after():
+    # scroll back by message_id, sends and removals in between do not shift
+    # the pages
+    user0, _, channel_id = initialise_messages()
+    m_ids = [message.message_send(user0['token'], channel_id, str(i))['message_id'] for i in range(120)]
+
+    page = channel.channel_messages(user0['token'], channel_id, 0)
+    assert [m['message_id'] for m in page['messages']] == m_ids[:69:-1]
+    message.message_send(user0['token'], channel_id, 'new')
+    message.message_remove(user0['token'], m_ids[60])
+
+    page = channel.channel_messages(user0['token'], channel_id, 0, before_message_id=m_ids[70])
+    assert [m['message_id'] for m in page['messages']] == m_ids[69:60:-1] + m_ids[59:18:-1]
+    assert page['before_message_id'] == m_ids[19]
+    assert page['after_message_id'] == m_ids[69]
+    page = channel.channel_messages(user0['token'], channel_id, 0, before_message_id=page['before_message_id'])
+    assert [m['message_id'] for m in page['messages']] == m_ids[18::-1]
+    assert page['before_message_id'] == -1
+
+    page = channel.channel_messages(user0['token'], channel_id, 0, after_message_id=m_ids[50])
+    assert [m['message_id'] for m in page['messages']] == m_ids[101:60:-1] + m_ids[59:50:-1]
+    assert page['after_message_id'] == m_ids[101]
+    page = channel.channel_messages(user0['token'], channel_id, 0, after_message_id=page['after_message_id'])
+    assert [m['message'] for m in page['messages']][0] == 'new'
+    assert len(page['messages']) == 19
+    last = page['after_message_id']
+    page = channel.channel_messages(user0['token'], channel_id, 0, after_message_id=last)
+    assert page['messages'] == []
+    assert page['after_message_id'] == last
+
+def test_messages_before_after_invalid():
+    # raise an InputError if the message is not in the channel, or both or
+    # neither of the message_ids are given
+    user0, _, channel_id = initialise_messages()
+    other_id = channels.channels_create(user0['token'], "other channel", True)['channel_id']
+    m_id = message.message_send(user0['token'], channel_id, 'message')['message_id']
+    other_m_id = message.message_send(user0['token'], other_id, 'message')['message_id']
+
+    with pytest.raises(error.InputError):
+        channel.channel_messages(user0['token'], channel_id, 0, before_message_id=other_m_id)
+    with pytest.raises(error.InputError):
+        channel.channel_messages(user0['token'], channel_id, 0, after_message_id=-5)
+    with pytest.raises(error.InputError):
+        channel.channel_messages(user0['token'], channel_id, 0, m_id, m_id)
+
+def test_messages_before_after_removed(monkeypatch):
+    # the message a page ended at can be removed before the next page is
+    # asked for, also once the channel's log is compacted
+    monkeypatch.setattr(data, 'COMPACT_MIN', 4)
+    user0, _, channel_id = initialise_messages()
+    m_ids = [message.message_send(user0['token'], channel_id, str(i))['message_id'] for i in range(120)]
+
+    page = channel.channel_messages(user0['token'], channel_id, 0, before_message_id=m_ids[70])
+    assert page['before_message_id'] == m_ids[20]
+    message.message_remove(user0['token'], m_ids[20])
+    page = channel.channel_messages(user0['token'], channel_id, 0, before_message_id=m_ids[20])
+    assert [m['message_id'] for m in page['messages']] == m_ids[19::-1]
+    assert page['before_message_id'] == -1
+
+    message.message_remove(user0['token'], m_ids[100])
+    page = channel.channel_messages(user0['token'], channel_id, 0, after_message_id=m_ids[100])
+    assert [m['message_id'] for m in page['messages']] == m_ids[119:100:-1]
+
+    # removing most of the channel compacts its log
+    for m_id in m_ids[30:90]:
+        message.message_remove(user0['token'], m_id)
+    assert len(data.channels[channel_id]['messages']) < 120
+    page = channel.channel_messages(user0['token'], channel_id, 0, before_message_id=m_ids[20])
+    assert [m['message_id'] for m in page['messages']] == m_ids[19::-1]
+    page = channel.channel_messages(user0['token'], channel_id, 0, after_message_id=m_ids[20])
+    assert [m['message_id'] for m in page['messages']] == m_ids[119:100:-1] + m_ids[99:89:-1] + m_ids[29:20:-1]
+    page = channel.channel_messages(user0['token'], channel_id, 0, before_message_id=m_ids[60])
+    assert [m['message_id'] for m in page['messages']] == m_ids[29:20:-1] + m_ids[19::-1]
+    page = channel.channel_messages(user0['token'], channel_id, 0, after_message_id=m_ids[100])
+    assert [m['message_id'] for m in page['messages']] == m_ids[119:100:-1]
+
+def test_messages_before_after_removed_forgotten(monkeypatch):
+    # only the places of the latest removals are kept
+    monkeypatch.setattr(data, 'REMOVED_KEPT', 2)
+    user0, _, channel_id = initialise_messages()
+    m_ids = [message.message_send(user0['token'], channel_id, str(i))['message_id'] for i in range(10)]
+    for m_id in m_ids[2:5]:
+        message.message_remove(user0['token'], m_id)
+    assert len(data.message_removed[channel_id]) == 2
+
+    with pytest.raises(error.InputError):
+        channel.channel_messages(user0['token'], channel_id, 0, before_message_id=m_ids[2])
+    page = channel.channel_messages(user0['token'], channel_id, 0, before_message_id=m_ids[4])
+    assert [m['message_id'] for m in page['messages']] == m_ids[1::-1]
+    page = channel.channel_messages(user0['token'], channel_id, 0, after_message_id=m_ids[3])
+    assert [m['message_id'] for m in page['messages']] == m_ids[9:4:-1]
@@ -0,0 +1,57 @@
+import pytest
+import requests
+import threading
+from time import time
+from error import AccessError, InputError
+from server_test_fixtures import url, register_users, create_channels
+
+'''File for testing the http wrapping for channel_messages_updates'''
+
+def poll(url, token, c_id, cursor, timeout=None):
+    params = {'token': token, 'channel_id': c_id, 'cursor': cursor}
+    if timeout is not None:
+        params['timeout'] = timeout
+    return requests.get(f"{url}/channel/messages/poll", params=params)
+
+def test_poll_errors(url, register_users):
+    ''' Invalid tokens, channels and non members are refused'''
+    (user1, user2, _) = register_users
+    c_id = requests.post(f'{url}/channels/create', json={
+        'token': user1['token'],
+        'name': "generic Channel",
+        'is_public': True,
+        }).json()['channel_id']
+
+    assert poll(url, 'invalidtoken', c_id, '').status_code == AccessError.code
+    assert poll(url, user1['token'], -42, '').status_code == InputError.code
+    assert poll(url, user2['token'], c_id, '').status_code == AccessError.code
+
+def test_poll_wakes_on_send(url, register_users):
+    ''' A waiting poll returns a message as soon as it is sent'''
+    (user1, _, _) = register_users
+    c_id = requests.post(f'{url}/channels/create', json={
+        'token': user1['token'],
+        'name': "generic Channel",
+        'is_public': True,
+        }).json()['channel_id']
+
+    first = poll(url, user1['token'], c_id, '').json()
+    assert first['reset'] == True
+
+    def send():
+        requests.post(f"{url}/message/send", json={
+            'token': user1['token'],
+            'channel_id': c_id,
+            'message': 'hello',
+        })
+    timer = threading.Timer(0.5, send)
+    timer.start()
+    started = time()
+    changed = poll(url, user1['token'], c_id, first['cursor'], 10).json()
+    timer.join()
+    assert time() - started < 5
+    assert changed['reset'] == False
+    assert [m['message'] for m in changed['messages']] == ['hello']
+
+    unchanged = poll(url, user1['token'], c_id, changed['cursor'], 0.2).json()
+    assert unchanged['messages'] == [] and unchanged['cursor'] == changed['cursor']
@@ -189,4 +189,35 @@ def test_30_messages(url, register_users):
     assert len(messages.json()['messages']) == 30
 
 
+def test_before_message_id(url, register_users):
+    '''scroll back through 60 messages by message_id'''
+    (user1,_,_) = register_users
+
+    c_id = (requests.post(f'{url}/channels/create', json = {
+        'token': user1['token'],
+        'name': "generic Channel",
+        'is_public': True
+        }).json())['channel_id']
 
+    m_ids = []
+    for i in range(60):
+        m_ids.append(requests.post(f"{url}/message/send", json={
+            'token' : user1['token'],
+            'channel_id' : c_id,
+            'message' : str(i)
+        }).json()['message_id'])
+
+    messages = requests.get(f"{url}/channel/messages", params={'token': user1['token'],
+        'channel_id': c_id, 'before_message_id': m_ids[55]}).json()
+    assert [m['message_id'] for m in messages['messages']] == m_ids[54:4:-1]
+    assert messages['before_message_id'] == m_ids[5]
+
+    messages = requests.get(f"{url}/channel/messages", params={'token': user1['token'],
+        'channel_id': c_id, 'before_message_id': messages['before_message_id']}).json()
+    assert [m['message_id'] for m in messages['messages']] == m_ids[4::-1]
+    assert messages['before_message_id'] == -1
+
+    messages = requests.get(f"{url}/channel/messages", params={'token': user1['token'],
+        'channel_id': c_id, 'after_message_id': m_ids[55]}).json()
+    assert [m['message_id'] for m in messages['messages']] == m_ids[:55:-1]
+    assert messages['after_message_id'] == m_ids[59]
@@ -0,0 +1,90 @@
+import pytest
+import threading
+from time import time
+from error import InputError, AccessError
+from message import message_send, message_edit, message_remove, message_pin, message_react
+from channel import channel_messages_updates
+from channels import channels_create
+from auth import auth_register
+from other import clear
+import updates
+
+@pytest.fixture()
+def setup():
+    owner_token = auth_register('1email@something.com', '1password', '1first', '1last')['token']
+    normal_token = auth_register('2email@something.com', '2password', '2first', '2last')['token']
+    channel_id1 = channels_create(owner_token, 'channel1', True)['channel_id']
+    channel_id2 = channels_create(owner_token, 'channel2', True)['channel_id']
+    return (owner_token, normal_token, channel_id1, channel_id2)
+
+@pytest.fixture(autouse=True)
+def clear_only():
+    clear()
+
+def test_channel_messages_updates_errors(setup):
+    """ Test invalid token, channel and non members """
+    (owner_token, normal_token, channel_id1, _) = setup
+    with pytest.raises(AccessError):
+        channel_messages_updates('not_a_token', channel_id1, '')
+    with pytest.raises(InputError):
+        channel_messages_updates(owner_token, -42, '')
+    with pytest.raises(AccessError):
+        channel_messages_updates(normal_token, channel_id1, '')
+
+def test_channel_messages_updates_changes(setup):
+    """ Test sends, edits, pins, reacts and removals since a cursor """
+    (owner_token, _, channel_id1, channel_id2) = setup
+    first = channel_messages_updates(owner_token, channel_id1, '')
+    assert first['reset'] == True
+    assert first['messages'] == [] and first['removed'] == []
+
+    cursor = first['cursor']
+    assert channel_messages_updates(owner_token, channel_id1, cursor) == {
+        'cursor': cursor, 'reset': False, 'messages': [], 'removed': []}
+
+    m_id1 = message_send(owner_token, channel_id1, 'one')['message_id']
+    m_id2 = message_send(owner_token, channel_id1, 'two')['message_id']
+    message_send(owner_token, channel_id2, 'elsewhere')
+    message_edit(owner_token, m_id1, 'one edited')
+    changed = channel_messages_updates(owner_token, channel_id1, cursor)
+    assert changed['reset'] == False
+    assert [m['message'] for m in changed['messages']] == ['two', 'one edited']
+    assert changed['removed'] == []
+
+    cursor = changed['cursor']
+    message_pin(owner_token, m_id2)
+    message_react(owner_token, m_id2, 1)
+    message_remove(owner_token, m_id1)
+    changed = channel_messages_updates(owner_token, channel_id1, cursor)
+    assert [m['message_id'] for m in changed['messages']] == [m_id2]
+    assert changed['messages'][0]['is_pinned'] == True
+    assert changed['messages'][0]['reacts'][0]['u_ids'] == [1]
+    assert changed['removed'] == [m_id1]
+
+def test_channel_messages_updates_clear(setup):
+    """ Test a cursor from before a clear asks for the channel to be loaded again """
+    (owner_token, _, channel_id1, _) = setup
+    cursor = channel_messages_updates(owner_token, channel_id1, '')['cursor']
+    clear()
+    owner_token = auth_register('1email@something.com', '1password', '1first', '1last')['token']
+    channel_id1 = channels_create(owner_token, 'channel1', True)['channel_id']
+    assert channel_messages_updates(owner_token, channel_id1, cursor)['reset'] == True
+    assert channel_messages_updates(owner_token, channel_id1, 'not_a_cursor')['reset'] == True
+
+def test_channel_messages_updates_wait(setup):
+    """ Test a wait returns once another thread sends, and not before its time otherwise """
+    (owner_token, _, channel_id1, channel_id2) = setup
+    cursor = channel_messages_updates(owner_token, channel_id1, '')['cursor']
+    started = time()
+    updates.wait(channel_id1, cursor, 0.3)
+    assert time() - started >= 0.3
+
+    timer = threading.Timer(0.2, message_send, (owner_token, channel_id1, 'late'))
+    message_send(owner_token, channel_id2, 'elsewhere')
+    timer.start()
+    started = time()
+    updates.wait(channel_id1, cursor, 10)
+    timer.join()
+    assert time() - started < 5
+    changed = channel_messages_updates(owner_token, channel_id1, cursor)
+    assert [m['message'] for m in changed['messages']] == ['late']
@@ -50,7 +50,7 @@ def channels_listall(token):
     
     channels_list = []
 
-    for channel in data.channels:
+    for channel in data.channels.values():
         channels_list.append(data.make_channel(channel['channel_id']))
 
     return {'channels': channels_list}
@@ -2,6 +2,7 @@ import pytest
 from error import InputError, AccessError
 from auth import auth_register
 from channels import channels_create, channels_listall, channels_list
+from channel import channel_join, channel_leave
 from other import clear
 
 @pytest.fixture
@@ -49,3 +50,23 @@ def test_channels_list_empty_channel_list():
     token = auth_register('email@something.com', 'password', 'first', 'last')['token']
     assert channels_list(token) == {'channels':[]}
     
+
+def test_channels_list_join_and_leave(clist):
+    """ Test the list follows joining and leaving channels, in creation order """
+    (token1, token2, channel_id1, channel_id2, channel_id3) = clist
+    channel_join(token2, channel_id2)
+    channel_join(token2, channel_id1)
+    assert channels_list(token2) == {'channels': [
+        {'channel_id': channel_id1, 'name': 'channel1'},
+        {'channel_id': channel_id2, 'name': 'channel2'},
+        {'channel_id': channel_id3, 'name': 'channel3'},
+    ]}
+    channel_leave(token2, channel_id2)
+    channel_leave(token1, channel_id1)
+    assert channels_list(token1) == {'channels': [
+        {'channel_id': channel_id2, 'name': 'channel2'},
+    ]}
+    assert channels_list(token2) == {'channels': [
+        {'channel_id': channel_id1, 'name': 'channel1'},
+        {'channel_id': channel_id3, 'name': 'channel3'},
+    ]}
@@ -17,25 +17,25 @@ users = [
     },
 ]
 
-# List containing active tokens.
-sessions = [
-    {
+# Active sessions keyed by token (saved to the database as a list).
+sessions = {
+    '123456': {
         'token': '123456',
         'u_id': 12
     },
-]
+}
 
-# List containing channels info.
-channels = [
-    {
+# Channels info keyed by channel_id (saved to the database as a list).
+channels = {
+    1: {
         'channel_id': 1,
         'name': 'channel1',
         'owner_members': [],
         'all_members': [],
-        'messages': [],
+        'messages': [], # oldest first, removed messages are left as None
         'is_public': True,
     },
-]
+}
 
 # Messages list structure
 messages = [
@@ -44,28 +44,37 @@ messages = [
         'u_id': u_id,
         'message': message,
         'time_created': time,
-        'reacts': [],
+        'reacts': {},
         'is_pinned': False,
     },
 ]
 
-# Reacts list structure
-reacts = [
-    {
-        'react_id': 0,
-        'u_ids': [list of u_id],
-        'is_user_reacted' : False
+# Reacts structure, react_id -> set of the u_ids that reacted, kept in the
+# database as {"react_id": [list of u_id]}
+reacts = {
+    react_id: {u_id},
+}
+
+# Scheduled messages, keyed by message_id (saved to the database as a list)
+scheduled = {
+    message_id: {
+        'message_id': message_id,
+        'u_id': u_id,
+        'channel_id': channel_id,
+        'message': message,
+        'time_sent': time_sent,
     },
-]
+}
 
-# Standups list structure
-standups = [
-    {
-        'c_id': 0,
+# Standups structure, keyed by channel_id
+standups = {
+    channel_id: {
+        'channel_id': channel_id,
+        'u_id': u_id, # user who started the standup and sends its summary
         'time_finish': time_finish,
-        'msg_buffer': [(handle, message)], 
+        'msg_buffer': [(handle, message)],
     },
-]
+}
 
 # List containing email address waiting to reset password
 reset_list = [
@@ -77,31 +86,173 @@ reset_list = [
 """
 
 import json
+import os
+from bisect import bisect_left, bisect_right, insort
+from functools import wraps
+from heapq import merge
+from itertools import islice
 from json import dumps
-from threading import Lock
+from threading import Lock, RLock, local
+from rwlock import ReadWriteLock
+from ids import IdAllocator
+import ids
+from uuid import uuid4
 
 #-------------------------------statistic of how many users registered------------------------------
+# highest u_id and next channel_id in the data
 u_id_stat = 0
 channel_id_stat = 0
+# hand out the ids of new users, channels and messages, see ids.py
+u_ids = IdAllocator('u_id', 1)
+channel_ids = IdAllocator('channel_id', 0)
+message_ids = IdAllocator('message_id', 1)
 
 #----------------------------------------------host url---------------------------------------------
 url = ""
 
 #----------------------------------------------database----------------------------------------------
 users = []
-sessions = []
-channels = []
+# lookup tables for users, one per unique field, each mapping value -> account
+account_index = {
+    'u_id': {},
+    'email': {},
+    'handle_str': {},
+}
+sessions = {}
+# active sessions keyed by u_id, a user has at most one session at a time
+session_u_ids = {}
+channels = {}
+# channels each user is a member/owner of, mapping u_id -> set of channel_ids
+channel_index = {
+    'all_members': {},
+    'owner_members': {},
+}
+# u_ids of each channel's members/owners, mapping channel_id -> {key: set of u_ids}
+channel_members = {}
 react_ids = [1] # a list of react_id's 
 
 #----------------------------------------------reset_code---------------------------------------------
 reset_list = []
 
 #----------------------------------------------standup data------------------------------------------
-standups = []
-s_lock = Lock()
+# running standups, mapping channel_id -> standup
+standups = {}
+# lock of each running standup's buffer, mapping channel_id -> Lock
+standup_locks = {}
 
 #----------------------------------------------message data------------------------------------------
+# highest message_id in the data
 message_id_stat = 0
+# every message in every channel, mapping message_id -> (channel_id, position in log)
+message_index = {}
+# positions of removed messages in each channel's log, mapping channel_id -> sorted list
+message_tombstones = {}
+# where removed messages were in each channel's log, mapping channel_id ->
+# {message_id: position}, so a page can still be asked for next to one: the
+# older messages are before the position and the newer ones from it on.
+# Only the last REMOVED_KEPT removals of a channel are kept, and only in
+# memory, so a page next to an older one or one removed before a restart
+# can not be asked for.
+message_removed = {}
+REMOVED_KEPT = 256
+# a channel's log is compacted once this share of it is removed messages
+COMPACT_RATIO = 0.25
+COMPACT_MIN = 64
+# function called with a message_id missing from message_index, to read it
+# from disk when channels only keep part of their messages in memory
+message_loader = None
+
+#----------------------------------------------scheduled messages-------------------------------------
+# messages waiting for their time_sent, mapping message_id -> scheduled message
+scheduled = {}
+
+#----------------------------------------------search index-------------------------------------------
+# trigram -> {channel_id: sorted list of message_ids of the channel containing the trigram}
+trigram_index = {}
+# channel_id -> trigrams used in the channel
+channel_trigrams = {}
+# channels whose messages are in the index, a channel loaded from disk is
+# indexed by the first search of it
+trigram_indexed = set()
+# held while indexing channels, as searches only hold the read side
+index_lock = Lock()
+# function called with a channel_id to return {trigram: message_ids} of its
+# messages without reading them in, when channels only keep part of their
+# messages in memory
+trigram_loader = None
+
+#----------------------------------------------journal------------------------------------------------
+# 'journal' appends a record per mutation to <database>.journal and only writes
+# a full snapshot every JOURNAL_CHECKPOINT records, 'snapshot' saves everything
+# on every commit, 'sqlite' writes the changed rows to <database>.sqlite3,
+# 'sharded' keeps a core file and per channel message segments in <database>.shards
+persistence_mode = 'journal'
+JOURNAL_CHECKPOINT = 1000
+
+# number of the last mutation recorded, the snapshot stores the one it includes
+journal_seq = 0
+# every snapshot gets a new epoch, a journal record only extends the snapshot
+# of its own epoch
+journal_epoch = None
+# records not yet written to the journal file
+journal_pending = []
+# records written to the journal file since the last snapshot
+journal_length = 0
+# mutating functions that can be replayed, by name
+journal_ops = {}
+# functions called with (name, args, result) after every recorded mutation
+journal_listeners = []
+# functions called with (channel_id, message_id) after a message is added,
+# edited, removed, pinned or reacted to, and with (None, None) after a clear.
+# Unlike journal_listeners they are also called for replayed changes.
+message_listeners = []
+# how deep the current thread is in journaled calls, only the outermost is recorded
+journal_state = local()
+journal_replaying = False
+# guards journal_seq and journal_pending for the changes made without the
+# write side of the data lock, see standup_message_add
+journal_lock = Lock()
+# the write side is held by every journaled call, so a commit sees no half
+# finished mutation. The server holds the read side for the whole of a request
+# that only reads and the write side for one that changes the data, so reads
+# run in parallel and a change never acts on what it checked being stale.
+data_lock = ReadWriteLock()
+read_lock = data_lock.read
+write_lock = data_lock.write
+# held while writing to disk, so commits reach the files in order
+commit_lock = RLock()
+
+def journaled(function):
+    '''
+    Record every call of a mutating function in the journal, so loading the
+    database can replay it. Calls made from inside another journaled function
+    are part of that function's record.
+    '''
+
+    journal_ops[function.__name__] = function
+
+    @wraps(function)
+    def wrapper(*args):
+        with write_lock:
+            depth = getattr(journal_state, 'depth', 0)
+            journal_state.depth = depth + 1
+            try:
+                result = function(*args)
+            finally:
+                journal_state.depth = depth
+            if depth == 0 and not journal_replaying:
+                record(function.__name__, args, result)
+        return result
+    return wrapper
+
+def record(name, args, result):
+    ''' Add a change to the journal and tell the journal listeners about it. '''
+    global journal_seq
+    with journal_lock:
+        journal_seq += 1
+        journal_pending.append(dumps([journal_epoch, journal_seq, name, list(args)]))
+    for listener in journal_listeners:
+        listener(name, args, result)
 
 #-------------------------------------method of handling user data------------------------------------
 def account_search(key, value):
@@ -112,11 +263,31 @@ def account_search(key, value):
     '''
 
     global users
-    account = {}
+    if key in account_index:
+        return account_index[key].get(value)
+
     for account in users:
         if account[key] == value:
             return account
 
+def index_account(account):
+    '''
+    Add an account to the lookup tables. If a value is already taken by
+    another account the first account keeps it, same as a linear search would.
+    Args: account
+    '''
+    for key, index in account_index.items():
+        index.setdefault(account[key], account)
+
+def unindex_account(account, key):
+    '''
+    Remove an account's current value of key from the lookup table.
+    Args: account and indexed key
+    '''
+    index = account_index[key]
+    if index.get(account[key]) is account:
+        del index[account[key]]
+
 def is_global_owner(u_id):
     '''
     Given u_id return if it's a global owner of flockr.
@@ -130,6 +301,7 @@ def is_global_owner(u_id):
     else:
         return False
 
+@journaled
 def set_global_permissions(u_id, permission_id):
     ''' Given the user's u_id and new permission_id, reset their permissions. '''
 
@@ -140,25 +312,30 @@ def set_global_permissions(u_id, permission_id):
     else:
         account['is_global_owner'] = False
 
+@journaled
 def new_account(account):
     '''
-    Creates a new account, increments u_id_stat and returns new u_id_stat.
+    Creates a new account, giving it the next u_id unless it has one already
+    (as when the journal is replayed).
     Args: account
-    Return: u_id_stat after increment
+    Return: u_id of the account
     '''
 
     global u_id_stat
     global users
-    u_id_stat += 1
-    account['u_id'] = u_id_stat
+    if 'u_id' not in account:
+        account['u_id'] = u_ids.take()
+    u_id_stat = max(u_id_stat, account['u_id'])
     # check if this is the first user who register
-    if u_id_stat == 1:
+    if not users:
         account['is_global_owner'] = True
     else:
         account['is_global_owner'] = False
     users.append(account)
-    return u_id_stat
+    index_account(account)
+    return account['u_id']
 
+@journaled
 def update_account(u_id, key, value):
     '''
     Update certain piece of info of user profile
@@ -166,9 +343,15 @@ def update_account(u_id, key, value):
     '''
     global users
     account = account_search("u_id", u_id)
-    account[key] = value
+    if key in account_index:
+        unindex_account(account, key)
+        account[key] = value
+        account_index[key].setdefault(value, account)
+    else:
+        account[key] = value
     user_info_sync(u_id, key, value)
 
+@journaled
 def reset_list_add(email, code):    # pragma: no cover
     '''
     add a new member to reset list
@@ -187,6 +370,7 @@ def reset_list_add(email, code):    # pragma: no cover
         return code
 
 
+@journaled
 def reset_list_remove(code):    # pragma: no cover
     '''
     remove a member from reset list
@@ -227,7 +411,7 @@ def img_url_update():    # pragma: no cover
         # recombine with different host
         user['profile_img_url'] = url + url_frac[3] + "/" + url_frac[4]
     
-    for channel in channels:
+    for channel in channels.values():
         for all_member in channel["all_members"]:
             all_member["profile_img_url"] = account_search("u_id", all_member["u_id"])["profile_img_url"]
         for owner_member in channel["owner_members"]:
@@ -253,6 +437,7 @@ def user_info_sync(u_id, key, value):   # pragma: no cover
             if member["u_id"] == u_id:
                 member[key] = value
 
+@journaled
 def add_img_url(u_id, host_url):     # pragma: no cover
     '''
     Add local host to the profile_img_url.
@@ -268,26 +453,36 @@ def session_search(key, value):
     Return: session
     '''
     global sessions
-    session = {}
-    for session in sessions:
+    if key == 'token':
+        return sessions.get(value)
+    if key == 'u_id':
+        return session_u_ids.get(value)
+
+    for session in sessions.values():
         if session[key] == value:
             return session
 
+@journaled
 def new_session(session):
     '''
     Add a new session to database
     Args: session
     '''
     global sessions
-    sessions.append(session)
+    sessions[session['token']] = session
+    session_u_ids[session['u_id']] = session
 
+@journaled
 def delete_session(session):
     '''
     Delete a session from database
     Args: session
     '''
     global sessions
-    sessions.remove(session)
+    # a replayed session is a copy, the one stored is found by its token
+    stored = sessions.pop(session['token'])
+    if session_u_ids.get(stored['u_id']) is stored:
+        del session_u_ids[stored['u_id']]
 
 def make_user(u_id):
     ''' Returns user given u_id. '''
@@ -345,39 +540,88 @@ def make_channel(channel_id):
     return channel
 
 def new_channel(channel_name, u_id, is_public):
-    ''' Add new channel and returns channel_id. '''
+    ''' Add new channel with the next channel_id and returns channel_id. '''
+    return add_channel(channel_name, u_id, is_public, channel_ids.take())
+
+@journaled
+def add_channel(channel_name, u_id, is_public, channel_id):
+    ''' Add new channel with channel_id and returns channel_id. '''
     global channels
     global channel_id_stat
     member = make_member(u_id)
-    channel_id = channel_id_stat
-    channel_id_stat += 1
-    channels.append(
-        {
+    channel_id_stat = max(channel_id_stat, channel_id + 1)
+    channels[channel_id] = {
         'channel_id': channel_id,
         'name': channel_name,
         'owner_members': [member],
         'all_members': [member],
         'messages': [],
         'is_public': is_public,
-        }
-    )
+    }
+    index_member(channel_id, 'all_members', u_id)
+    index_member(channel_id, 'owner_members', u_id)
+    # a new channel has no messages to index
+    trigram_indexed.add(channel_id)
     return channel_id
 
+# journals written before channel ids came from channel_ids record new_channel
+journal_ops['new_channel'] = lambda channel_name, u_id, is_public: \
+    add_channel(channel_name, u_id, is_public, channel_id_stat)
+
+def index_member(channel_id, key, u_id):
+    ''' Record that u_id is one of the key (all_members/owner_members) of a channel. '''
+    channel_index[key].setdefault(u_id, set()).add(channel_id)
+    members = channel_members.setdefault(channel_id, {'all_members': set(), 'owner_members': set()})
+    members[key].add(u_id)
+
+def unindex_member(channel_id, key, u_id):
+    ''' Forget that u_id is one of the key (all_members/owner_members) of a channel. '''
+    channel_ids = channel_index[key].get(u_id)
+    if channel_ids:
+        channel_ids.discard(channel_id)
+        if not channel_ids:
+            del channel_index[key][u_id]
+    if channel_id in channel_members:
+        channel_members[channel_id][key].discard(u_id)
+
 def delete_channel(channel):
     ''' Delete a channel. '''
-    global channels 
-    channels.remove(channel)
+    delete_channel_id(channel['channel_id'])
 
+@journaled
+def delete_channel_id(channel_id):
+    ''' Delete the channel with channel_id. '''
+    global channels 
+    channel = channels.pop(channel_id)
+    for message in resident_messages(channel):
+        del message_index[message['message_id']]
+    for trigram in channel_trigrams.pop(channel_id, ()):
+        del trigram_index[trigram][channel_id]
+        if not trigram_index[trigram]:
+            del trigram_index[trigram]
+    trigram_indexed.discard(channel_id)
+    message_tombstones.pop(channel['channel_id'], None)
+    message_removed.pop(channel['channel_id'], None)
+    for key in ['all_members', 'owner_members']:
+        for member in channel[key]:
+            unindex_member(channel['channel_id'], key, member['u_id'])
+    channel_members.pop(channel['channel_id'], None)
+
+@journaled
 def add_member(channel_id, member):
     ''' Add member to channel. '''
     global channels
     channels_search('channel_id', channel_id)['all_members'].append(member)
+    index_member(channel_id, 'all_members', member['u_id'])
 
+@journaled
 def promote_owner(channel_id, member):
     ''' Promote an existing member to owner of channel. '''
     global channels
     channels_search('channel_id', channel_id)['owner_members'].append(member)
+    index_member(channel_id, 'owner_members', member['u_id'])
 
+@journaled
 def remove_member(channel_id, u_id):
     ''' Remove a member from the channel. '''
     global channels
@@ -386,23 +630,24 @@ def remove_member(channel_id, u_id):
     # search for this member (could as well be an owner)
     for member in channel["all_members"]:
         if member['u_id'] == u_id:
-
-            # if the member is an owner, delete ownership as well
-            if member in channel["owner_members"]:
-                channel["owner_members"].remove(member)
             channel["all_members"].remove(member)
+            unindex_member(channel_id, 'all_members', u_id)
+            break
+
+    # if the member is an owner, delete ownership as well
+    remove_ownership(channel_id, u_id)
     
     # if there's no more owner
     if channel["owner_members"] == []:
-        next_member = channel["all_members"][0]
         # if there's no member left, delete the whole channel
-        if not next_member:
-            channels.remove(channel)
+        if channel["all_members"] == []:
+            delete_channel(channel)
         
         # if there's member left, make this dude new owner
         else:
-            channel["owner_members"].append(next_member)
+            promote_owner(channel_id, channel["all_members"][0])
  
+@journaled
 def remove_ownership(channel_id, u_id):
     ''' Remove an owner from the channel. '''
     global channels
@@ -410,8 +655,10 @@ def remove_ownership(channel_id, u_id):
     for member in channel["owner_members"]:
         if member['u_id'] == u_id:
             channel["owner_members"].remove(member)
+            unindex_member(channel_id, 'owner_members', u_id)
+            break
+
 
- 
 def channels_search(key, value):
     '''
     If key is channel_id return the single channel with matching channel_id or {}.
@@ -422,38 +669,23 @@ def channels_search(key, value):
     
     global channels
     if key in ['owner_members', 'all_members']:
-        result = []
-        for channel in channels:
-            for member in channel[key]:
-                if member['u_id'] == value:
-                    result.append(channel)
-                    break
-        return result
+        # channel ids are handed out in order, so this keeps creation order
+        channel_ids = sorted(channel_index[key].get(value, ()))
+        return [channels[channel_id] for channel_id in channel_ids]
             
     elif key == 'channel_id':
-        for channel in channels:
-            if channel[key] == value:
-                return channel
+        return channels.get(value, {})
     return {}
 
 def is_member(u_id, channel_id):
     ''' Check if given token belongs to one of this channel's members. '''
-    global channels
-    channel = channels_search('channel_id', channel_id)    
-    for member in channel['all_members']:
-        if member['u_id'] == u_id:
-            return True 
-    
-    return False
+    members = channel_members.get(channel_id)
+    return bool(members) and u_id in members['all_members']
     
 def is_owner(u_id, channel_id):
     ''' Check if given token belongs to one of this channel's owners. '''
-    global channels
-    channel = channels_search('channel_id', channel_id)
-    for member in channel['owner_members']:
-        if member['u_id'] == u_id:
-            return True 
-    return False
+    members = channel_members.get(channel_id)
+    return bool(members) and u_id in members['owner_members']
 
 def is_channel_public(channel_id):
     ''' Check whether or not a channel is public given the channel_id. '''
@@ -465,6 +697,7 @@ def is_channel_public(channel_id):
     
 #------------------------------methods for handling messages data---------------------------------
 
+@journaled
 def add_message(message_id,u_id,message,time,channel_id):
     '''
     Adds a message with "message_id" to a channel with "channel_id" by a user with "u_id" 
@@ -477,16 +710,24 @@ def add_message(message_id,u_id,message,time,channel_id):
         'u_id': u_id,
         'message': message,
         'time_created': time,
-        'reacts': [],
+        'reacts': {},
         'is_pinned': False,
     }
 
-    channel = channels_search('channel_id', channel_id)
-    #insert the latest message at the beggining of the list
-    channel['messages'].insert(0, message_insert)
-    #increment the number of messages in the server.
-    message_id_stat += 1
+    append_message(channel_id, message_insert)
+    message_id_stat = max(message_id_stat, message_id)
 
+def post_message(u_id, message, time, channel_id):
+    '''
+    Give a message the next message_id and add it to a channel.
+    Return: message_id of the new message
+    '''
+
+    message_id = message_ids.take()
+    add_message(message_id, u_id, message, time, channel_id)
+    return message_id
+
+@journaled
 def add_later(message_id, u_id, message, time, channel_id):
     '''
     Add a message with the given time. 
@@ -497,24 +738,203 @@ def add_later(message_id, u_id, message, time, channel_id):
         'u_id': u_id,
         'message': message,
         'time_created': time,
-        'reacts': [],
+        'reacts': {},
         'is_pinned': False,
     }
 
-    channel = channels_search('channel_id', channel_id)
+    scheduled.pop(message_id, None)
     # if the channel has been deleted, dont add the message
-    if channel == {}:
+    if channel_id not in channels:
         return
-    #insert the latest message at the beggining of the list
-    channel['messages'].insert(0, message_insert)
+    append_message(channel_id, message_insert)
+
+@journaled
+def schedule_message(message_id, u_id, message, time_sent, channel_id):
+    '''
+    Keep a message to be added with add_later once time_sent comes.
+    '''
+
+    global message_id_stat
+    message_id_stat = max(message_id_stat, message_id)
+    scheduled[message_id] = {
+        'message_id': message_id,
+        'u_id': u_id,
+        'channel_id': channel_id,
+        'message': message,
+        'time_sent': time_sent,
+    }
 
+@journaled
+def unschedule_message(message_id):
+    ''' Cancel a scheduled message before it is added. '''
+    del scheduled[message_id]
+
+def append_message(channel_id, message):
+    ''' Append a message to the end (newest) of a channel's log. '''
+    log = channels[channel_id]['messages']
+    log.append(message)
+    message_index[message['message_id']] = (channel_id, len(log) - 1)
+    if channel_id in trigram_indexed:
+        index_trigrams(channel_id, message)
+    message_changed(channel_id, message['message_id'])
+
+def message_changed(channel_id, message_id):
+    ''' Tell the message listeners about a change to a message. '''
+    for listener in message_listeners:
+        listener(channel_id, message_id)
+
+@journaled
 def remove_message(message_id):
     ''' Takes message_id and removes the message from the channel. '''
-    (channel, _) = message_search(message_id)
+    (channel_id, position) = message_index.pop(message_id)
+    log = channels[channel_id]['messages']
+    if channel_id in trigram_indexed:
+        unindex_trigrams(channel_id, log[position])
+    # leave a tombstone rather than shifting the rest of the log
+    log[position] = None
+    removed = message_tombstones.setdefault(channel_id, [])
+    insort(removed, position)
+    positions = message_removed.setdefault(channel_id, {})
+    positions[message_id] = position
+    # the oldest removal is forgotten first
+    if len(positions) > REMOVED_KEPT:
+        del positions[next(iter(positions))]
+    # a sharded log never moves its messages, positions name segments on disk
+    if (isinstance(log, list) and len(removed) > COMPACT_MIN
+            and len(removed) > COMPACT_RATIO * len(log)):
+        compact_messages(channel_id)
+    message_changed(channel_id, message_id)
+
+def compact_messages(channel_id):
+    ''' Drop the tombstones from a channel's log and reposition its messages. '''
+    channel = channels[channel_id]
+    channel['messages'] = list(iter_messages(channel))
+    for (position, message) in enumerate(channel['messages']):
+        message_index[message['message_id']] = (channel_id, position)
+    tombstones = message_tombstones.pop(channel_id, [])
+    removed = message_removed.get(channel_id, {})
+    for (message_id, position) in removed.items():
+        removed[message_id] = position - bisect_left(tombstones, position)
+
+def iter_messages(channel):
+    ''' Iterate over the messages of a channel, oldest first. '''
     for message in channel['messages']:
-        if (message['message_id'] == message_id):
-            channel['messages'].remove(message)
-            return
+        if message is not None:
+            yield message
+
+def resident_messages(channel):
+    ''' Iterate over the messages of a channel that are in memory. '''
+    log = channel['messages']
+    if isinstance(log, list):
+        return iter_messages(channel)
+    return log.loaded()
+
+def message_count(channel_id):
+    ''' Return the number of messages in a channel. '''
+    return len(channels[channel_id]['messages']) - len(message_tombstones.get(channel_id, []))
+
+def messages_page(channel_id, start, count):
+    '''
+    Return up to count messages of a channel, newest first, skipping the
+    start most recent ones.
+    '''
+    log = channels[channel_id]['messages']
+    removed = message_tombstones.get(channel_id, [])
+
+    # position of the message with start newer messages after it: step back
+    # over the tombstones between the guess and the end until it settles
+    position = len(log) - 1 - start
+    while True:
+        newer_removed = len(removed) - bisect_right(removed, position)
+        settled = len(log) - 1 - start - newer_removed
+        if settled == position:
+            break
+        position = settled
+
+    page = []
+    while position >= 0 and len(page) < count:
+        if log[position] is not None:
+            page.append(log[position])
+        position -= 1
+    return page
+
+def messages_before(channel_id, position, count):
+    '''
+    Return up to count messages of a channel older than the one at position,
+    newest first, and whether there are even older ones.
+    '''
+    log = channels[channel_id]['messages']
+    page = []
+    position -= 1
+    while position >= 0 and len(page) < count:
+        if log[position] is not None:
+            page.append(log[position])
+        position -= 1
+    removed = message_tombstones.get(channel_id, [])
+    older = position + 1 - bisect_right(removed, position)
+    return (page, older > 0)
+
+def messages_after(channel_id, position, count):
+    '''
+    Return up to count messages of a channel newer than the one at position,
+    the oldest of them first in the log, listed newest first, and whether
+    there are even newer ones.
+    '''
+    log = channels[channel_id]['messages']
+    page = []
+    position += 1
+    while position < len(log) and len(page) < count:
+        if log[position] is not None:
+            page.append(log[position])
+        position += 1
+    removed = message_tombstones.get(channel_id, [])
+    newer = len(log) - position - (len(removed) - bisect_left(removed, position))
+    page.reverse()
+    return (page, newer > 0)
+
+def message_location(message_id):
+    ''' Return (channel_id, position) of a message in its channel's log, or None. '''
+    # one lookup each time, a reader evicting a segment may drop the entry
+    location = message_index.get(message_id)
+    if location is None and message_loader is not None:
+        message_loader(message_id)
+        location = message_index.get(message_id)
+    return location
+
+def removed_position(channel_id, message_id):
+    ''' Return where a message removed from a channel was in its log, or None. '''
+    return message_removed.get(channel_id, {}).get(message_id)
+
+@journaled
+def edit_message(message_id, message):
+    ''' Replace the text of the message with message_id. '''
+    (channel, message_edited) = message_search(message_id)
+    indexed = channel['channel_id'] in trigram_indexed
+    if indexed:
+        unindex_trigrams(channel['channel_id'], message_edited)
+    message_edited['message'] = message
+    if indexed:
+        index_trigrams(channel['channel_id'], message_edited)
+    message_changed(channel['channel_id'], message_id)
+
+@journaled
+def set_pinned(message_id, is_pinned):
+    ''' Pin or unpin the message with message_id. '''
+    (channel, message) = message_search(message_id)
+    message['is_pinned'] = is_pinned
+    message_changed(channel['channel_id'], message_id)
+
+def replay_new_message_id():
+    '''
+    Take the next message_id the way journals written before message ids came
+    from message_ids recorded it. Not for new ids, which would not be reserved
+    in message_ids.
+    '''
+    global message_id_stat
+    message_id_stat += 1
+    return message_id_stat
+
+journal_ops['new_message_id'] = replay_new_message_id
 
 def message_search(message_id):
     '''
@@ -523,123 +943,258 @@ def message_search(message_id):
     If no message is found associated with message_id or no channels exist, returns None.
     '''
 
-    global channels
-    for channel in channels:
-        for message in channel['messages']:
-            if message['message_id'] == message_id:
-                return (channel, message)
+    location = message_location(message_id)
+    if location is None:
+        return None
+    (channel_id, position) = location
+    channel = channels[channel_id]
+    return (channel, channel['messages'][position])
 
-def set_message_react_status(u_id, return_messages):
-    '''reacts is List of dictionaries, where each dictionary contains 
-    types { react_id, u_ids, is_this_user_reacted } 
-    where react_id is the id of a react, 
-    and u_ids is a list of user id's of people who've reacted for that react.
-    is_this_user_reacted is whether or not the 
-    authorised user has been one of the reacts to this post
+def message_view(u_id, message):
+    '''
+    Return what the user with u_id sees of a message: a shallow copy whose
+    reacts carry is_this_user_reacted for that user. The stored message is
+    not changed, so readers never write to shared state.
+    Args: u_id of the viewer, stored message
+    Return: message with reacts { react_id, u_ids, is_this_user_reacted }
     '''
 
-    # rd = {'react_id' : 1,'uids' : [], 'is_this_user_reacted' : False}
-    
-    for m in return_messages:
-        if (not m['reacts'] == []):
-            for r in m['reacts']:
-                if u_id in r['u_ids']:
-                    r['is_this_user_reacted'] = True
-                else:
-                    r['is_this_user_reacted'] = False
-    
-    return return_messages
-    
+    view = dict(message)
+    view['reacts'] = [{
+        'react_id': react_id,
+        'u_ids': list(u_ids),
+        'is_this_user_reacted': u_id in u_ids,
+    } for (react_id, u_ids) in message['reacts'].items()]
+    return view
 
+def message_views(u_id, messages):
+    ''' Return the view of each message for the user with u_id, see message_view. '''
+    return [message_view(u_id, message) for message in messages]
+
+@journaled
 def message_react_to(u_id, message_id, react_id):
     '''
     React to a message given the message_id by adding the user given by user_id
-    to the list of users reacted. 
+    to the set of users reacted.
     '''
 
-    (_, m) = message_search(message_id)
-
-    reacts = m['reacts']
-    
-    # if there are no reacts for this message
-    if reacts == []:
-        react = {
-            'react_id' : react_id,
-            'u_ids' : [u_id],
-            'is_this_user_reacted' : False
-        }
-        reacts.append(react)
-        return {}
-    
-    # if there are reacts to this message
-    for r in reacts:
-        if react_id == r['react_id']:
-            r['u_ids'].append(u_id)
-            r['is_this_user_reacted'] = False
-            return{}
+    (channel, message) = message_search(message_id)
+    message['reacts'].setdefault(react_id, set()).add(u_id)
+    message_changed(channel['channel_id'], message_id)
+    return {}
 
+@journaled
 def message_unreact_to(u_id, message_id, react_id):
     '''
     Unreact a message given the message_id by removing the user given by user_id
-    from the list of users reacted. 
+    from the set of users reacted.
     '''
 
-    (_, message) = message_search(message_id)
+    (channel, message) = message_search(message_id)
+    message['reacts'][react_id].discard(u_id)
+    message_changed(channel['channel_id'], message_id)
+    return {}
+
+def load_reacts(saved):
+    '''
+    Return the reacts of a message as kept in memory.
+    Args: reacts as saved, {"react_id": [u_ids]} or, from older databases,
+    [{ react_id, u_ids }]
+    Return: {react_id: set of u_ids}
+    '''
 
-    for r in message['reacts']:
-        if react_id == r['react_id']:
-            r['u_ids'].remove(u_id)
-            r['is_this_user_reacted'] = False
-            return {}  
+    if isinstance(saved, list):
+        return {react['react_id']: set(react['u_ids']) for react in saved}
+    return {int(react_id): set(u_ids) for (react_id, u_ids) in saved.items()}
+
+def encode_set(value):
+    ''' Write the sets json can not, such as the u_ids of a react, as sorted lists. '''
+    if isinstance(value, set):
+        return sorted(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+#---------------------------------methods for searching messages----------------------------------
+def trigrams(text):
+    ''' Return the set of three character substrings of text. '''
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def index_trigrams(channel_id, message):
+    ''' Add a message to the posting lists of its trigrams. '''
+    message_id = message['message_id']
+    for trigram in trigrams(message['message']):
+        message_ids = trigram_index.setdefault(trigram, {}).setdefault(channel_id, [])
+        # ids mostly grow, so this is nearly always an append
+        if not posting_contains(message_ids, message_id):
+            insort(message_ids, message_id)
+        channel_trigrams.setdefault(channel_id, set()).add(trigram)
+
+def unindex_trigrams(channel_id, message):
+    ''' Remove a message from the posting lists of its trigrams. '''
+    for trigram in trigrams(message['message']):
+        postings = trigram_index[trigram]
+        message_ids = postings[channel_id]
+        i = bisect_left(message_ids, message['message_id'])
+        if i < len(message_ids) and message_ids[i] == message['message_id']:
+            del message_ids[i]
+        if not postings[channel_id]:
+            del postings[channel_id]
+            channel_trigrams[channel_id].discard(trigram)
+            if not postings:
+                del trigram_index[trigram]
+
+def posting_contains(message_ids, message_id):
+    ''' Return whether a sorted posting list holds message_id. '''
+    i = bisect_left(message_ids, message_id)
+    return i < len(message_ids) and message_ids[i] == message_id
+
+def posting_matches(lists, after, limit):
+    '''
+    Return the message_ids greater than after that are in every one of the
+    sorted posting lists, in order, and no more than limit of them.
+    '''
+    (shortest, *others) = sorted(lists, key=len)
+    found = []
+    for i in range(bisect_right(shortest, after), len(shortest)):
+        if len(found) == limit:
+            break
+        if all(posting_contains(message_ids, shortest[i]) for message_ids in others):
+            found.append(shortest[i])
+    return found
+
+def index_channels(channel_ids):
+    '''
+    Index the messages of the channels that are not indexed yet, after they
+    were loaded without the index. Channels that keep part of their messages
+    on disk are indexed through trigram_loader, without reading them in.
+    '''
+    # readers may race to index a channel, writers are kept out by the read side
+    with read_lock, index_lock:
+        for channel_id in channel_ids:
+            if channel_id in trigram_indexed:
+                continue
+            channel = channels[channel_id]
+            if trigram_loader is None or isinstance(channel['messages'], list):
+                for message in iter_messages(channel):
+                    index_trigrams(channel_id, message)
+            else:
+                for (trigram, message_ids) in trigram_loader(channel_id).items():
+                    trigram_index.setdefault(trigram, {})[channel_id] = sorted(message_ids)
+                    channel_trigrams.setdefault(channel_id, set()).add(trigram)
+            trigram_indexed.add(channel_id)
+
+def search_messages(channel_ids, query_str, after=-1, limit=None):
+    '''
+    Return the messages of the given channels containing query_str, in
+    message_id order. Candidates are the messages containing every trigram of
+    the query, only a query shorter than three characters scans the messages.
+    Only messages with a message_id greater than after are returned, and no
+    more than limit of them.
+    '''
+    if len(query_str) < 3:
+        found = [message for channel_id in channel_ids
+                 for message in iter_messages(channels[channel_id])
+                 if message['message_id'] > after and query_str in message['message']]
+        return sorted(found, key=lambda message: message['message_id'])[:limit]
+
+    index_channels(channel_ids)
+    query_trigrams = trigrams(query_str)
+    found = []
+    while limit is None or len(found) < limit:
+        # a page only needs the first few candidates past after of each
+        # channel, the smallest of them are the candidates of the page
+        wanted = None if limit is None else limit - len(found)
+        with read_lock:
+            postings = [trigram_index.get(trigram, {}) for trigram in query_trigrams]
+            matches = [posting_matches([posting.get(channel_id, []) for posting in postings], after, wanted)
+                       for channel_id in channel_ids]
+            candidates = list(islice(merge(*matches), wanted))
+
+        for message_id in candidates:
+            result = message_search(message_id)
+            if result is not None and query_str in result[1]['message']:
+                found.append(result[1])
+        # candidates whose text does not match leave the page short, and the
+        # next candidates are past the last one checked
+        if wanted is None or len(candidates) < wanted:
+            break
+        after = candidates[-1]
+    return found
 
 #---------------------------Functions for standups.------------------------------
-def standup_create(channel_id, time_finish):
+@journaled
+def standup_create(channel_id, u_id, time_finish):
     '''
-    Given channel_id and time_finish, create a standup with these details
-    and append it to the standup data structure.
+    Given channel_id, the u_id of the user starting it and time_finish,
+    create a standup with these details unless the channel already has one
+    running.
+    Return: True if the standup was created
     '''
-    global standups
-    with s_lock:
-        standup = {
-            'channel_id': channel_id,
-            'time_finish': time_finish,
-            'msg_buffer': [], 
-        }
-        standups.append(standup)
-    
+    standup = {
+        'channel_id': channel_id,
+        'u_id': u_id,
+        'time_finish': time_finish,
+        'msg_buffer': [],
+    }
+    return standups.setdefault(channel_id, standup) is standup
+
 def standup_search(channel_id):
     '''
-    Given a channel_id, search for and return the standup with channel_id 
-    channel_id.
+    Given a channel_id, return the standup running on channel with channel_id
+    channel_id, or {} if there is none.
     '''
-    global standups
-    with s_lock:
-        for standup in standups:
-            if standup['channel_id'] == channel_id:
-                return standup
-    return {}
-    
+    return standups.get(channel_id, {})
+
+@journaled
 def standup_remove(channel_id):
     '''
     Given a channel_id, remove the standup with channel_id channel_id
     from standups.
+    Return: the (handle, message) buffered by the standup, oldest first
     '''
-    global standups
-    with s_lock:
-        for (i, standup) in enumerate(standups):
-            if standup['channel_id'] == channel_id:
-                del standups[i]
-                
+    standup = standups.pop(channel_id, None)
+    standup_locks.pop(channel_id, None)
+    if standup is None:
+        return []
+    return standup['msg_buffer']
+
 def standup_message_add(channel_id, handle, message):
     '''
     Given a channel_id, a user handle and a message (str), add the message 
     to the standup running on channel with channel_id channel_id.
+    Unlike the journaled helpers it holds only the read side of the data
+    lock, which keeps commits and standup_remove out, and the lock of its
+    standup, so sends to different channels run in parallel.
+    Return: False if no standup is running on the channel
     '''
-    global standups
-    with s_lock:
-        for (i, standup) in enumerate(standups):
-            if standup['channel_id'] == channel_id:
-                standups[i]['msg_buffer'].append((handle, message))
+    with read_lock:
+        standup = standups.get(channel_id)
+        if standup is None:
+            return False
+        with standup_locks.setdefault(channel_id, Lock()):
+            standup['msg_buffer'].append((handle, message))
+            if getattr(journal_state, 'depth', 0) == 0 and not journal_replaying:
+                record('standup_message_add', (channel_id, handle, message), True)
+    return True
+
+journal_ops['standup_message_add'] = standup_message_add
+
+def saved_standup(standup):
+    ''' Return a standup as stored in the database. '''
+    return {
+        'channel_id': standup['channel_id'],
+        'u_id': standup['u_id'],
+        'time_finish': standup['time_finish'],
+        'msg_buffer': [list(sent) for sent in standup['msg_buffer']],
+    }
+
+def load_standup(saved):
+    ''' Return a standup as kept in memory from its stored form. '''
+    return {
+        'channel_id': saved['channel_id'],
+        'u_id': saved['u_id'],
+        'time_finish': saved['time_finish'],
+        'msg_buffer': [tuple(sent) for sent in saved['msg_buffer']],
+    }
 
 #---------------------------downloading and uploading from database------------------------------
 def load(filename):
@@ -649,6 +1204,102 @@ def load(filename):
     Args: filename of database
     '''
 
+    global journal_seq
+    global journal_epoch
+    global journal_pending
+    global journal_length
+    # anything recorded before loading is not part of this database's history
+    journal_pending = []
+    journal_seq = 0
+    journal_epoch = None
+    ids.open_marks(filename + '.ids')
+    if persistence_mode == 'sqlite':
+        load_sqlite(filename)
+    elif persistence_mode == 'sharded':
+        load_sharded(filename)
+    else:
+        try:
+            with open(filename, 'r') as FILE:   
+                database = json.load(FILE)
+                if database:
+                    restore(database)
+                    journal_seq = int(database.get("journal_seq", 0))
+                    journal_epoch = database.get("journal_epoch")
+        except Exception:
+            pass
+
+        if persistence_mode == 'journal':
+            journal_length = replay_journal(filename + '.journal')
+
+    # new ids go past the loaded ones, and past every block reserved before
+    u_ids.advance(u_id_stat)
+    channel_ids.advance(channel_id_stat - 1)
+    message_ids.advance(message_id_stat)
+
+def sqlite_filename(filename):
+    ''' Return the SQLite database that goes with a JSON database filename. '''
+    return os.path.splitext(filename)[0] + '.sqlite3'
+
+def load_sqlite(filename):
+    '''
+    Update program memory from the SQLite database, moving the JSON database
+    into it first if the SQLite database is still empty.
+    Args: filename of JSON database
+    '''
+
+    global journal_seq
+    import sqlite_store
+    is_empty = sqlite_store.open_store(sqlite_filename(filename))
+    if is_empty:
+        try:
+            with open(filename, 'r') as FILE:
+                database = json.load(FILE)
+                if database:
+                    restore(database)
+                    journal_seq = int(database.get("journal_seq", 0))
+        except Exception:
+            pass
+        sqlite_store.save()
+    else:
+        database = sqlite_store.load()
+        restore(database)
+        journal_seq = database["journal_seq"]
+
+def shard_dirname(filename):
+    ''' Return the sharded database directory that goes with a JSON database filename. '''
+    return os.path.splitext(filename)[0] + '.shards'
+
+def load_sharded(filename):
+    '''
+    Update program memory from the core file of the sharded database, moving
+    the JSON database into it first if there is no sharded database yet.
+    Messages are read from their segments when they are first needed.
+    Args: filename of JSON database
+    '''
+
+    global journal_seq
+    import shard_store
+    is_empty = shard_store.open_store(shard_dirname(filename))
+    if is_empty:
+        try:
+            with open(filename, 'r') as FILE:
+                database = json.load(FILE)
+                if database:
+                    restore(database)
+                    journal_seq = int(database.get("journal_seq", 0))
+        except Exception:
+            pass
+        shard_store.save()
+    else:
+        database = shard_store.load()
+        journal_seq = database["journal_seq"]
+
+def restore(database):
+    '''
+    Replace the data in memory with a database snapshot and rebuild the indexes.
+    Args: database as saved by save
+    '''
+
     global u_id_stat
     global channel_id_stat
     global message_id_stat
@@ -656,19 +1307,177 @@ def load(filename):
     global sessions
     global channels
     global reset_list
+    u_id_stat = int(database["u_id_stat"])
+    channel_id_stat = int(database["channel_id_stat"])
+    message_id_stat = int(database["message_id_stat"])
+    users = database["users"]
+    sessions = {}
+    session_u_ids.clear()
+    for session in database["sessions"]:
+        sessions[session['token']] = session
+        session_u_ids[session['u_id']] = session
+    channels = {}
+    for index in channel_index.values():
+        index.clear()
+    channel_members.clear()
+    message_index.clear()
+    message_tombstones.clear()
+    message_removed.clear()
+    # each channel is indexed by the first search of it
+    trigram_index.clear()
+    channel_trigrams.clear()
+    trigram_indexed.clear()
+    for channel in database["channels"]:
+        channels[channel['channel_id']] = channel
+        # the database keeps messages newest first
+        channel['messages'].reverse()
+        for (position, message) in enumerate(channel['messages']):
+            message['reacts'] = load_reacts(message['reacts'])
+            message_index[message['message_id']] = (channel['channel_id'], position)
+        for key in ['all_members', 'owner_members']:
+            for member in channel[key]:
+                index_member(channel['channel_id'], key, member['u_id'])
+    reset_list = database["reset_list"]
+    scheduled.clear()
+    for pending in database.get("scheduled", []):
+        scheduled[pending['message_id']] = pending
+    standups.clear()
+    standup_locks.clear()
+    for saved in database.get("standups", []):
+        standups[saved['channel_id']] = load_standup(saved)
+    for index in account_index.values():
+        index.clear()
+    for account in users:
+        index_account(account)
+
+def replay_journal(filename):
+    '''
+    Apply the journal records that are newer than the loaded snapshot.
+    Records of another epoch (appended by another server sharing the file)
+    are skipped. A record cut short by a crash ends the replay and is cut off
+    the journal with everything after it.
+    Args: filename of journal
+    Return: number of records in the journal
+    '''
+
+    global journal_seq
+    global journal_replaying
+    length = 0
+    size = 0
+    journal_replaying = True
     try:
-        with open(filename, 'r') as FILE:   
-            database = json.load(FILE)
-            if database:
-                u_id_stat = int(database["u_id_stat"])
-                channel_id_stat = int(database["channel_id_stat"])
-                message_id_stat = int(database["message_id_stat"])
-                users = database["users"]
-                sessions = database["sessions"]
-                channels = database["channels"]
-                reset_list = database["reset_list"]
-    except Exception:
+        with open(filename, 'rb') as FILE:
+            lines = FILE.readlines()
+        for line in lines:
+            try:
+                (epoch, seq, op, args) = json.loads(line)
+                if epoch == journal_epoch and seq > journal_seq:
+                    journal_ops[op](*args)
+                    journal_seq = seq
+            except Exception:
+                os.truncate(filename, size)
+                break
+            length += 1
+            size += len(line)
+    except FileNotFoundError:
         pass
+    finally:
+        journal_replaying = False
+    return length
+
+def replay(records):
+    '''
+    Apply journal records made by another server process sharing the
+    database, through the same helpers that made them.
+    Args: records as kept in the journal
+    '''
+
+    global journal_replaying
+    with write_lock:
+        journal_replaying = True
+        try:
+            for record in records:
+                (_, _, op, args) = json.loads(record)
+                journal_ops[op](*args)
+        finally:
+            journal_replaying = False
+
+def commit(filename):
+    '''
+    Make the changes since the last commit persistent. In journal mode only
+    the new records are appended, with a full snapshot every JOURNAL_CHECKPOINT
+    records.
+    Args: filename of database
+    '''
+
+    global journal_pending
+    global journal_length
+    with commit_lock:
+        if persistence_mode == 'sqlite':
+            import sqlite_store
+            with write_lock:
+                (records, journal_pending) = (journal_pending, [])
+                sqlite_store.commit(records)
+            return
+        if persistence_mode == 'sharded':
+            import shard_store
+            with write_lock:
+                journal_pending = []
+            shard_store.commit()
+            return
+        if persistence_mode != 'journal':
+            save(filename)
+            return
+
+        with write_lock:
+            (records, journal_pending) = (journal_pending, [])
+        if not records:
+            return
+        if journal_length + len(records) >= JOURNAL_CHECKPOINT:
+            save(filename)
+            return
+        with open(filename + '.journal', 'a') as FILE:
+            FILE.write(''.join(record + '\n' for record in records))
+            FILE.flush()
+            os.fsync(FILE.fileno())
+        journal_length += len(records)
+
+@journaled
+def clear():
+    '''
+    Reset all the data in memory to its initial state.
+    '''
+
+    global u_id_stat
+    global channel_id_stat
+    global message_id_stat
+    u_id_stat = 0
+    channel_id_stat = 0
+    message_id_stat = 0
+    users.clear()
+    for index in account_index.values():
+        index.clear()
+    sessions.clear()
+    session_u_ids.clear()
+    channels.clear()
+    for index in channel_index.values():
+        index.clear()
+    channel_members.clear()
+    message_index.clear()
+    message_tombstones.clear()
+    message_removed.clear()
+    trigram_index.clear()
+    channel_trigrams.clear()
+    trigram_indexed.clear()
+    reset_list.clear()
+    scheduled.clear()
+    standups.clear()
+    standup_locks.clear()
+    for allocator in [u_ids, channel_ids, message_ids]:
+        allocator.reset()
+    message_changed(None, None)
+    if not journal_replaying:
+        ids.clear_marks()
 
 # dump data into given file
 def save(filename):
@@ -678,14 +1487,55 @@ def save(filename):
     Args: filename of database
     '''
 
-    with open(filename, 'w') as FILE:
-        data_collection = {
-            "u_id_stat": u_id_stat,
-            "channel_id_stat": channel_id_stat,
-            "message_id_stat": message_id_stat,
-            "users": users,
-            "sessions": sessions,
-            "channels": channels,
-            "reset_list": reset_list
-        }
-        json.dump(data_collection, FILE)
+    global journal_epoch
+    global journal_pending
+    global journal_length
+    with commit_lock:
+        if persistence_mode == 'sqlite':
+            import sqlite_store
+            with write_lock:
+                (records, journal_pending) = (journal_pending, [])
+                sqlite_store.save(records)
+            return
+        if persistence_mode == 'sharded':
+            import shard_store
+            with write_lock:
+                journal_pending = []
+            shard_store.save()
+            return
+
+        with write_lock:
+            journal_epoch = uuid4().hex
+            data_collection = {
+                "u_id_stat": u_id_stat,
+                "channel_id_stat": channel_id_stat,
+                "message_id_stat": message_id_stat,
+                "journal_seq": journal_seq,
+                "journal_epoch": journal_epoch,
+                "users": users,
+                "sessions": list(sessions.values()),
+                "channels": [saved_channel(channel) for channel in channels.values()],
+                "reset_list": reset_list,
+                "scheduled": list(scheduled.values()),
+                "standups": [saved_standup(standup) for standup in standups.values()],
+            }
+            database = dumps(data_collection, default=encode_set)
+            # the snapshot includes every record so far
+            journal_pending = []
+
+        # write a new file and swap it in, so a crash never leaves half a database
+        with open(filename + '.tmp', 'w') as FILE:
+            FILE.write(database)
+            FILE.flush()
+            os.fsync(FILE.fileno())
+        os.replace(filename + '.tmp', filename)
+
+        if persistence_mode == 'journal':
+            open(filename + '.journal', 'w').close()
+            journal_length = 0
+
+def saved_channel(channel):
+    ''' Return a channel as stored in the database, with its messages newest first. '''
+    saved = dict(channel)
+    saved['messages'] = list(iter_messages(channel))[::-1]
+    return saved
@@ -1,7 +1,15 @@
 import other
 import auth
+import channel
+import channels
 import data
 import json
+import message
+import pytest
+import shard_store
+import shutil
+import sqlite_store
+from error import AccessError
 
 def test_data_transfer():
     '''
@@ -16,6 +24,8 @@ def test_data_transfer():
         assert database == {"u_id_stat": 1, 
             "channel_id_stat": 0, 
             "message_id_stat": 0, 
+            "journal_seq": data.journal_seq,
+            "journal_epoch": data.journal_epoch,
             "users": [
                 {
                     'u_id': 1,
@@ -34,7 +44,9 @@ def test_data_transfer():
                 }
             ],
             "channels": [],
-            "reset_list": []
+            "reset_list": [],
+            "scheduled": [],
+            "standups": []
         }
     other.clear()
     data.save("src/database.json")
@@ -43,8 +55,498 @@ def test_data_transfer():
         assert database == {"u_id_stat": 0, 
             "channel_id_stat": 0, 
             "message_id_stat": 0, 
+            "journal_seq": data.journal_seq,
+            "journal_epoch": data.journal_epoch,
             "users": [],
             "sessions": [],
             "channels": [],
-            "reset_list": []
+            "reset_list": [],
+            "scheduled": [],
+            "standups": []
         }
+
+def test_data_transfer_messages(tmp_path):
+    '''
+    messages keep their order and can still be found after a save and load
+    '''
+
+    other.clear()
+    token = auth.auth_register('user1@gmail.com', 'password1', 'name_1', 'surname_1')['token']
+    c_id = channels.channels_create(token, 'channel1', True)['channel_id']
+    m_ids = [message.message_send(token, c_id, f'message {i}')['message_id'] for i in range(3)]
+    message.message_remove(token, m_ids[1])
+    database = str(tmp_path / "database.json")
+    data.save(database)
+    with open(database, 'r') as FILE:
+        saved = json.load(FILE)
+        assert [m['message_id'] for m in saved['channels'][0]['messages']] == [m_ids[2], m_ids[0]]
+
+    other.clear()
+    data.load(database)
+    messages = channel.channel_messages(token, c_id, 0)['messages']
+    assert [m['message_id'] for m in messages] == [m_ids[2], m_ids[0]]
+    found = other.search(token, 'message')['messages']
+    assert [m['message_id'] for m in found] == [m_ids[0], m_ids[2]]
+    message.message_remove(token, m_ids[2])
+    messages = channel.channel_messages(token, c_id, 0)['messages']
+    assert [m['message_id'] for m in messages] == [m_ids[0]]
+    other.clear()
+
+def test_data_transfer_reacts(tmp_path):
+    '''
+    reacts are saved as {react_id: u_ids}, and databases saved with a list of
+    reacts still load
+    '''
+
+    other.clear()
+    token1 = auth.auth_register('user1@gmail.com', 'password1', 'name_1', 'surname_1')['token']
+    token2 = auth.auth_register('user2@gmail.com', 'password2', 'name_2', 'surname_2')['token']
+    c_id = channels.channels_create(token1, 'channel1', True)['channel_id']
+    channel.channel_join(token2, c_id)
+    m_id = message.message_send(token1, c_id, 'message')['message_id']
+    message.message_react(token2, m_id, 1)
+    message.message_react(token1, m_id, 1)
+    database = str(tmp_path / "database.json")
+    data.save(database)
+    with open(database, 'r') as FILE:
+        saved = json.load(FILE)
+    assert saved['channels'][0]['messages'][0]['reacts'] == {"1": [1, 2]}
+
+    saved['channels'][0]['messages'][0]['reacts'] = [{'react_id': 1, 'u_ids': [2, 1], 'is_this_user_reacted': False}]
+    with open(database, 'w') as FILE:
+        json.dump(saved, FILE)
+    for _ in range(2):
+        other.clear()
+        data.load(database)
+        reacts = channel.channel_messages(token2, c_id, 0)['messages'][0]['reacts']
+        assert sorted(reacts[0]['u_ids']) == [1, 2]
+        assert reacts[0]['is_this_user_reacted'] == True
+        message.message_unreact(token2, m_id, 1)
+        reacts = channel.channel_messages(token2, c_id, 0)['messages'][0]['reacts']
+        assert reacts == [{'react_id': 1, 'u_ids': [1], 'is_this_user_reacted': False}]
+        message.message_react(token2, m_id, 1)
+        data.save(database)
+    other.clear()
+
+def test_data_transfer_journal(tmp_path, monkeypatch):
+    '''
+    committed changes are appended to the journal and replayed on load
+    '''
+
+    other.clear()
+    database = str(tmp_path / "database.json")
+    data.load(database)
+    token = auth.auth_register('user1@gmail.com', 'password1', 'name_1', 'surname_1')['token']
+    c_id = channels.channels_create(token, 'channel1', True)['channel_id']
+    m_id = message.message_send(token, c_id, 'message')['message_id']
+    message.message_edit(token, m_id, 'edited message')
+    message.message_pin(token, m_id)
+    data.commit(database)
+    with open(database + '.journal', 'r') as FILE:
+        assert len(FILE.readlines()) == 6
+
+    # changes that were never committed are lost
+    other.clear()
+    data.load(database)
+    messages = channel.channel_messages(token, c_id, 0)['messages']
+    assert [(m['message'], m['is_pinned']) for m in messages] == [('edited message', True)]
+
+    # reaching the checkpoint writes a snapshot and starts a new journal
+    monkeypatch.setattr(data, 'JOURNAL_CHECKPOINT', 8)
+    message.message_send(token, c_id, 'message 2')
+    data.commit(database)
+    with open(database + '.journal', 'r') as FILE:
+        assert len(FILE.readlines()) == 7
+    message.message_send(token, c_id, 'message 3')
+    data.commit(database)
+    with open(database + '.journal', 'r') as FILE:
+        assert FILE.readlines() == []
+    message.message_send(token, c_id, 'message 4')
+    data.commit(database)
+
+    other.clear()
+    data.load(database)
+    messages = channel.channel_messages(token, c_id, 0)['messages']
+    assert [m['message'] for m in messages] == ['message 4', 'message 3', 'message 2', 'edited message']
+    other.clear()
+
+def test_data_transfer_journal_logout(tmp_path):
+    '''
+    a logout replayed from the journal ends the session for good, so the
+    user can log in again
+    '''
+
+    other.clear()
+    database = str(tmp_path / "database.json")
+    data.load(database)
+    token = auth.auth_register('user1@gmail.com', 'password1', 'name_1', 'surname_1')['token']
+    auth.auth_logout(token)
+    data.commit(database)
+
+    other.clear()
+    data.load(database)
+    assert data.session_search('u_id', 1) is None
+    token = auth.auth_login('user1@gmail.com', 'password1')['token']
+    assert data.session_search('token', token)['u_id'] == 1
+    other.clear()
+
+def test_data_transfer_journal_foreign(tmp_path):
+    '''
+    journal records of another snapshot are skipped, a torn record ends the
+    replay and is cut off the journal
+    '''
+
+    other.clear()
+    database = str(tmp_path / "database.json")
+    data.load(database)
+    data.save(database)
+    token = auth.auth_register('user1@gmail.com', 'password1', 'name_1', 'surname_1')['token']
+    data.commit(database)
+    with open(database + '.journal', 'a') as FILE:
+        FILE.write(json.dumps(['other', data.journal_seq + 1, 'add_img_url', [5, 'http://host/']]) + '\n')
+    c_id = channels.channels_create(token, 'channel1', True)['channel_id']
+    data.commit(database)
+    with open(database + '.journal', 'a') as FILE:
+        FILE.write('["torn')
+
+    other.clear()
+    data.load(database)
+    assert data.account_search('u_id', 1)['email'] == 'user1@gmail.com'
+    assert list(data.channels) == [c_id]
+    with open(database + '.journal', 'r') as FILE:
+        assert len(FILE.readlines()) == 4
+    other.clear()
+
+@pytest.fixture
+def sqlite_mode(monkeypatch):
+    '''
+    store the database in SQLite for the duration of a test
+    '''
+
+    other.clear()
+    monkeypatch.setattr(data, 'persistence_mode', 'sqlite')
+    yield
+    sqlite_store.close_store()
+    other.clear()
+
+def dump_state(token, c_id):
+    '''
+    everything a user can see about the data, to compare before and after loading
+    '''
+
+    return (
+        other.users_all(token),
+        channels.channels_listall(token),
+        channel.channel_details(token, c_id),
+        channel.channel_messages(token, c_id, 0),
+    )
+
+def test_data_transfer_sqlite(tmp_path, sqlite_mode):
+    '''
+    committed changes are written to SQLite and read back on load
+    '''
+
+    database = str(tmp_path / "database.json")
+    data.load(database)
+    token1 = auth.auth_register('user1@gmail.com', 'password1', 'name_1', 'surname_1')['token']
+    token2 = auth.auth_register('user2@gmail.com', 'password2', 'name_2', 'surname_2')['token']
+    c_id = channels.channels_create(token1, 'channel1', True)['channel_id']
+    channel.channel_join(token2, c_id)
+    m_ids = [message.message_send(token1, c_id, f'message {i}')['message_id'] for i in range(3)]
+    data.commit(database)
+    message.message_edit(token1, m_ids[0], 'edited message')
+    message.message_remove(token1, m_ids[1])
+    message.message_pin(token1, m_ids[2])
+    message.message_react(token2, m_ids[2], 1)
+    channel.channel_addowner(token1, c_id, 2)
+    later = data.message_ids.take()
+    data.schedule_message(later, 1, 'later', 4102444800, c_id)
+    data.commit(database)
+    before = dump_state(token1, c_id)
+    scheduled = dict(data.scheduled)
+
+    other.clear()
+    data.load(database)
+    assert dump_state(token1, c_id) == before
+    assert data.scheduled == scheduled
+    data.unschedule_message(later)
+    data.commit(database)
+    data.load(database)
+    assert data.scheduled == {}
+
+    # the removed owner and the logout are written too
+    channel.channel_leave(token1, c_id)
+    auth.auth_logout(token1)
+    data.commit(database)
+    before = dump_state(token2, c_id)
+    data.load(database)
+    assert dump_state(token2, c_id) == before
+    assert channel.channel_details(token2, c_id)['owner_members'][0]['u_id'] == 2
+    with pytest.raises(AccessError):
+        auth.auth_logout(token1)
+
+def test_data_transfer_sqlite_old_indexes(tmp_path, sqlite_mode):
+    '''
+    indexes only kept by older databases are dropped when the database is opened
+    '''
+
+    database = str(tmp_path / "database.json")
+    data.load(database)
+    token = auth.auth_register('user1@gmail.com', 'password1', 'name_1', 'surname_1')['token']
+    c_id = channels.channels_create(token, 'channel1', True)['channel_id']
+    data.commit(database)
+    before = dump_state(token, c_id)
+    sqlite_store.connection.execute('CREATE INDEX users_email ON users (email)')
+    sqlite_store.connection.execute('CREATE INDEX members_u_id ON members (u_id)')
+    sqlite_store.connection.commit()
+
+    other.clear()
+    data.load(database)
+    assert dump_state(token, c_id) == before
+    indexes = {name for (name,) in sqlite_store.connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")}
+    assert indexes == {'messages_channel_id'}
+
+def test_data_transfer_sqlite_migrate(tmp_path, sqlite_mode, monkeypatch):
+    '''
+    an existing JSON database is moved into an empty SQLite database
+    '''
+
+    monkeypatch.setattr(data, 'persistence_mode', 'journal')
+    database = str(tmp_path / "database.json")
+    data.load(database)
+    token = auth.auth_register('user1@gmail.com', 'password1', 'name_1', 'surname_1')['token']
+    c_id = channels.channels_create(token, 'channel1', True)['channel_id']
+    message.message_send(token, c_id, 'message')
+    data.save(database)
+    before = dump_state(token, c_id)
+
+    monkeypatch.setattr(data, 'persistence_mode', 'sqlite')
+    other.clear()
+    data.load(database)
+    assert dump_state(token, c_id) == before
+    assert (tmp_path / "database.sqlite3").exists()
+    other.clear()
+    data.load(database)
+    assert dump_state(token, c_id) == before
+
+@pytest.fixture
+def sharded_mode(monkeypatch):
+    '''
+    store the database in channel shards for the duration of a test
+    '''
+
+    other.clear()
+    monkeypatch.setattr(data, 'persistence_mode', 'sharded')
+    yield
+    shard_store.close_store()
+    other.clear()
+
+def test_data_transfer_sharded(tmp_path, sharded_mode, monkeypatch):
+    '''
+    committed changes are written to the shards and read back on load
+    '''
+
+    monkeypatch.setattr(shard_store, 'SEGMENT_SIZE', 2)
+    database = str(tmp_path / "database.json")
+    data.load(database)
+    token1 = auth.auth_register('user1@gmail.com', 'password1', 'name_1', 'surname_1')['token']
+    token2 = auth.auth_register('user2@gmail.com', 'password2', 'name_2', 'surname_2')['token']
+    c_id = channels.channels_create(token1, 'channel1', True)['channel_id']
+    channel.channel_join(token2, c_id)
+    m_ids = [message.message_send(token1, c_id, f'message {i}')['message_id'] for i in range(5)]
+    data.commit(database)
+    message.message_edit(token1, m_ids[0], 'edited message')
+    message.message_remove(token1, m_ids[1])
+    message.message_pin(token1, m_ids[2])
+    message.message_react(token2, m_ids[4], 1)
+    c_id_2 = channels.channels_create(token2, 'channel2', True)['channel_id']
+    message.message_send(token2, c_id_2, 'message')
+    channel.channel_leave(token2, c_id_2)
+    data.schedule_message(data.message_ids.take(), 1, 'later', 4102444800, c_id)
+    data.commit(database)
+    before = dump_state(token1, c_id)
+    scheduled = dict(data.scheduled)
+
+    other.clear()
+    data.load(database)
+    assert dump_state(token1, c_id) == before
+    assert data.scheduled == scheduled
+    assert not (tmp_path / "database.shards" / str(c_id_2)).exists()
+
+    # nothing but the core file is read until messages are needed
+    other.clear()
+    data.load(database)
+    assert list(shard_store.resident) == []
+    assert data.message_count(c_id) == 4
+    message.message_unpin(token1, m_ids[2])
+    assert list(shard_store.resident) == [(c_id, 1)]
+    data.commit(database)
+    data.load(database)
+    messages = channel.channel_messages(token1, c_id, 0)['messages']
+    assert [m['is_pinned'] for m in messages] == [False, False, False, False]
+
+def test_data_transfer_sharded_pages(tmp_path, sharded_mode, monkeypatch):
+    '''
+    recent pages only read the newest segment, old segments are evicted
+    when the budget is exceeded
+    '''
+
+    monkeypatch.setattr(shard_store, 'SEGMENT_SIZE', 100)
+    monkeypatch.setattr(shard_store, 'MESSAGE_BUDGET', 150)
+    database = str(tmp_path / "database.json")
+    data.load(database)
+    token = auth.auth_register('user1@gmail.com', 'password1', 'name_1', 'surname_1')['token']
+    c_id = channels.channels_create(token, 'channel1', True)['channel_id']
+    m_ids = [message.message_send(token, c_id, f'message {i}')['message_id'] for i in range(250)]
+    data.commit(database)
+
+    data.load(database)
+    page = channel.channel_messages(token, c_id, 0)
+    assert [m['message_id'] for m in page['messages']] == m_ids[:199:-1]
+    assert list(shard_store.resident) == [(c_id, 2)]
+
+    # the oldest message is found through the locator
+    message.message_edit(token, m_ids[0], 'edited message')
+    assert list(shard_store.resident) == [(c_id, 2), (c_id, 0)]
+
+    # segment 1 pushes the budget, the unchanged newest segment goes
+    channel.channel_messages(token, c_id, 100)
+    assert list(shard_store.resident) == [(c_id, 0), (c_id, 1)]
+    assert m_ids[-1] not in data.message_index
+    data.commit(database)
+
+    data.load(database)
+    page = channel.channel_messages(token, c_id, 210)
+    assert page['messages'][-1]['message'] == 'edited message'
+    assert page['end'] == -1
+
+def test_data_transfer_sharded_locator(tmp_path, sharded_mode, monkeypatch):
+    '''
+    a message that is not in memory is found by reading its own segment only,
+    and a removed one by reading none
+    '''
+
+    monkeypatch.setattr(shard_store, 'SEGMENT_SIZE', 10)
+    database = str(tmp_path / "database.json")
+    data.load(database)
+    token = auth.auth_register('user1@gmail.com', 'password1', 'name_1', 'surname_1')['token']
+    c_ids = [channels.channels_create(token, f'channel{i}', True)['channel_id'] for i in range(20)]
+    # message ids of the channels interleave
+    m_ids = [[message.message_send(token, c_id, f'{c_id} {i}')['message_id'] for c_id in c_ids]
+             for i in range(15)]
+    message.message_remove(token, m_ids[3][5])
+    data.commit(database)
+
+    data.load(database)
+    message.message_react(token, m_ids[2][-1], 1)
+    assert list(shard_store.resident) == [(c_ids[-1], 0)]
+    assert data.message_search(m_ids[3][5]) is None
+    assert data.message_search(-1) is None
+    assert list(shard_store.resident) == [(c_ids[-1], 0)]
+
+    # the locator of a database written before it was kept is filled on load
+    data.commit(database)
+    shutil.rmtree(tmp_path / "database.shards" / "locator")
+    core_file = tmp_path / "database.shards" / "core.json"
+    core = json.loads(core_file.read_text())
+    del core['located']
+    core_file.write_text(json.dumps(core))
+    data.load(database)
+    assert data.message_search(m_ids[12][0])[1]['message'] == f'{c_ids[0]} 12'
+    assert list(shard_store.resident) == [(c_ids[0], 1)]
+    data.commit(database)
+    data.load(database)
+    assert data.message_search(m_ids[12][0])[1]['message'] == f'{c_ids[0]} 12'
+    assert list(shard_store.resident) == [(c_ids[0], 1)]
+
+def test_data_transfer_sharded_search(tmp_path, sharded_mode, monkeypatch):
+    '''
+    a search after loading indexes the channel from the trigram files, without
+    reading its segments in
+    '''
+
+    monkeypatch.setattr(shard_store, 'SEGMENT_SIZE', 10)
+    database = str(tmp_path / "database.json")
+    data.load(database)
+    token = auth.auth_register('user1@gmail.com', 'password1', 'name_1', 'surname_1')['token']
+    c_id = channels.channels_create(token, 'channel1', True)['channel_id']
+    m_ids = [message.message_send(token, c_id, f'message {i}')['message_id'] for i in range(30)]
+    message.message_edit(token, m_ids[5], 'edited needle')
+    message.message_remove(token, m_ids[15])
+    data.commit(database)
+
+    data.load(database)
+    assert [m['message_id'] for m in data.search_messages([c_id], 'message 1')] == \
+        m_ids[1:2] + m_ids[10:15] + m_ids[16:20]
+    assert data.search_messages([c_id], 'needle')[0]['message_id'] == m_ids[5]
+    # only the segments of the messages found are read in
+    assert sorted(shard_store.resident) == [(c_id, 0), (c_id, 1)]
+
+    # a message sent since the last commit is found too
+    m_id = message.message_send(token, c_id, 'another needle')['message_id']
+    assert [m['message_id'] for m in data.search_messages([c_id], 'needle')] == [m_ids[5], m_id]
+
+    # databases written before the trigram files were kept are still searched
+    data.commit(database)
+    for path in (tmp_path / "database.shards" / str(c_id)).glob('*.trigrams.json'):
+        path.unlink()
+    data.load(database)
+    assert [m['message_id'] for m in data.search_messages([c_id], 'needle')] == [m_ids[5], m_id]
+
+def test_data_transfer_sharded_migrate(tmp_path, sharded_mode, monkeypatch):
+    '''
+    an existing JSON database is moved into a new sharded database
+    '''
+
+    monkeypatch.setattr(data, 'persistence_mode', 'journal')
+    database = str(tmp_path / "database.json")
+    data.load(database)
+    token = auth.auth_register('user1@gmail.com', 'password1', 'name_1', 'surname_1')['token']
+    c_id = channels.channels_create(token, 'channel1', True)['channel_id']
+    message.message_send(token, c_id, 'message')
+    data.save(database)
+    before = dump_state(token, c_id)
+
+    monkeypatch.setattr(data, 'persistence_mode', 'sharded')
+    other.clear()
+    data.load(database)
+    assert dump_state(token, c_id) == before
+    assert (tmp_path / "database.shards" / "core.json").exists()
+    other.clear()
+    data.load(database)
+    assert dump_state(token, c_id) == before
+
+@pytest.mark.parametrize('mode', ['journal', 'snapshot', 'sqlite', 'sharded'])
+def test_data_transfer_standups(tmp_path, monkeypatch, mode):
+    '''
+    running standups are saved with the database in every mode
+    '''
+
+    other.clear()
+    monkeypatch.setattr(data, 'persistence_mode', mode)
+    database = str(tmp_path / "database.json")
+    data.load(database)
+    token = auth.auth_register('user1@gmail.com', 'password1', 'name_1', 'surname_1')['token']
+    c_id = channels.channels_create(token, 'channel1', True)['channel_id']
+    data.standup_create(c_id, 1, 4102444800)
+    data.standup_message_add(c_id, 'name_1surname_1', 'first')
+    data.standup_message_add(c_id, 'name_1surname_1', 'second')
+    data.commit(database)
+
+    other.clear()
+    data.load(database)
+    assert data.standups == {c_id: {
+        'channel_id': c_id,
+        'u_id': 1,
+        'time_finish': 4102444800,
+        'msg_buffer': [('name_1surname_1', 'first'), ('name_1surname_1', 'second')],
+    }}
+    data.standup_remove(c_id)
+    data.commit(database)
+    other.clear()
+    data.load(database)
+    assert data.standups == {}
+    sqlite_store.close_store()
+    shard_store.close_store()
+    other.clear()
@@ -0,0 +1,116 @@
+'''
+Id allocation
+
+u_ids, channel_ids and message_ids are handed out by an IdAllocator each. An
+allocator reserves ids BLOCK_SIZE at a time by moving the high water mark of
+its kind of id in <database>.ids, and hands them out from memory until the
+block is used up. Ids are never handed out twice, even across a restart or by
+several servers sharing the database: each reserves its own blocks, under a
+lock on <database>.ids.lock, starting past every mark written so far.
+
+A restart skips what was left of the blocks, so ids may have gaps.
+'''
+import fcntl
+import json
+import os
+from threading import Lock
+
+BLOCK_SIZE = 100
+
+# file keeping the high water marks, None while ids are only kept in memory
+filename = None
+
+class IdAllocator:
+    '''
+    Hands out increasing ids of one kind, starting at first.
+    '''
+
+    def __init__(self, name, first):
+        self.name = name
+        self.first = first
+        self.lock = Lock()
+        self.reset()
+
+    def take(self):
+        '''
+        Hand out the next id, reserving a new block if this one is used up.
+
+        Return:
+            id (int): an id that was never handed out before.
+        '''
+        with self.lock:
+            if self.last >= self.limit:
+                (self.last, self.limit) = reserve(self.name, self.last)
+            self.last += 1
+            return self.last
+
+    def advance(self, last):
+        '''
+        Hand out only ids after last.
+
+        Args:
+            last (int): highest id loaded from the database.
+        '''
+        with self.lock:
+            self.last = max(self.last, last)
+
+    def reset(self):
+        ''' Start again from first, after the data was cleared. '''
+        with self.lock:
+            self.last = self.first - 1
+            self.limit = self.first - 1
+
+def open_marks(name):
+    '''
+    Keep the high water marks in a file from now on.
+
+    Args:
+        name (str): filename of the high water marks.
+    '''
+    global filename
+    filename = name
+
+def read_marks():
+    ''' Return the high water marks in the file, by kind of id. '''
+    try:
+        with open(filename, 'r') as FILE:
+            return json.load(FILE)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def write_marks(marks):
+    ''' Replace the high water marks in the file. '''
+    with open(filename + '.tmp', 'w') as FILE:
+        json.dump(marks, FILE)
+        FILE.flush()
+        os.fsync(FILE.fileno())
+    os.replace(filename + '.tmp', filename)
+
+def reserve(name, last):
+    '''
+    Reserve the next block of ids of a kind.
+
+    Args:
+        name (str): kind of id.
+        last (int): last id the allocator handed out.
+
+    Return:
+        (id the block starts after, last id of the block)
+    '''
+    if filename is None:
+        return (last, last + BLOCK_SIZE)
+    with open(filename + '.lock', 'a') as LOCK:
+        fcntl.flock(LOCK, fcntl.LOCK_EX)
+        marks = read_marks()
+        start = max(last, marks.get(name, last))
+        marks[name] = start + BLOCK_SIZE
+        write_marks(marks)
+    return (start, start + BLOCK_SIZE)
+
+def clear_marks():
+    ''' Forget every high water mark, after the data was cleared. '''
+    if filename is None:
+        return
+    with open(filename + '.lock', 'a') as LOCK:
+        fcntl.flock(LOCK, fcntl.LOCK_EX)
+        write_marks({})
@@ -0,0 +1,84 @@
+import other
+import auth
+import channels
+import data
+import ids
+from ids import IdAllocator
+import pytest
+import threading
+
+@pytest.fixture
+def marks(monkeypatch, tmp_path):
+    '''
+    keep the high water marks in a file of the test's own
+    '''
+
+    other.clear()
+    monkeypatch.setattr(ids, 'filename', None)
+    ids.open_marks(str(tmp_path / "database.json.ids"))
+    yield str(tmp_path / "database.json")
+    other.clear()
+
+def test_ids_threads():
+    '''
+    threads taking ids at once never get the same one
+    '''
+
+    allocator = IdAllocator('u_id', 1)
+    taken = []
+    def take():
+        for _ in range(1000):
+            taken.append(allocator.take())
+    threads = [threading.Thread(target=take) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(taken) == list(range(1, 8001))
+
+def test_ids_restart(marks):
+    '''
+    an allocator started again on the same file goes past every id handed out,
+    two at once share no ids
+    '''
+
+    allocator = IdAllocator('message_id', 1)
+    first = [allocator.take() for _ in range(ids.BLOCK_SIZE + 1)]
+    assert first == list(range(1, ids.BLOCK_SIZE + 2))
+    assert ids.read_marks() == {'message_id': 2 * ids.BLOCK_SIZE}
+
+    restarted = IdAllocator('message_id', 1)
+    other_worker = IdAllocator('message_id', 1)
+    assert restarted.take() == 2 * ids.BLOCK_SIZE + 1
+    assert other_worker.take() == 3 * ids.BLOCK_SIZE + 1
+    assert restarted.take() == 2 * ids.BLOCK_SIZE + 2
+
+def test_ids_load(marks):
+    '''
+    users, channels and messages made after loading the database get new ids,
+    and clear starts the ids again
+    '''
+
+    user = auth.auth_register('user1@gmail.com', 'password1', 'name_1', 'surname_1')
+    c_id = channels.channels_create(user['token'], 'channel1', True)['channel_id']
+    m_id = data.post_message(user['u_id'], 'hello', 0, c_id)
+    data.save(marks)
+    assert (user['u_id'], c_id, m_id) == (1, 0, 1)
+
+    # as if the server was started again
+    for allocator in [data.u_ids, data.channel_ids, data.message_ids]:
+        allocator.reset()
+    data.load(marks)
+    user_2 = auth.auth_register('user2@gmail.com', 'password2', 'name_2', 'surname_2')
+    c_id_2 = channels.channels_create(user_2['token'], 'channel2', True)['channel_id']
+    m_id_2 = data.post_message(user_2['u_id'], 'hello', 0, c_id_2)
+    assert user_2['u_id'] > ids.BLOCK_SIZE
+    assert c_id_2 >= ids.BLOCK_SIZE
+    assert m_id_2 > ids.BLOCK_SIZE
+    assert data.is_global_owner(user['u_id'])
+    assert not data.is_global_owner(user_2['u_id'])
+
+    other.clear()
+    user = auth.auth_register('user1@gmail.com', 'password1', 'name_1', 'surname_1')
+    assert user['u_id'] == 1
+    assert data.is_global_owner(user['u_id'])
@@ -3,7 +3,8 @@ import channels
 import data
 from error import AccessError, InputError
 from datetime import datetime as dt, timezone
-import threading
+import scheduler
+import workers
 
 def message_send(token, channel_id, message):
     '''
@@ -24,7 +25,8 @@ def message_send(token, channel_id, message):
     '''
     
     # check if the token is valid
-    if not data.session_search('token', token):
+    session = data.session_search('token', token)
+    if not session:
         raise AccessError(description='Invalid Token!')
 
     # check if the channel is exists
@@ -32,7 +34,7 @@ def message_send(token, channel_id, message):
         raise InputError(description='This Channel Doesn\'t Exist!')
 
     # check if the user is a member of the channel
-    u_id = data.session_search('token', token)['u_id']
+    u_id = session['u_id']
     if (not data.is_member(u_id, channel_id)):
         raise AccessError(description='You Cannot Access This Channel!')
 
@@ -44,10 +46,7 @@ def message_send(token, channel_id, message):
     send_time = dt.utcnow()
     send_time = int(send_time.replace(tzinfo=timezone.utc).timestamp())
 
-    # Calculate the message_id
-    message_id = data.message_id_stat + 1
-
-    data.add_message(message_id,u_id,message,send_time,channel_id)
+    message_id = data.post_message(u_id, message, send_time, channel_id)
 
     return {
         'message_id' : message_id 
@@ -85,7 +84,7 @@ def message_remove(token, message_id):
     user = data.account_search('u_id', u_id)
 
     # error check for if user is not global owner, not channel owner, and not message sender 
-    if not ((data.make_member(u_id) in result_channel['owner_members']) 
+    if not (data.is_owner(u_id, result_channel['channel_id'])
             or user['is_global_owner'] or (result_message['u_id'] == u_id)):
         raise AccessError(description='Need to be global owner, channel owner, or message sender.')
 
@@ -128,7 +127,7 @@ def message_edit(token, message_id, message):
     
     # Check the calling user is authorized.
     global_owner = data.account_search('u_id', calling_u_id)['is_global_owner']
-    channel_owner = (data.make_member(calling_u_id) in result_channel['owner_members'])
+    channel_owner = data.is_owner(calling_u_id, result_channel['channel_id'])
     message_sender = (result_message['u_id'] == calling_u_id)
     if not (global_owner or channel_owner or message_sender):
         raise AccessError(description = 'User is not authorized to edit this message.')
@@ -137,7 +136,7 @@ def message_edit(token, message_id, message):
     if message == '':
         message_remove(token, result_message['message_id'])
     else:
-        result_message['message'] = message
+        data.edit_message(message_id, message)
     
     return {}
 
@@ -183,7 +182,7 @@ def message_pin(token, message_id):
     if result_message['is_pinned']:
         raise InputError(description='Message already pinned.')
     
-    result_message['is_pinned'] = True
+    data.set_pinned(message_id, True)
 
     return {}
 
@@ -228,7 +227,7 @@ def message_unpin(token, message_id):
     if not result_message['is_pinned']:
         raise InputError(description='Message already unpinned.')
     
-    result_message['is_pinned'] = False
+    data.set_pinned(message_id, False)
 
     return {}
 
@@ -252,11 +251,13 @@ def message_react(token, message_id, react_id):
     '''
     
     # invalid token
-    if not data.session_search('token', token):
+    session = data.session_search('token', token)
+    if not session:
         raise AccessError(description='Invalid Token!')
 
     # invalid message id
-    if not data.message_search(message_id):
+    m_search = data.message_search(message_id)
+    if not m_search:
         raise InputError(description='Invalid MessageID!')
 
     # invalid react id
@@ -266,17 +267,13 @@ def message_react(token, message_id, react_id):
     
     # if the authorised user has already reacted to this message
     # raise an input error
-    u_id = data.session_search('token', token)['u_id']
-    (_, message) = data.message_search(message_id)
+    u_id = session['u_id']
+    (_, message) = m_search
 
 
-    for r in message['reacts']:
-        if react_id == r['react_id']:
-            if u_id in r['u_ids']:
-                raise InputError(description='You have already reacted to this message!')
-            
-    
-    
+    if u_id in message['reacts'].get(react_id, ()):
+        raise InputError(description='You have already reacted to this message!')
+
     # add the react
     data.message_react_to(u_id, message_id, react_id)
 
@@ -304,11 +301,13 @@ def message_unreact(token, message_id, react_id):
     '''
 
     # invalid token
-    if not data.session_search('token', token):
+    session = data.session_search('token', token)
+    if not session:
         raise AccessError(description='Invalid Token!')
 
     # invalid message id
-    if not data.message_search(message_id):
+    m_search = data.message_search(message_id)
+    if not m_search:
         raise InputError(description='Invalid MessageID!')
 
     # invalid react id
@@ -317,19 +316,13 @@ def message_unreact(token, message_id, react_id):
 
     # if the authorised user has not already reacted to this message
     # raise an input error
-    u_id = data.session_search('token', token)['u_id']
-    (_, message) = data.message_search(message_id)
+    u_id = session['u_id']
+    (_, message) = m_search
     # print(message)
 
-    if message['reacts'] == []:
+    if u_id not in message['reacts'].get(react_id, ()):
         raise InputError(description='You have already reacted to this message!')
 
-    for r in message['reacts']:
-        if react_id == r['react_id']:
-            if u_id not in r['u_ids']:
-                raise InputError(description='You have already reacted to this message!')
-
-    
     data.message_unreact_to(u_id,message_id, react_id)
 
     return {}
@@ -365,7 +358,8 @@ def message_sendlater(token, channel_id, message, time_sent):
     '''
 
     # invalid token
-    if not data.session_search('token', token):
+    session = data.session_search('token', token)
+    if not session:
         raise AccessError(description='Invalid Token!')
 
     # check if the channel is exists
@@ -373,7 +367,7 @@ def message_sendlater(token, channel_id, message, time_sent):
         raise InputError(description='This Channel Doesn\'t Exist!')
 
     # check if the user is a member of the channel
-    u_id = data.session_search('token', token)['u_id']
+    u_id = session['u_id']
     if (not data.is_member(u_id, channel_id)):
         raise AccessError(description='You Cannot Access This Channel!')
 
@@ -390,15 +384,119 @@ def message_sendlater(token, channel_id, message, time_sent):
     if dt.now(tz=timezone.utc) > send_time:
         raise InputError(description='Invalid Time')
 
-    # find the time difference
-    now_time = dt.now(tz=timezone.utc)
-    delay_time = int((send_time - now_time).total_seconds())
+    m_id = data.message_ids.take()
+    data.schedule_message(m_id, u_id, message, time_sent, channel_id)
+    scheduler.call_at(time_sent, send_scheduled, m_id)
+    scheduler.start()
 
-    data.message_id_stat += 1
-    m_id = data.message_id_stat
-    
-    threading.Timer(delay_time, data.add_later, args=(m_id, u_id, message,time_sent, channel_id)).start()
-    
     return {'message_id' : m_id}
 
+def send_scheduled(message_id):
+    '''
+    Add a scheduled message to its channel, called by the scheduler at its
+    time_sent. Nothing is sent if the message was cancelled.
+
+    Args:
+        message_id(int): The id returned by message_sendlater.
+
+    Return: None
+    '''
+
+    # a message can not be cancelled between being looked up and added
+    with workers.writing():
+        pending = data.scheduled.get(message_id)
+        if pending is not None:
+            data.add_later(message_id, pending['u_id'], pending['message'],
+                           pending['time_sent'], pending['channel_id'])
+
+def message_sendlater_resume():
+    '''
+    Give the scheduler every scheduled message, after they were restored
+    by data.load.
+
+    Args: NA
+
+    Return: None
+    '''
+
+    for pending in list(data.scheduled.values()):
+        scheduler.call_at(pending['time_sent'], send_scheduled, pending['message_id'])
+    scheduler.start()
+
+def message_sendlater_list(token, channel_id):
+    '''
+    List the messages the authorised user has scheduled in a channel that
+    have not been sent yet.
+
+    Args:
+        token(str): The token of the user.
+        channel_id(int): The id of the channel.
+
+    Return {'messages': [{message_id, u_id, channel_id, message, time_sent}]},
+    the earliest time_sent first
+
+    Raises:
+        InputError when:
+            Channel ID is not a valid channel
+
+        AccessError when:
+            The token is invalid
+            The authorised user has not joined the channel
+    '''
+
+    session = data.session_search('token', token)
+    if not session:
+        raise AccessError(description='Invalid Token!')
+
+    if (data.channels_search('channel_id', channel_id) == {}):
+        raise InputError(description='This Channel Doesn\'t Exist!')
+
+    u_id = session['u_id']
+    if (not data.is_member(u_id, channel_id)):
+        raise AccessError(description='You Cannot Access This Channel!')
+
+    pending = [dict(p) for p in list(data.scheduled.values())
+               if p['channel_id'] == channel_id and p['u_id'] == u_id]
+    pending.sort(key=lambda p: (p['time_sent'], p['message_id']))
+
+    return {'messages': pending}
+
+def message_sendlater_cancel(token, message_id):
+    '''
+    Cancel a message scheduled by message_sendlater before it is sent.
+
+    Args:
+        token(str): The token of the user.
+        message_id(int): The id returned by message_sendlater.
+
+    Return: {}
+
+    Raises:
+        InputError when:
+            No message with message_id is waiting to be sent
+
+        AccessError when:
+            The token is invalid
+            The user is not global owner, not channel owner and not the
+            message sender
+    '''
+
+    session = data.session_search('token', token)
+    if not session:
+        raise AccessError(description='Invalid Token!')
+
+    pending = data.scheduled.get(message_id)
+    if pending is None:
+        raise InputError(description='This Message Is Not Scheduled!')
+
+    u_id = session['u_id']
+    user = data.account_search('u_id', u_id)
+    if not (data.is_owner(u_id, pending['channel_id'])
+            or user['is_global_owner'] or pending['u_id'] == u_id):
+        raise AccessError(description='Need to be global owner, channel owner, or message sender.')
+
+    data.unschedule_message(message_id)
+
+    return {}
+
 
@@ -4,6 +4,7 @@ import channels
 import message
 import other
 import pytest
+import user
 from datetime import timezone, datetime
 from error import AccessError, InputError
 
@@ -152,6 +153,15 @@ def test_owner_edit(message_edit_fixture):
     assert(margin_compare(other.search(u1['token'], 'Test Message')['messages'], []))
     assert(margin_compare(other.search(u1['token'], 'Edited Message')['messages'], [m]))
     
+def test_owner_edit_after_profile_change(message_edit_fixture):
+    '''U1 changes their name and is still allowed to edit as channel owner.'''
+    (_, u1, u2, c_id) = message_edit_fixture
+    channel.channel_join(u2['token'], c_id)
+    m_id = message.message_send(u2['token'], c_id, 'Test Message')['message_id']
+    user.user_profile_setname(u1['token'], 'new_first1', 'new_last1')
+    message.message_edit(u1['token'], m_id, 'Edited Message')
+    assert(other.search(u1['token'], 'Edited Message')['messages'][0]['message_id'] == m_id)
+    
 def test_global(message_edit_fixture):
     '''
     Test that a global owner can edit a message on a channel they are not an 
@@ -5,6 +5,7 @@ import channels
 import auth
 from error import AccessError, InputError
 import other
+import data
 
 '''Tests for message_react function in message.py '''
 
@@ -110,3 +111,21 @@ def test_reacted_two(initialise):
     assert test_react[0]['is_this_user_reacted'] == True
     assert len(test_react[0]['u_ids']) == 2
 
+def test_reacted_views(initialise):
+    '''Each user sees their own is_this_user_reacted, in channel_messages and
+    search, and reading never changes the stored message'''
+    (user0, user1, channel_id, message_id) = initialise
+
+    channel.channel_join(user1['token'], channel_id)
+    message.message_react(user0['token'], message_id, REACT_ID)
+
+    react0 = channel.channel_messages(user0['token'], channel_id, 0)['messages'][0]['reacts']
+    react1 = channel.channel_messages(user1['token'], channel_id, 0)['messages'][0]['reacts']
+    assert react0[0]['is_this_user_reacted'] == True
+    assert react1[0]['is_this_user_reacted'] == False
+
+    assert other.search(user0['token'], 'Test')['messages'][0]['reacts'][0]['is_this_user_reacted'] == True
+    assert other.search(user1['token'], 'Test', 1)['messages'][0]['reacts'][0]['is_this_user_reacted'] == False
+
+    (_, stored) = data.message_search(message_id)
+    assert stored['reacts'] == {REACT_ID: {user0['u_id']}}
@@ -1,7 +1,7 @@
 import pytest
 from error import InputError, AccessError
 from message import message_remove, message_send
-from channel import channel_join, channel_messages
+from channel import channel_join, channel_leave, channel_messages
 from channels import channels_create
 from auth import auth_register
 from other import clear
@@ -122,3 +122,11 @@ def test_message_remove_no_channels_exist():
     with pytest.raises(InputError):
         message_remove(global_token, 10)
 
+
+def test_message_remove_channel_deleted(setup):
+    """ Test for removing a message whose channel was deleted """
+    (global_token, channel_owner_token, _, channel_id1, _, _) = setup
+    message_id1 = message_send(channel_owner_token, channel_id1, 'stub_message1')['message_id']
+    channel_leave(channel_owner_token, channel_id1)
+    with pytest.raises(InputError):
+        message_remove(global_token, message_id1)
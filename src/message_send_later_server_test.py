@@ -146,6 +146,32 @@ def test_send_1_minute(initialise_send_later):
     
 
 
+def test_list_cancel(initialise_send_later):
+    '''List the scheduled messages and cancel one of them'''
+    (url, user0, user1, c_id, m, time_sent) = initialise_send_later
 
+    m_id = requests.post(f"{url}/message/sendlater",
+                         json={
+                             'token': user0['token'],
+                             'channel_id': c_id,
+                             'message' : m,
+                             'time_sent' : time_sent,
+                         }).json()['message_id']
+
+    pending = requests.get(f"{url}/message/sendlater/list",
+                           params={'token': user0['token'], 'channel_id': c_id}).json()
+    assert [p['message_id'] for p in pending['messages']] == [m_id]
+
+    response = requests.post(f"{url}/message/sendlater/cancel",
+                             json={'token': user1['token'], 'message_id': m_id})
+    assert response.status_code == AccessError.code
 
+    requests.post(f"{url}/message/sendlater/cancel",
+                  json={'token': user0['token'], 'message_id': m_id})
+    pending = requests.get(f"{url}/message/sendlater/list",
+                           params={'token': user0['token'], 'channel_id': c_id}).json()
+    assert pending['messages'] == []
 
+    response = requests.post(f"{url}/message/sendlater/cancel",
+                             json={'token': user0['token'], 'message_id': m_id})
+    assert response.status_code == InputError.code
@@ -131,3 +131,38 @@ def test_send_two(initialise):
     assert sent_message_1['message'] == m_1
 
 
+def test_list_cancel(initialise):
+    '''list the scheduled messages and cancel one before it is sent'''
+    (user0, user1, channel_id, time_sent) = initialise
+
+    channel.channel_join(user1['token'], channel_id)
+    m_id_1 = message.message_sendlater(user0['token'], channel_id, "second", time_sent + 5)['message_id']
+    m_id_0 = message.message_sendlater(user0['token'], channel_id, "first", time_sent)['message_id']
+    message.message_sendlater(user1['token'], channel_id, "other user", time_sent)
+
+    pending = message.message_sendlater_list(user0['token'], channel_id)['messages']
+    assert [(m['message_id'], m['message'], m['time_sent']) for m in pending] == [
+        (m_id_0, "first", time_sent),
+        (m_id_1, "second", time_sent + 5),
+    ]
+
+    with pytest.raises(AccessError):
+        message.message_sendlater_cancel(user1['token'], m_id_0)
+    with pytest.raises(InputError):
+        message.message_sendlater_cancel(user0['token'], -42)
+
+    message.message_sendlater_cancel(user0['token'], m_id_0)
+    pending = message.message_sendlater_list(user0['token'], channel_id)['messages']
+    assert [m['message_id'] for m in pending] == [m_id_1]
+    with pytest.raises(InputError):
+        message.message_sendlater_cancel(user0['token'], m_id_0)
+
+
+def test_list_not_member(initialise):
+    '''only members of the channel can list their scheduled messages'''
+    (_, user1, channel_id, _) = initialise
+
+    with pytest.raises(AccessError):
+        message.message_sendlater_list(user1['token'], channel_id)
+    with pytest.raises(InputError):
+        message.message_sendlater_list(user1['token'], -42)
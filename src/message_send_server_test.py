@@ -4,6 +4,7 @@ from error import AccessError, InputError
 import pytest
 from server_test_fixtures import url, register_users,create_channels
 from datetime import datetime as dt, timezone
+from threading import Thread
 
 
 def test_sanity(url):
@@ -124,3 +125,32 @@ def test_send_1_message(url, register_users):
     assert m_0 == message['message']
     assert message_id == message['message_id']
     assert user1['u_id'] == message['u_id']
+
+
+def test_send_concurrent(url, register_users, create_channels):
+    '''messages sent at once while others read the channel get distinct ids'''
+    (user1,_,_) = register_users
+    (pub_channel_id,_,_,_) = create_channels
+    message_ids = []
+    def send(n):
+        for i in range(10):
+            message_ids.append(requests.post(f"{url}/message/send", json={
+                'token' : user1['token'],
+                'channel_id' : pub_channel_id,
+                'message' : f'{n} {i}'
+            }).json()['message_id'])
+    def read():
+        for i in range(10):
+            requests.get(f"{url}/channel/messages", params={'token': user1['token'],
+                'channel_id': pub_channel_id, 'start': 0}).raise_for_status()
+    threads = [Thread(target=send, args=(n,)) for n in range(4)]
+    threads += [Thread(target=read) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(message_ids)) == 40
+    messages = requests.get(f"{url}/channel/messages", params={'token': user1['token'],
+        'channel_id': pub_channel_id, 'start': 0}).json()['messages']
+    assert sorted(m['message_id'] for m in messages) == sorted(message_ids)
@@ -123,9 +123,9 @@ def test_react_unreact_two(initialise):
 
     test_react_1 = channel.channel_messages(user1['token'], channel_id, 0)['messages'][0]['reacts']
 
-    assert test_react_0[0]['react_id'] == REACT_ID
-    assert test_react_0[0]['is_this_user_reacted'] == False
-    assert len(test_react_0[0]['u_ids']) == 0
+    assert test_react_1[0]['react_id'] == REACT_ID
+    assert test_react_1[0]['is_this_user_reacted'] == False
+    assert len(test_react_1[0]['u_ids']) == 0
 
 
 
@@ -0,0 +1,195 @@
+import os
+import re
+import pytest
+import requests
+from error import AccessError
+import signal
+from subprocess import Popen, PIPE
+from threading import Thread, Timer
+from time import sleep, time
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+
+def start_worker(directory):
+    '''
+    Start a server in multi-worker mode on the database in directory/src.
+    Return: (server process, url)
+    '''
+    url_re = re.compile(r' \* Running on ([^ ]*)')
+    env = dict(os.environ, FLOCKR_MULTI_WORKER='1')
+    server = Popen(["python3", SERVER], stderr=PIPE, stdout=PIPE, cwd=directory, env=env)
+    local_url = url_re.match(server.stderr.readline().decode())
+    if not local_url:
+        server.kill()
+        raise Exception("Couldn't get URL from local server")
+    return (server, local_url.group(1))
+
+@pytest.fixture(scope="module")
+def workers(tmp_path_factory):
+    '''
+    two servers sharing one database, as two workers of a pre-fork server
+    '''
+    directory = tmp_path_factory.mktemp('workers')
+    (directory / 'src').mkdir()
+    servers = [start_worker(str(directory)) for _ in range(2)]
+    yield [url for (_, url) in servers]
+    for (server, _) in servers:
+        server.send_signal(signal.SIGTERM)
+    for (server, _) in servers:
+        try:
+            server.wait(5)
+        except Exception:
+            server.kill()
+
+@pytest.fixture
+def user(workers):
+    '''
+    clear the shared database through one worker and register a user with a
+    channel through the other
+    '''
+    (url_a, url_b) = workers
+    requests.delete(f"{url_a}/clear")
+    user = requests.post(f"{url_b}/auth/register", json={
+        'email': 'user1@gmail.com',
+        'password': 'password1',
+        'name_first': 'name_1',
+        'name_last': 'surname_1',
+    }).json()
+    c_id = requests.post(f"{url_b}/channels/create", json={
+        'token': user['token'],
+        'name': 'channel1',
+        'is_public': True,
+    }).json()['channel_id']
+    return (user, c_id)
+
+def messages(url, token, c_id, start=0):
+    return requests.get(f"{url}/channel/messages", params={
+        'token': token,
+        'channel_id': c_id,
+        'start': start,
+    }).json()['messages']
+
+def test_workers_share_changes(workers, user):
+    '''
+    a change made through one worker is seen through the other
+    '''
+    (url_a, url_b) = workers
+    (user, c_id) = user
+    assert user['u_id'] == 1
+
+    m_id = requests.post(f"{url_a}/message/send", json={
+        'token': user['token'],
+        'channel_id': c_id,
+        'message': 'hello',
+    }).json()['message_id']
+    assert [m['message'] for m in messages(url_b, user['token'], c_id)] == ['hello']
+
+    requests.put(f"{url_b}/message/edit", json={
+        'token': user['token'],
+        'message_id': m_id,
+        'message': 'edited',
+    })
+    assert [m['message'] for m in messages(url_a, user['token'], c_id)] == ['edited']
+
+    requests.post(f"{url_a}/auth/logout", json={'token': user['token']})
+    response = requests.post(f"{url_b}/message/send", json={
+        'token': user['token'],
+        'channel_id': c_id,
+        'message': 'logged out',
+    })
+    assert response.status_code == AccessError.code
+
+def test_workers_concurrent_sends(workers, user):
+    '''
+    messages sent through both workers at once all get their own message_id
+    and both workers list all of them
+    '''
+    (url_a, url_b) = workers
+    (user, c_id) = user
+    m_ids = []
+    def send(url):
+        for i in range(20):
+            m_ids.append(requests.post(f"{url}/message/send", json={
+                'token': user['token'],
+                'channel_id': c_id,
+                'message': f'message {i}',
+            }).json()['message_id'])
+    threads = [Thread(target=send, args=(url,)) for url in workers for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(m_ids)) == 80
+    for url in workers:
+        listed = messages(url, user['token'], c_id) + messages(url, user['token'], c_id, 50)
+        assert sorted(m['message_id'] for m in listed) == sorted(m_ids)
+
+def test_workers_standup(workers, user):
+    '''
+    a standup started through one worker takes sends through the other
+    '''
+    (url_a, url_b) = workers
+    (user, c_id) = user
+    requests.post(f"{url_a}/standup/start", json={
+        'token': user['token'],
+        'channel_id': c_id,
+        'length': 2,
+    })
+    active = requests.get(f"{url_b}/standup/active", params={
+        'token': user['token'],
+        'channel_id': c_id,
+    }).json()
+    assert active['is_active'] == True
+    requests.post(f"{url_b}/standup/send", json={
+        'token': user['token'],
+        'channel_id': c_id,
+        'message': 'standup',
+    })
+    sleep(3)
+    for url in workers:
+        assert [m['message'] for m in messages(url, user['token'], c_id)] == ['name_1surname_1: standup']
+
+def poll(url, token, c_id, cursor, timeout):
+    return requests.get(f"{url}/channel/messages/poll", params={
+        'token': token,
+        'channel_id': c_id,
+        'cursor': cursor,
+        'timeout': timeout,
+    }).json()
+
+def test_workers_poll(workers, user):
+    '''
+    a cursor from one worker is good with the other, which wakes on a
+    message sent through the first
+    '''
+    (url_a, url_b) = workers
+    (user, c_id) = user
+    first = poll(url_a, user['token'], c_id, '', 0)
+    assert first['reset'] == True
+
+    requests.post(f"{url_b}/message/send", json={
+        'token': user['token'],
+        'channel_id': c_id,
+        'message': 'one',
+    })
+    changed = poll(url_b, user['token'], c_id, first['cursor'], 10)
+    assert changed['reset'] == False
+    assert [m['message'] for m in changed['messages']] == ['one']
+    unchanged = poll(url_a, user['token'], c_id, changed['cursor'], 0)
+    assert unchanged['reset'] == False and unchanged['messages'] == []
+
+    def send():
+        requests.post(f"{url_b}/message/send", json={
+            'token': user['token'],
+            'channel_id': c_id,
+            'message': 'two',
+        })
+    timer = Timer(0.5, send)
+    timer.start()
+    started = time()
+    changed = poll(url_a, user['token'], c_id, unchanged['cursor'], 10)
+    timer.join()
+    assert time() - started < 5
+    assert changed['reset'] == False
+    assert [m['message'] for m in changed['messages']] == ['two']
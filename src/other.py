@@ -1,6 +1,10 @@
+import base64
 import data
 from error import AccessError, InputError
-from standup import standup_cancel_timers
+import scheduler
+
+# messages on a search page when only a cursor is given
+SEARCH_PAGE = 50
 
 def clear():
     '''
@@ -9,15 +13,8 @@ def clear():
     Return: {}
     '''
 
-    data.u_id_stat = 0
-    data.channel_id_stat = 0
-    data.message_id_stat = 0
-    data.users.clear()
-    data.sessions.clear()
-    data.channels.clear()
-    data.reset_list.clear()
-    data.standups.clear()
-    standup_cancel_timers()
+    data.clear()
+    scheduler.clear()
 
     return {
     }
@@ -93,7 +90,7 @@ def admin_userpermission_change(token, u_id, permission_id):
     return {
     }
 
-def search(token, query_str):
+def search(token, query_str, limit=None, cursor=None):
 
     '''
     Search for a message containing query_str in all the channels the user
@@ -102,12 +99,18 @@ def search(token, query_str):
     Args:
         token (str): token of calling user.
         query_str (str): Search for messages containing this string.
+        limit (int): Return at most this many messages, with a cursor to the
+        next page. Every message is returned if neither limit nor cursor is given.
+        cursor (str): Cursor returned with the previous page.
         
     Return:
-        result (list): List of messages containing the query string.
+        result (list): List of messages containing the query string, in
+        message_id order, and the cursor to the next page (None on the last
+        page) if the search is paged.
         
     Raises:
         AccessError: No user with token token.
+        InputError: limit is not a positive number or cursor is invalid.
     '''
 
     # Get the user.
@@ -116,15 +119,39 @@ def search(token, query_str):
         raise AccessError(description = 'Invalid Token')
     calling_u_id = calling_session['u_id']
 
-    # Search logic.
-    result = {
-        'messages': [], 
-    }
     user_channels = data.channels_search('all_members', calling_u_id)
-    for channel in user_channels:
-        for message in channel['messages']:
-            if query_str in message['message']:
-                result['messages'].append(message)
-    result['messages'] = sorted(result['messages'], key = lambda i: i['message_id'])
+    channel_ids = [channel['channel_id'] for channel in user_channels]
+    if limit is None and cursor is None:
+        return {
+            'messages': data.message_views(calling_u_id,
+                data.search_messages(channel_ids, query_str)),
+        }
+
+    # Paged search.
+    if limit is None:
+        limit = SEARCH_PAGE
+    if limit < 1:
+        raise InputError(description = 'Invalid limit')
+    after = -1 if cursor is None else decode_cursor(cursor)
+    # one more than the page shows whether there is a next page
+    messages = data.search_messages(channel_ids, query_str, after, limit + 1)
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_cursor = encode_cursor(messages[-1]['message_id'])
    
-    return result
+    return {
+        'messages': data.message_views(calling_u_id, messages),
+        'cursor': next_cursor,
+    }
+
+def encode_cursor(message_id):
+    ''' Return the opaque cursor of the search page after message_id. '''
+    return base64.urlsafe_b64encode(str(message_id).encode()).decode()
+
+def decode_cursor(cursor):
+    ''' Return the message_id a search cursor continues after. '''
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except ValueError:
+        raise InputError(description = 'Invalid cursor')
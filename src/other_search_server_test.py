@@ -224,3 +224,28 @@ def test_channel_member(url, search_fixture):
     }
     messages = requests.get(f"{url}/search?token={u2['token']}&query_str=Test Message").json()['messages']
     assert(margin_compare(messages, [m]))
+
+def test_search_pages(url, search_fixture):
+    '''A search with a limit returns one page and a cursor to the next.'''
+    (_, u1, _, c_id) = search_fixture
+    m_ids = []
+    for i in range(3):
+        m_ids.append(requests.post(f'{url}/message/send', json = {'token': u1['token'],
+            'channel_id': c_id, 'message': f'Message {i}'}).json()['message_id'])
+    page = requests.get(f"{url}/search", params = {'token': u1['token'],
+        'query_str': 'Message', 'limit': 2}).json()
+    assert [m['message_id'] for m in page['messages']] == m_ids[:2]
+    page = requests.get(f"{url}/search", params = {'token': u1['token'],
+        'query_str': 'Message', 'limit': 2, 'cursor': page['cursor']}).json()
+    assert [m['message_id'] for m in page['messages']] == m_ids[2:]
+    assert page['cursor'] is None
+    messages = requests.get(f"{url}/search", params = {'token': u1['token'],
+        'query_str': 'Message'}).json()['messages']
+    assert [m['message_id'] for m in messages] == m_ids
+
+def test_search_pages_invalid_limit(url, search_fixture):
+    '''A limit that is not a number raises an InputError.'''
+    (_, u1, _, _) = search_fixture
+    page = requests.get(f"{url}/search", params = {'token': u1['token'],
+        'query_str': 'Message', 'limit': 'two'})
+    assert page.status_code == InputError.code
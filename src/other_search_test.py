@@ -196,3 +196,107 @@ def test_channel_member(search_fixture):
     }
     assert(margin_compare(other.search(u2['token'], 'Test Message')['messages'], [m]))
     
+
+def search_ids(token, query_str):
+    ''' Helper function returns the message_ids found by a search. '''
+    return [m['message_id'] for m in other.search(token, query_str)['messages']]
+
+def test_search_word_boundaries(search_fixture):
+    '''Query strings that start or end inside a word still match.'''
+    (_, u1, _, c_id) = search_fixture
+    m_id1 = message.message_send(u1['token'], c_id, 'Othello, Hello world!')['message_id']
+    m_id2 = message.message_send(u1['token'], c_id, 'hello worldwide')['message_id']
+    m_id3 = message.message_send(u1['token'], c_id, '!!!')['message_id']
+    assert search_ids(u1['token'], 'ello') == [m_id1, m_id2]
+    assert search_ids(u1['token'], 'Hello') == [m_id1]
+    assert search_ids(u1['token'], 'lo, Hello wor') == [m_id1]
+    assert search_ids(u1['token'], 'hello world') == [m_id2]
+    assert search_ids(u1['token'], 'world!') == [m_id1]
+    assert search_ids(u1['token'], 'Hello worldwide') == []
+    assert search_ids(u1['token'], '!!') == [m_id3]
+    assert search_ids(u1['token'], '') == [m_id1, m_id2, m_id3]
+
+def test_search_edit_remove(search_fixture):
+    '''Edited and removed messages are found by their current text only.'''
+    (_, u1, _, c_id) = search_fixture
+    m_id1 = message.message_send(u1['token'], c_id, 'first message')['message_id']
+    m_id2 = message.message_send(u1['token'], c_id, 'second message')['message_id']
+    message.message_edit(u1['token'], m_id1, 'edited text')
+    assert search_ids(u1['token'], 'message') == [m_id2]
+    assert search_ids(u1['token'], 'edited') == [m_id1]
+    message.message_remove(u1['token'], m_id2)
+    assert search_ids(u1['token'], 'message') == []
+    assert search_ids(u1['token'], 'text') == [m_id1]
+
+def test_search_left_channel(search_fixture):
+    '''Messages of a channel are not found once the caller left it.'''
+    (_, u1, u2, c_id) = search_fixture
+    c_id2 = channels.channels_create(u2['token'], 'channel2', True)['channel_id']
+    channel.channel_join(u1['token'], c_id2)
+    m_id1 = message.message_send(u1['token'], c_id, 'Test Message')['message_id']
+    m_id2 = message.message_send(u2['token'], c_id2, 'Test Message')['message_id']
+    assert search_ids(u1['token'], 'Test') == [m_id1, m_id2]
+    channel.channel_leave(u1['token'], c_id2)
+    assert search_ids(u1['token'], 'Test') == [m_id1]
+    channel.channel_leave(u2['token'], c_id2)
+    assert search_ids(u2['token'], 'Test') == []
+
+def test_search_short_and_repeated(search_fixture):
+    '''Short queries and queries whose trigrams repeat are still exact.'''
+    (_, u1, _, c_id) = search_fixture
+    m_id1 = message.message_send(u1['token'], c_id, 'aaa')['message_id']
+    m_id2 = message.message_send(u1['token'], c_id, 'baaaab')['message_id']
+    assert search_ids(u1['token'], 'aaaa') == [m_id2]
+    assert search_ids(u1['token'], 'aaa') == [m_id1, m_id2]
+    assert search_ids(u1['token'], 'aa') == [m_id1, m_id2]
+    assert search_ids(u1['token'], 'b') == [m_id2]
+    assert search_ids(u1['token'], 'abc') == []
+
+def test_search_pages(search_fixture):
+    '''A limited search returns pages in message_id order joined by cursors.'''
+    (_, u1, _, c_id) = search_fixture
+    c_id2 = channels.channels_create(u1['token'], 'channel2', True)['channel_id']
+    m_ids = []
+    for i in range(5):
+        m_ids.append(message.message_send(u1['token'], [c_id, c_id2][i % 2], f'Message {i}')['message_id'])
+    message.message_send(u1['token'], c_id, 'Other')
+
+    page = other.search(u1['token'], 'Message', 2)
+    assert [m['message_id'] for m in page['messages']] == m_ids[:2]
+    page = other.search(u1['token'], 'Message', 2, page['cursor'])
+    assert [m['message_id'] for m in page['messages']] == m_ids[2:4]
+    page = other.search(u1['token'], 'Message', 2, page['cursor'])
+    assert [m['message_id'] for m in page['messages']] == m_ids[4:]
+    assert page['cursor'] is None
+
+    # a page that ends exactly on the last result has no next page
+    page = other.search(u1['token'], 'Message', 5)
+    assert len(page['messages']) == 5
+    assert page['cursor'] is None
+    page = other.search(u1['token'], 'Me', 3)
+    assert [m['message_id'] for m in page['messages']] == m_ids[:3]
+
+def test_search_pages_skip_partial_matches(search_fixture):
+    '''Messages with every trigram of the query but not the query fill no page.'''
+    (_, u1, _, c_id) = search_fixture
+    c_id2 = channels.channels_create(u1['token'], 'channel2', True)['channel_id']
+    for _ in range(3):
+        message.message_send(u1['token'], c_id, 'abc bcd')
+    m_ids = []
+    for i in range(3):
+        message.message_send(u1['token'], c_id2, 'bcd abc')
+        m_ids.append(message.message_send(u1['token'], [c_id, c_id2][i % 2], f'abcd {i}')['message_id'])
+
+    page = other.search(u1['token'], 'abcd', 2)
+    assert [m['message_id'] for m in page['messages']] == m_ids[:2]
+    page = other.search(u1['token'], 'abcd', 2, page['cursor'])
+    assert [m['message_id'] for m in page['messages']] == m_ids[2:]
+    assert page['cursor'] is None
+
+def test_search_pages_invalid(search_fixture):
+    '''An invalid limit or cursor raises an InputError.'''
+    (_, u1, _, _) = search_fixture
+    with pytest.raises(InputError):
+        other.search(u1['token'], 'Message', 0)
+    with pytest.raises(InputError):
+        other.search(u1['token'], 'Message', 2, 'not a cursor')
@@ -0,0 +1,118 @@
+'''
+Background persister
+
+Routes only change the in memory database. The persister writes the changes to
+disk on its own thread, either every FLUSH_INTERVAL seconds or as soon as
+FLUSH_CHANGES changes are waiting, so many requests share one write.
+'''
+from threading import Condition, Thread
+import data
+
+# seconds between flushes while there are waiting changes
+FLUSH_INTERVAL = 1.0
+# flush straight away once this many changes are waiting
+FLUSH_CHANGES = 100
+
+database = None
+changes = 0
+condition = Condition()
+thread = None
+running = False
+
+def mark_dirty(op, args, result):
+    '''
+    Count a mutation of the database, called for every journaled change.
+
+    Args:
+        op (str): name of the data helper that made the change.
+        args (tuple): arguments it was called with.
+        result: what it returned.
+
+    Return:
+        None
+    '''
+    global changes
+    with condition:
+        changes += 1
+        if changes >= FLUSH_CHANGES:
+            condition.notify()
+
+def flush():
+    '''
+    Write every waiting change to disk now.
+
+    Args:
+        NA
+
+    Return:
+        None
+    '''
+    global changes
+    if database is None:
+        return
+    with condition:
+        changes = 0
+    data.commit(database)
+
+def run():
+    '''
+    Body of the persister thread, flush waiting changes until stopped.
+
+    Args:
+        NA
+
+    Return:
+        None
+    '''
+    while True:
+        with condition:
+            condition.wait_for(lambda: not running or changes >= FLUSH_CHANGES,
+                               timeout=FLUSH_INTERVAL)
+            if not running:
+                break
+            if changes == 0:
+                continue
+        flush()
+
+def start(filename):
+    '''
+    Start persisting the database into filename in the background.
+
+    Args:
+        filename (str): file the database was loaded from.
+
+    Return:
+        None
+    '''
+    global database
+    global running
+    global thread
+    if running:
+        return
+    database = filename
+    running = True
+    data.journal_listeners.append(mark_dirty)
+    thread = Thread(target=run, daemon=True)
+    thread.start()
+
+def stop():
+    '''
+    Stop the persister thread and write out what it had not flushed yet.
+
+    Args:
+        NA
+
+    Return:
+        None
+    '''
+    global running
+    global thread
+    if not running:
+        return
+    with condition:
+        running = False
+        condition.notify()
+    thread.join()
+    thread = None
+    data.journal_listeners.remove(mark_dirty)
+    flush()
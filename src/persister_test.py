@@ -0,0 +1,70 @@
+import other
+import auth
+import channel
+import channels
+import data
+import message
+import persister
+import pytest
+from time import sleep
+
+@pytest.fixture
+def database(tmp_path):
+    other.clear()
+    database = str(tmp_path / "database.json")
+    data.load(database)
+    yield database
+    persister.stop()
+    other.clear()
+
+def journal_lines(database):
+    try:
+        with open(database + '.journal', 'r') as FILE:
+            return len(FILE.readlines())
+    except FileNotFoundError:
+        return 0
+
+def test_persister_interval(database, monkeypatch):
+    '''
+    waiting changes are written after the flush interval
+    '''
+
+    monkeypatch.setattr(persister, 'FLUSH_INTERVAL', 0.1)
+    persister.start(database)
+    auth.auth_register('user1@gmail.com', 'password1', 'name_1', 'surname_1')
+    assert journal_lines(database) == 0
+    sleep(0.5)
+    assert journal_lines(database) == 2
+
+def test_persister_changes(database, monkeypatch):
+    '''
+    reaching the change threshold flushes without waiting for the interval
+    '''
+
+    monkeypatch.setattr(persister, 'FLUSH_INTERVAL', 60)
+    monkeypatch.setattr(persister, 'FLUSH_CHANGES', 5)
+    persister.start(database)
+    token = auth.auth_register('user1@gmail.com', 'password1', 'name_1', 'surname_1')['token']
+    channels.channels_create(token, 'channel1', True)
+    assert journal_lines(database) == 0
+    auth.auth_register('user2@gmail.com', 'password2', 'name_2', 'surname_2')
+    sleep(0.5)
+    assert journal_lines(database) == 5
+
+def test_persister_stop(database, monkeypatch):
+    '''
+    stopping the persister writes out every change it had not flushed
+    '''
+
+    monkeypatch.setattr(persister, 'FLUSH_INTERVAL', 60)
+    persister.start(database)
+    token = auth.auth_register('user1@gmail.com', 'password1', 'name_1', 'surname_1')['token']
+    c_id = channels.channels_create(token, 'channel1', True)['channel_id']
+    message.message_send(token, c_id, 'message')
+    persister.stop()
+    assert journal_lines(database) == 4
+
+    other.clear()
+    data.load(database)
+    messages = channel.channel_messages(token, c_id, 0)['messages']
+    assert [m['message'] for m in messages] == ['message']
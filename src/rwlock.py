@@ -0,0 +1,96 @@
+'''
+Reader/writer lock
+
+Any number of threads can hold the read side at once, the write side is held
+by one thread with no readers. Waiting writers go before new readers, so a
+steady stream of reads can not starve the writes.
+
+Both sides are reentrant. The thread holding the write side can also take the
+read side, but a thread holding only the read side can not take the write
+side, as two such threads would wait on each other forever.
+'''
+from threading import Condition, Lock, get_ident, local
+
+class ReadWriteLock:
+    '''
+    Lock with a shared read side and an exclusive write side, used as
+    "with lock.read:" and "with lock.write:".
+    '''
+
+    def __init__(self):
+        self.condition = Condition(Lock())
+        # threads holding the read side, not counting the writer
+        self.readers = 0
+        self.writer = None
+        self.writer_depth = 0
+        self.writers_waiting = 0
+        # how deep each thread is in the read side, and whether it counts
+        # in readers (it does not if it held the write side when it started)
+        self.state = local()
+        self.read = Side(self.acquire_read, self.release_read)
+        self.write = Side(self.acquire_write, self.release_write)
+
+    def acquire_read(self):
+        ''' Take the read side, waiting while a writer holds or waits for the lock. '''
+        depth = getattr(self.state, 'depth', 0)
+        if depth == 0:
+            with self.condition:
+                if self.writer == get_ident():
+                    self.state.counted = False
+                else:
+                    self.condition.wait_for(lambda: self.writer is None and not self.writers_waiting)
+                    self.readers += 1
+                    self.state.counted = True
+        self.state.depth = depth + 1
+
+    def release_read(self):
+        ''' Give back the read side. '''
+        self.state.depth -= 1
+        if self.state.depth == 0 and self.state.counted:
+            with self.condition:
+                self.readers -= 1
+                if self.readers == 0:
+                    self.condition.notify_all()
+
+    def acquire_write(self):
+        ''' Take the write side, waiting for the writer and the readers to leave. '''
+        with self.condition:
+            if self.writer == get_ident():
+                self.writer_depth += 1
+                return
+            if getattr(self.state, 'depth', 0):
+                raise RuntimeError('can not take the write side while holding the read side')
+            self.writers_waiting += 1
+            try:
+                self.condition.wait_for(lambda: self.writer is None and self.readers == 0)
+            finally:
+                self.writers_waiting -= 1
+            self.writer = get_ident()
+            self.writer_depth = 1
+
+    def release_write(self):
+        ''' Give back the write side. '''
+        with self.condition:
+            self.writer_depth -= 1
+            if self.writer_depth:
+                return
+            self.writer = None
+            # a read taken while writing goes on as an ordinary read
+            if getattr(self.state, 'depth', 0) and not self.state.counted:
+                self.readers += 1
+                self.state.counted = True
+            self.condition.notify_all()
+
+class Side:
+    ''' One side of a ReadWriteLock, usable in a with statement. '''
+
+    def __init__(self, acquire, release):
+        self.acquire = acquire
+        self.release = release
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -0,0 +1,90 @@
+import pytest
+from rwlock import ReadWriteLock
+from threading import Barrier, Thread
+from time import sleep
+
+def test_readers_together():
+    '''
+    readers hold the lock at the same time
+    '''
+
+    lock = ReadWriteLock()
+    barrier = Barrier(3, timeout=5)
+    def read():
+        with lock.read:
+            barrier.wait()
+    threads = [Thread(target=read) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    # every reader is inside the lock when the barrier breaks
+    barrier.wait()
+    for thread in threads:
+        thread.join()
+
+def test_writer_alone():
+    '''
+    a writer waits for the readers and later readers wait for the writer,
+    even when they come before the writer gets the lock
+    '''
+
+    lock = ReadWriteLock()
+    events = []
+    def write():
+        with lock.write:
+            events.append('write')
+    def read():
+        with lock.read:
+            events.append('read')
+
+    with lock.read:
+        writer = Thread(target=write)
+        writer.start()
+        sleep(0.2)
+        reader = Thread(target=read)
+        reader.start()
+        sleep(0.2)
+        assert events == []
+    writer.join()
+    reader.join()
+    assert events == ['write', 'read']
+
+def test_reentrant():
+    '''
+    both sides can be taken again by the thread holding them, and the writer
+    can read, but a reader can not write
+    '''
+
+    lock = ReadWriteLock()
+    with lock.write:
+        with lock.write:
+            with lock.read:
+                pass
+    with lock.read:
+        with lock.read:
+            with pytest.raises(RuntimeError):
+                lock.write.acquire()
+    # every side was given back
+    with lock.write:
+        pass
+
+def test_read_after_write():
+    '''
+    a read taken while writing is still a read once the write is given back
+    '''
+
+    lock = ReadWriteLock()
+    events = []
+    def write():
+        with lock.write:
+            events.append('write')
+
+    lock.write.acquire()
+    lock.read.acquire()
+    lock.write.release()
+    writer = Thread(target=write)
+    writer.start()
+    sleep(0.2)
+    assert events == []
+    lock.read.release()
+    writer.join()
+    assert events == ['write']
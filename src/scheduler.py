@@ -0,0 +1,210 @@
+'''
+Scheduler
+
+One thread runs every timed callback of the server: scheduled messages from
+message_sendlater and the end of standups. Callbacks are kept on a heap by due
+time and the thread sleeps until the earliest one, so the number of threads
+does not grow with the number of waiting callbacks.
+
+Tests can replace clock with a virtual clock and call run_due after moving it
+forward, without starting the thread.
+'''
+from heapq import heappop, heappush
+from itertools import count
+from threading import Condition, Thread
+from time import time
+import traceback
+
+# returns the current timestamp, tests may swap it for a virtual clock
+clock = time
+
+condition = Condition()
+# [due time, order, callback, args] of every waiting timer, earliest first.
+# The callback of a cancelled timer is set to None.
+timers = []
+order = count()
+thread = None
+running = False
+
+def call_at(when, callback, *args):
+    '''
+    Call callback(*args) on the scheduler thread once clock() reaches when.
+
+    Args:
+        when (float): timestamp to call it at.
+        callback (function): function to call.
+        args: arguments to call it with.
+
+    Return:
+        timer (list): handle to pass to cancel.
+    '''
+    timer = [when, next(order), callback, args]
+    with condition:
+        heappush(timers, timer)
+        # it may be due before the timer the thread is waiting for
+        if timers[0] is timer:
+            condition.notify()
+    return timer
+
+def call_later(delay, callback, *args):
+    '''
+    Call callback(*args) on the scheduler thread in delay seconds.
+
+    Args:
+        delay (float): seconds to wait, nothing is waited if it is negative.
+        callback (function): function to call.
+        args: arguments to call it with.
+
+    Return:
+        timer (list): handle to pass to cancel.
+    '''
+    return call_at(clock() + max(delay, 0), callback, *args)
+
+def cancel(timer):
+    '''
+    Stop a timer from being called, nothing happens if it was called already.
+
+    Args:
+        timer (list): handle returned by call_at or call_later.
+
+    Return:
+        None
+    '''
+    with condition:
+        timer[2] = None
+        timer[3] = ()
+
+def clear():
+    '''
+    Cancel every waiting timer.
+
+    Args:
+        NA
+
+    Return:
+        None
+    '''
+    with condition:
+        for timer in timers:
+            timer[2] = None
+            timer[3] = ()
+        timers.clear()
+
+def take_due():
+    '''
+    Take the earliest timer if it is due.
+
+    Args:
+        NA
+
+    Return:
+        (timer or None, due time of the earliest waiting timer or None)
+    '''
+    with condition:
+        while timers and timers[0][2] is None:
+            heappop(timers)
+        if not timers:
+            return (None, None)
+        if timers[0][0] <= clock():
+            return (heappop(timers), None)
+        return (None, timers[0][0])
+
+def call(timer):
+    '''
+    Call a timer's callback, an error in it does not stop the scheduler.
+
+    Args:
+        timer (list): timer taken from the heap.
+
+    Return:
+        None
+    '''
+    with condition:
+        (callback, args) = (timer[2], timer[3])
+    if callback is None:
+        return
+    try:
+        callback(*args)
+    except Exception:
+        traceback.print_exc()
+
+def run_due():
+    '''
+    Call every timer that is due by clock() on the calling thread.
+
+    Args:
+        NA
+
+    Return:
+        None
+    '''
+    while True:
+        (timer, _) = take_due()
+        if timer is None:
+            return
+        call(timer)
+
+def run():
+    '''
+    Body of the scheduler thread, call timers as they come due until stopped.
+
+    Args:
+        NA
+
+    Return:
+        None
+    '''
+    while True:
+        (timer, next_time) = take_due()
+        if timer is not None:
+            call(timer)
+            continue
+        with condition:
+            if not running:
+                break
+            # wait unless an earlier timer was added since take_due
+            if (timers[0][0] if timers else None) == next_time:
+                timeout = None if next_time is None else max(next_time - clock(), 0)
+                condition.wait(timeout)
+            if not running:
+                break
+
+def start():
+    '''
+    Start the scheduler thread, if it is not running already.
+
+    Args:
+        NA
+
+    Return:
+        None
+    '''
+    global running
+    global thread
+    with condition:
+        if running:
+            return
+        running = True
+    thread = Thread(target=run, daemon=True)
+    thread.start()
+
+def stop():
+    '''
+    Stop the scheduler thread. Waiting timers stay on the heap and are called
+    once the scheduler is started again.
+
+    Args:
+        NA
+
+    Return:
+        None
+    '''
+    global running
+    global thread
+    with condition:
+        if not running:
+            return
+        running = False
+        condition.notify()
+    thread.join()
+    thread = None
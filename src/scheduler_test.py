@@ -0,0 +1,145 @@
+import other
+import auth
+import channel
+import channels
+import data
+import message
+import scheduler
+import standup
+import pytest
+import threading
+from time import sleep, time
+
+@pytest.fixture
+def initialise():
+    other.clear()
+    user = auth.auth_register('user1@gmail.com', 'password1', 'name_1', 'surname_1')
+    c_id = channels.channels_create(user['token'], 'channel1', True)['channel_id']
+    yield (user, c_id)
+    scheduler.stop()
+    other.clear()
+
+@pytest.fixture
+def virtual_clock(monkeypatch):
+    '''
+    run the scheduler on a clock that only moves when the test moves it
+    '''
+
+    scheduler.stop()
+    now = [time()]
+    monkeypatch.setattr(scheduler, 'clock', lambda: now[0])
+    monkeypatch.setattr(scheduler, 'start', lambda: None)
+    return now
+
+def sent(token, c_id):
+    return [m['message'] for m in channel.channel_messages(token, c_id, 0)['messages']]
+
+def test_scheduler_one_thread(initialise):
+    '''
+    every scheduled message and standup is run by the one scheduler thread,
+    earliest first
+    '''
+
+    (user, c_id) = initialise
+    scheduler.stop()
+    threads = threading.active_count()
+    time_sent = int(time()) + 2
+    for i in range(40):
+        message.message_sendlater(user['token'], c_id, f'later {i}', time_sent + i % 2)
+    for i in range(20):
+        c_id_2 = channels.channels_create(user['token'], f'standup {i}', True)['channel_id']
+        standup.standup_start(user['token'], c_id_2, 1)
+    assert threading.active_count() == threads + 1
+    assert sent(user['token'], c_id) == []
+    sleep(4)
+    messages = sent(user['token'], c_id)[::-1]
+    assert messages == [f'later {i}' for i in range(0, 40, 2)] + [f'later {i}' for i in range(1, 40, 2)]
+    assert data.scheduled == {}
+    assert data.standups == {}
+
+def test_scheduler_earlier(initialise):
+    '''
+    a message scheduled before the one the scheduler waits for is sent first
+    '''
+
+    (user, c_id) = initialise
+    message.message_sendlater(user['token'], c_id, 'late', int(time()) + 30)
+    sleep(0.2)
+    message.message_sendlater(user['token'], c_id, 'early', int(time()) + 1)
+    sleep(2.5)
+    assert sent(user['token'], c_id) == ['early']
+
+def test_scheduler_virtual_clock(initialise, virtual_clock):
+    '''
+    timers run in due order once the virtual clock reaches them, cancelled
+    ones and errors do not stop the others
+    '''
+
+    calls = []
+    def fail():
+        raise ValueError('callback error')
+    scheduler.call_later(20, calls.append, 'second')
+    scheduler.call_later(10, calls.append, 'first')
+    scheduler.call_later(15, fail)
+    cancelled = scheduler.call_later(5, calls.append, 'cancelled')
+    scheduler.cancel(cancelled)
+
+    scheduler.run_due()
+    assert calls == []
+    virtual_clock[0] += 15
+    scheduler.run_due()
+    assert calls == ['first']
+    virtual_clock[0] += 5
+    scheduler.run_due()
+    assert calls == ['first', 'second']
+
+def test_scheduler_virtual_standup_sendlater(initialise, virtual_clock):
+    '''
+    standups end and scheduled messages are sent when the virtual clock
+    reaches them
+    '''
+
+    (user, c_id) = initialise
+    message.message_sendlater(user['token'], c_id, 'later', int(time()) + 3600)
+    standup.standup_start(user['token'], c_id, 60)
+    standup.standup_send(user['token'], c_id, 'standup')
+
+    virtual_clock[0] += 59
+    scheduler.run_due()
+    assert standup.standup_active(user['token'], c_id)['is_active'] == True
+    virtual_clock[0] += 1
+    scheduler.run_due()
+    assert standup.standup_active(user['token'], c_id)['is_active'] == False
+    assert sent(user['token'], c_id) == ['name_1surname_1: standup']
+
+    virtual_clock[0] += 3600
+    scheduler.run_due()
+    assert sent(user['token'], c_id) == ['later', 'name_1surname_1: standup']
+
+def test_scheduler_restore(initialise, tmp_path):
+    '''
+    scheduled messages are saved with the database and sent after loading it
+    '''
+
+    (user, c_id) = initialise
+    database = str(tmp_path / "database.json")
+    data.save(database)
+    m_id = message.message_sendlater(user['token'], c_id, 'later', int(time()) + 2)['message_id']
+    cancelled = message.message_sendlater(user['token'], c_id, 'cancelled', int(time()) + 2)['message_id']
+    message.message_sendlater_cancel(user['token'], cancelled)
+    scheduler.stop()
+    data.commit(database)
+
+    other.clear()
+    data.load(database)
+    assert list(data.scheduled) == [m_id]
+    message.message_sendlater_resume()
+    sleep(3.5)
+    messages = channel.channel_messages(user['token'], c_id, 0)['messages']
+    assert [(m['message_id'], m['message']) for m in messages] == [(m_id, 'later')]
+    data.commit(database)
+
+    other.clear()
+    data.load(database)
+    assert data.scheduled == {}
+    assert sent(user['token'], c_id) == ['later']
@@ -1,9 +1,9 @@
 from error import AccessError, InputError
 from flask_mail import Mail, Message
-from flask import Flask, request, send_from_directory
+from flask import Flask, Response, g, request, send_from_directory
 from json import dump, dumps
 from flask_cors import CORS
-from os import utime
+from os import environ, utime
 from datetime import datetime as dt, timezone, timedelta
 import base64
 import random
@@ -17,6 +17,11 @@ import channels
 import channel
 import message
 import standup
+import persister
+import scheduler
+import signal
+import updates
+import workers
 
 def defaultHandler(err):
     response = err.get_response()
@@ -41,21 +46,79 @@ APP.config.update(
 CORS(APP)
 mail = Mail(APP)
 
+# how the database is kept on disk: journal, snapshot, sqlite or sharded
+data.persistence_mode = environ.get('FLOCKR_PERSISTENCE', data.persistence_mode)
+# several server processes share the database, see workers.py
+workers.enabled = environ.get('FLOCKR_MULTI_WORKER') == '1'
+
 APP.config['TRAP_HTTP_EXCEPTIONS'] = True
 APP.register_error_handler(Exception, defaultHandler)
 
+# requests that take their own locks: /clear writes to disk, which takes the
+# commit lock before the write lock. In multi-worker mode every change takes
+# the commit lock first anyway.
+UNLOCKED_ENDPOINTS = ['clear']
+# requests that wait on other hosts (fetching a photo, sending mail) or for
+# updates take the data locks only around their use of the data, so they do
+# not hold up the others
+SLOW_ENDPOINTS = ['send_mail', 'profile_uploadphoto', 'channel_messages_poll']
+# changes whose data helper keeps the others out itself, so the request only
+# holds the read side: sends to the standups of different channels do not
+# wait for each other. In multi-worker mode they are changes like any other.
+SHARED_ENDPOINTS = ['standup_send']
+
+@APP.before_request
+def lock_data():
+    '''
+    hold the read side of the data lock for a GET request or one of
+    SHARED_ENDPOINTS, so they run in parallel, and the write side for any
+    other request, so its checks still hold when it makes its changes. In
+    multi-worker mode a GET first applies the changes of the other workers,
+    and any other request is a change of the data for all of them.
+    '''
+    if request.endpoint in UNLOCKED_ENDPOINTS and not workers.enabled:
+        return
+    if request.endpoint in SLOW_ENDPOINTS:
+        workers.catch_up()
+        return
+    if request.method == 'GET' or (request.endpoint in SHARED_ENDPOINTS and not workers.enabled):
+        workers.catch_up()
+        data.read_lock.acquire()
+        g.unlock_data = data.read_lock.release
+    else:
+        workers.begin_write()
+        g.unlock_data = workers.end_write
+
+@APP.teardown_request
+def unlock_data(exception):
+    '''
+    release the lock taken by lock_data
+    '''
+    unlock = g.pop('unlock_data', None)
+    if unlock is not None:
+        unlock()
+
 #------------------------------------routes for auth.py-------------------------------------
 @APP.before_first_request
 def init():
     '''
     load database into memory
     update host url
-    save status
-    '''
-    data.load("src/database.json")
+    save status and start writing changes to disk in the background, unless
+    the workers commit every change
+    start sending the scheduled messages and ending the standups
+    '''
+    if workers.enabled:
+        workers.start("src/database.json")
+    else:
+        data.load("src/database.json")
     data.host_update(request.host_url)
     data.img_url_update()
-    data.save("src/database.json")
+    if not workers.enabled:
+        data.save("src/database.json")
+        persister.start("src/database.json")
+    message.message_sendlater_resume()
+    standup.standup_resume()
 
 @APP.route("/auth/login", methods=['POST'])
 def login():
@@ -66,7 +129,6 @@ def login():
     '''
     input = request.get_json()
     output = auth.auth_login(input['email'], input['password'])
-    data.save("src/database.json")
     return dumps(output)
 
 @APP.route("/auth/logout", methods=['POST'])
@@ -79,7 +141,6 @@ def logout():
     '''
     input = request.get_json()
     output = auth.auth_logout(input['token'])
-    data.save("src/database.json")
     return dumps(output)
 
 @APP.route("/auth/register", methods=["POST"])
@@ -93,7 +154,6 @@ def register():
     input = request.get_json()
     output = auth.auth_register(input['email'], input['password'], input['name_first'], input['name_last'])
     data.add_img_url(output["u_id"], request.host_url)
-    data.save("src/database.json")
     return dumps(output)
 
 @APP.route('/auth/passwordreset/request', methods=["POST"])
@@ -104,15 +164,16 @@ def send_mail():
     Dumps: {reset_code} if email successfully sent, otherwise {}
     '''
     email = request.get_json()["email"]
-    account = data.account_search("email", email)
+    with workers.writing():
+        account = data.account_search("email", email)
+        if account:
+            code = data.reset_list_add(email, str(random.randint(100000,1000000)))
     if account:
-        code = data.reset_list_add(email, str(random.randint(100000,1000000)))
         try:
             msg = Message(f"Flockr: Reset password for {account['email']}",
             recipients=[email])
             msg.html = f"<h1>Password Reset</h1>\n<p>Dear {account['name_first'].capitalize()} {account['name_last'].capitalize()}, your reset code is <strong>{code}</strong>, please enter this code in flockr to verify your identity. Thank you.</p>"
             mail.send(msg)
-            data.save("src/database.json")
             return dumps ({
                 "reset_code": code
             })
@@ -123,7 +184,6 @@ def send_mail():
 def password_reset():
     input = request.get_json()
     output = auth.auth_setpassword(input["reset_code"], input["new_password"])
-    data.save("src/database.json")
     return dumps(output)
 
 #-----------------------------------routes for other.py----------------------------------------
@@ -134,7 +194,7 @@ def clear():
     Return {}.
     '''
     other.clear()
-    data.save("src/database.json")
+    persister.flush()
     return {}
 
 @APP.route('/users/all', methods=['GET'])
@@ -159,23 +219,41 @@ def admin_user_permission_change():
     u_id = int(payload['u_id'])
     permission_id = payload['permission_id']
     output = other.admin_userpermission_change(token, u_id, permission_id)
-    data.save("src/database.json")
     return dumps(output)
     
 @APP.route('/search', methods=['GET'])
 def other_search():
     '''
-    Given a query string, return all messages containing that
-    query string.
-    Return { messages }.
+    Given a query string, return the messages containing that
+    query string. With a limit or a cursor, return one page of them.
+    Return { messages } or { messages, cursor }.
     '''
     payload = request.args
     token = payload['token']
     query_str = payload['query_str']
-    output = other.search(token, query_str)
-    data.save("src/database.json")
+    limit = payload.get('limit')
+    cursor = payload.get('cursor')
+    if limit is None and cursor is None:
+        output = other.search(token, query_str)
+        return Response(stream_messages(output['messages']), content_type='application/json')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise InputError(description = 'Invalid limit')
+    output = other.search(token, query_str, limit, cursor)
     return dumps(output)
 
+def stream_messages(messages):
+    '''
+    write { messages } one message at a time, rather than building the
+    whole response in memory
+    '''
+    yield '{"messages": ['
+    for (i, message) in enumerate(messages):
+        yield (', ' if i else '') + dumps(message)
+    yield ']}'
+
 #------------------------------------routes for user.py-------------------------------------
 @APP.route("/user/profile", methods=["GET"])
 def profile():
@@ -197,7 +275,6 @@ def profile_setname():
     '''
     input = request.get_json()
     output = user.user_profile_setname(input['token'], input['name_first'], input['name_last'])
-    data.save("src/database.json")
     return dumps(output)
 
 @APP.route("/user/profile/setemail", methods=["PUT"])
@@ -208,7 +285,6 @@ def profile_setemail():
     '''
     input = request.get_json()
     output = user.user_profile_setemail(input['token'], input['email'])
-    data.save("src/database.json")
     return dumps(output)
 
 @APP.route("/user/profile/sethandle", methods=["PUT"])
@@ -219,7 +295,6 @@ def profile_sethandle():
     '''
     input = request.get_json()
     output = user.user_profile_sethandle(input['token'], input['handle_str'])
-    data.save("src/database.json")
     return dumps(output)
 
 @APP.route("/user/profile/uploadphoto", methods=["POST"])
@@ -238,7 +313,6 @@ def profile_uploadphoto():
     y_end = int(photo['y_end'])
     
     output = user.user_profile_uploadphoto(token, img_url, x_start, y_start, x_end, y_end)
-    data.save("src/database.json")
 
     return dumps(output)
 
@@ -256,7 +330,6 @@ def channels_create():
     '''
     payload = request.get_json()
     channel = channels.channels_create(payload['token'], payload['name'], bool(payload['is_public']))
-    data.save('src/database.json')
     return dumps(channel)
 
 @APP.route('/channels/listall', methods=['GET'])
@@ -303,7 +376,6 @@ def channel_invite():
     channel_id = int(payload['channel_id'])
     u_id = int(payload['u_id'])
     output = channel.channel_invite(token, channel_id, u_id)
-    data.save('src/database.json')
     return dumps(output)
 
 @APP.route('/channel/join', methods=['POST'])
@@ -316,7 +388,6 @@ def channel_join():
     token = payload['token']
     channel_id = int(payload['channel_id'])
     output = channel.channel_join(token, channel_id)
-    data.save('src/database.json')
     return dumps(output)
     
 @APP.route('/channel/leave', methods=['POST'])
@@ -328,7 +399,6 @@ def channel_leave():
     ''' 
     payload = request.get_json()
     output = channel.channel_leave(payload['token'], int(payload['channel_id']))
-    data.save('src/database.json')
     return dumps(output)
     
 @APP.route('/channel/addowner', methods=['POST'])
@@ -342,7 +412,6 @@ def channel_addowner():
     payload = request.get_json()
     output = channel.channel_addowner(payload['token'], int(payload['channel_id']), 
     int(payload['u_id']))
-    data.save('src/database.json')
     return dumps(output)
     
 @APP.route('/channel/removeowner', methods=['POST'])
@@ -356,7 +425,6 @@ def channel_removeowner():
     payload = request.get_json()
     output = channel.channel_removeowner(payload['token'], 
         int(payload['channel_id']), int(payload['u_id']))
-    data.save('src/database.json')
     return dumps(output)
 
 @APP.route('/channel/messages', methods=['GET'])
@@ -366,19 +434,57 @@ def channel_messages():
     takes in a valid token, a valid channel_id and a start int
     return a dictionary with a start, end and list of (end - start) messages
     return end as -1 if less that 50 messages left in the channel
+    or, given before_message_id or after_message_id instead of start,
+    the messages just before or after that message
 
     return {
         'messages': [],
         'start': start,
         'end': end,
     }
+    or {
+        'messages': [],
+        'before_message_id': before_message_id,
+        'after_message_id': after_message_id,
+    }
     '''
     token = request.args.get('token')
     channel_id = int(request.args.get('channel_id'))
-    start = int(request.args.get('start'))
-    messages = channel.channel_messages(token,channel_id,start)
+    start = int(request.args.get('start', 0))
+    before_message_id = request.args.get('before_message_id', type=int)
+    after_message_id = request.args.get('after_message_id', type=int)
+    messages = channel.channel_messages(token, channel_id, start, before_message_id, after_message_id)
     return dumps(messages)
 
+@APP.route('/channel/messages/poll', methods=['GET'])
+def channel_messages_poll():
+    '''
+    Long poll for the messages of a channel changed since a cursor.
+    takes in a valid token, a valid channel_id, the cursor returned by the
+    last poll ('' on the first) and optionally how many seconds to wait
+    return straight away if there are changes, else once there are some or
+    the wait (at most updates.POLL_TIMEOUT seconds) is over
+
+    return {
+        'cursor': cursor,
+        'reset': reset,
+        'messages': [],
+        'removed': [],
+    }
+    '''
+    token = request.args.get('token')
+    channel_id = int(request.args.get('channel_id'))
+    cursor = request.args.get('cursor', '')
+    timeout = min(request.args.get('timeout', updates.POLL_TIMEOUT, type=float), updates.POLL_TIMEOUT)
+    with data.read_lock:
+        output = channel.channel_messages_updates(token, channel_id, cursor)
+    if output['reset'] or output['messages'] or output['removed']:
+        return dumps(output)
+    updates.wait(channel_id, cursor, timeout)
+    with data.read_lock:
+        output = channel.channel_messages_updates(token, channel_id, cursor)
+    return dumps(output)
+
 #----------------------------------routes for message.py--------------------------------------
 @APP.route('/message/send', methods=['POST'])
 def message_send():
@@ -390,7 +496,6 @@ def message_send():
 
     payload = request.get_json()
     message_id = message.message_send(payload['token'], int(payload['channel_id']), payload['message'])
-    data.save('src/database.json')
     return dumps(message_id)
 
 @APP.route('/message/remove', methods=['DELETE'])
@@ -413,7 +518,6 @@ def message_edit():
     payload = request.get_json()
     output = message.message_edit(payload['token'], int(payload['message_id']), 
         payload['message'])
-    data.save('src/database.json')
     return dumps(output)
 
 @APP.route('/message/pin', methods=['POST'])
@@ -425,7 +529,6 @@ def message_pin():
 
     payload = request.get_json()
     pin_return = message.message_pin(payload['token'], int(payload['message_id']))
-    data.save('src/database.json')
     return dumps(pin_return)
 
 @APP.route('/message/unpin', methods=['POST'])
@@ -434,7 +537,6 @@ def message_unpin():
 
     payload = request.get_json()
     unpin_return = message.message_unpin(payload['token'], int(payload['message_id']))
-    data.save('src/database.json')
     return dumps(unpin_return)
 
 @APP.route('/message/react', methods=['POST'])
@@ -445,7 +547,6 @@ def message_react():
     '''
     payload = request.get_json()
     react = message.message_react(payload['token'],int(payload['message_id']), int(payload['react_id']))
-    data.save('src/database.json')
     return dumps(react)
 
 @APP.route('/message/unreact', methods=['POST'])
@@ -456,7 +557,6 @@ def message_unreact():
     '''
     payload = request.get_json()
     unreact = message.message_unreact(payload['token'],int(payload['message_id']), int(payload['react_id']))
-    data.save('src/database.json')
     return dumps(unreact)
 
 
@@ -474,9 +574,28 @@ def message_sendlater():
     send_time = int(payload['time_sent'])
 
     to_send = message.message_sendlater(token, c_id, m, send_time)
-    data.save('src/database.json')
     return dumps(to_send)
 
+@APP.route('/message/sendlater/list', methods=['GET'])
+def message_sendlater_list():
+    '''
+    List the messages the authorised user has scheduled in a channel
+    that have not been sent yet.
+    Return { messages }.
+    '''
+    payload = request.args
+    output = message.message_sendlater_list(payload['token'], int(payload['channel_id']))
+    return dumps(output)
+
+@APP.route('/message/sendlater/cancel', methods=['POST'])
+def message_sendlater_cancel():
+    '''
+    Cancel a scheduled message before it is sent.
+    '''
+    payload = request.get_json()
+    output = message.message_sendlater_cancel(payload['token'], int(payload['message_id']))
+    return dumps(output)
+
 
 #------------------------------routes for standup-------------------------------
 @APP.route('/standup/start', methods=['POST'])
@@ -488,7 +607,6 @@ def standup_start():
     payload = request.get_json()
     time_finish = standup.standup_start(payload['token'], int(payload['channel_id']),
         int(payload['length']))
-    data.save('src/database.json')
     return dumps(time_finish)
     
 @APP.route('/standup/active', methods=['GET'])
@@ -499,7 +617,6 @@ def standup_active():
     """
     payload = request.args
     result = standup.standup_active(payload['token'], int(payload['channel_id']))
-    data.save('src/database.json')
     return dumps(result)
     
 @APP.route('/standup/send', methods=['POST'])
@@ -511,8 +628,17 @@ def standup_send():
     payload = request.get_json()
     output = standup.standup_send(payload['token'], int(payload['channel_id']),
     payload['message'])
-    data.save('src/database.json')
     return dumps(output)
 
+def shutdown(signum, frame):
+    '''
+    stop sending scheduled messages, flush the changes the persister has
+    not written yet, then exit
+    '''
+    scheduler.stop()
+    persister.stop()
+    sys.exit(0)
+
 if __name__ == "__main__":
-    APP.run(port=0)
+    signal.signal(signal.SIGTERM, shutdown)
+    APP.run(port=0, threaded=True)
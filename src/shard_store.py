@@ -0,0 +1,540 @@
+'''
+Sharded on-disk layout
+
+<directory>/core.json keeps everything but the messages: users, sessions,
+channels with their members, and for each channel the length of its log and
+the removed positions.
+<directory>/<channel_id>/<segment>.json keeps SEGMENT_SIZE positions of a
+channel's log, oldest first, with null for removed messages.
+<directory>/<channel_id>/<segment>.trigrams.json keeps the message_ids of the
+segment's messages containing each trigram, so a search can index a channel
+without reading its segments in.
+<directory>/locator/<page>.json maps the message_ids of a page of
+LOCATOR_PAGE ids to the [channel_id, segment] holding them, so a message that
+is not in memory is found by reading one segment.
+
+Segments are read on first access and evicted, least recently used first,
+once more than MESSAGE_BUDGET messages are in memory. Segments changed since
+the last commit stay in memory until they are written.
+'''
+import json
+import os
+import shutil
+from collections import OrderedDict
+from json import dumps
+from threading import RLock
+import data
+
+SEGMENT_SIZE = 1000
+MESSAGE_BUDGET = 100000
+LOCATOR_PAGE = 1000
+# locator pages kept in memory
+LOCATOR_CACHE = 64
+
+directory = None
+# (channel_id, segment) -> log of every segment in memory, least recently used first
+resident = OrderedDict()
+resident_count = 0
+# (channel_id, segment) -> log of the segments changed since the last commit
+dirty = {}
+# segments the commit in progress is writing, they can not be evicted yet
+writing = set()
+# channel_id -> log whose segments are in the channel's directory
+on_disk = {}
+core_dirty = False
+# page -> {str(message_id): [channel_id, segment]} of the locator pages read,
+# least recently used first
+located = OrderedDict()
+# message_id -> [channel_id, segment], or None once removed, of the changes
+# to the locator not written yet
+locating = {}
+# set by a clear until the next commit removes the locator files
+locator_cleared = False
+# held while reading, evicting or marking segments. Readers of the data only
+# hold its read side, so reads of different threads can load segments at once.
+store_lock = RLock()
+
+class MessageLog:
+    '''
+    The message log of a channel, oldest first with None for removed messages,
+    read from its segment files as positions are accessed.
+    '''
+
+    def __init__(self, channel_id, length=0):
+        self.channel_id = channel_id
+        self.length = length
+        self.segments = [None] * -(-length // SEGMENT_SIZE)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += self.length
+        if not 0 <= position < self.length:
+            raise IndexError('message log index out of range')
+        return self.segment(position // SEGMENT_SIZE)[position % SEGMENT_SIZE]
+
+    def __setitem__(self, position, message):
+        if not 0 <= position < self.length:
+            raise IndexError('message log index out of range')
+        segment = position // SEGMENT_SIZE
+        with store_lock:
+            messages = self.segment(segment)
+            removed = messages[position % SEGMENT_SIZE]
+            if message is None and removed is not None:
+                locating[removed['message_id']] = None
+            messages[position % SEGMENT_SIZE] = message
+            dirty[(self.channel_id, segment)] = self
+
+    def __iter__(self):
+        for segment in range(len(self.segments)):
+            yield from list(self.segment(segment))
+
+    def append(self, message):
+        global resident_count
+        segment = self.length // SEGMENT_SIZE
+        with store_lock:
+            if segment == len(self.segments):
+                self.segments.append([])
+                resident[(self.channel_id, segment)] = self
+            self.segment(segment).append(message)
+            self.length += 1
+            resident_count += 1
+            locating[message['message_id']] = [self.channel_id, segment]
+            dirty[(self.channel_id, segment)] = self
+            evict((self.channel_id, segment))
+
+    def segment(self, segment):
+        ''' Return the messages of a segment, reading it from disk if needed. '''
+        with store_lock:
+            if self.segments[segment] is None:
+                read_segment(self, segment)
+            else:
+                resident.move_to_end((self.channel_id, segment))
+            return self.segments[segment]
+
+    def loaded(self):
+        ''' Iterate over the messages of the segments in memory. '''
+        for segment in list(self.segments):
+            if segment is not None:
+                yield from (message for message in segment if message is not None)
+
+def segment_filename(channel_id, segment):
+    ''' Return the file a segment of a channel is kept in. '''
+    return os.path.join(directory, str(channel_id), f'{segment}.json')
+
+def postings_filename(channel_id, segment):
+    ''' Return the file the trigrams of a segment of a channel are kept in. '''
+    return os.path.join(directory, str(channel_id), f'{segment}.trigrams.json')
+
+def segment_postings(messages):
+    '''
+    Return {trigram: message_ids} of the messages of a segment.
+    Args: messages of the segment, None for removed ones
+    '''
+
+    postings = {}
+    for message in messages:
+        if message is not None:
+            for trigram in data.trigrams(message['message']):
+                postings.setdefault(trigram, []).append(message['message_id'])
+    return postings
+
+def trigram_postings(channel_id):
+    '''
+    Return {trigram: message_ids} of a channel's messages, from the segments
+    in memory and the trigram files of the others. The segments on disk are
+    not read in, so a search does not push the others out of memory.
+    Args: channel_id
+    '''
+
+    log = data.channels[channel_id]['messages']
+    # changed segments are in memory until written, so the files of the
+    # others are up to date
+    with store_lock:
+        segments = list(log.segments)
+    postings = {}
+    for (segment, messages) in enumerate(segments):
+        if messages is None:
+            found = read_postings(log, segment)
+        else:
+            found = segment_postings(messages)
+        for (trigram, message_ids) in found.items():
+            postings.setdefault(trigram, set()).update(message_ids)
+    return postings
+
+def read_postings(log, segment):
+    '''
+    Read the trigrams of a segment on disk, from the segment itself if it was
+    written before trigram files were kept.
+    Args: log, number of the segment
+    '''
+
+    try:
+        with open(postings_filename(log.channel_id, segment), 'r') as FILE:
+            return json.load(FILE)
+    except FileNotFoundError:
+        size = min(SEGMENT_SIZE, log.length - segment * SEGMENT_SIZE)
+        with open(segment_filename(log.channel_id, segment), 'r') as FILE:
+            return segment_postings(json.load(FILE)[:size])
+
+def read_segment(log, segment):
+    '''
+    Read a segment of a log from disk and index its messages.
+    Args: log, number of the segment
+    '''
+
+    global resident_count
+    size = min(SEGMENT_SIZE, log.length - segment * SEGMENT_SIZE)
+    with open(segment_filename(log.channel_id, segment), 'r') as FILE:
+        messages = json.load(FILE)[:size]
+    log.segments[segment] = messages
+    for (offset, message) in enumerate(messages):
+        if message is not None:
+            message['reacts'] = data.load_reacts(message['reacts'])
+            data.message_index[message['message_id']] = (log.channel_id, segment * SEGMENT_SIZE + offset)
+    resident[(log.channel_id, segment)] = log
+    resident_count += len(messages)
+    evict((log.channel_id, segment))
+
+def evict(keep):
+    '''
+    Drop the least recently used unchanged segments until the messages in
+    memory fit MESSAGE_BUDGET.
+    Args: (channel_id, segment) that must stay
+    '''
+
+    global resident_count
+    for key in list(resident):
+        if resident_count <= MESSAGE_BUDGET:
+            break
+        if key == keep or key in dirty or key in writing:
+            continue
+        log = resident.pop(key)
+        messages = log.segments[key[1]]
+        log.segments[key[1]] = None
+        resident_count -= len(messages)
+        if data.channels.get(log.channel_id, {}).get('messages') is log:
+            for message in messages:
+                if message is not None:
+                    data.message_index.pop(message['message_id'], None)
+
+def adopt(channel):
+    '''
+    Replace a channel's list of messages by a log, with every segment in
+    memory and still to be written.
+    Args: channel
+    '''
+
+    global resident_count
+    messages = channel['messages']
+    log = MessageLog(channel['channel_id'])
+    for start in range(0, len(messages), SEGMENT_SIZE):
+        segment = len(log.segments)
+        log.segments.append(messages[start:start + SEGMENT_SIZE])
+        for message in log.segments[-1]:
+            if message is not None:
+                locating[message['message_id']] = [log.channel_id, segment]
+        resident[(log.channel_id, segment)] = log
+        dirty[(log.channel_id, segment)] = log
+    log.length = len(messages)
+    resident_count += len(messages)
+    channel['messages'] = log
+
+def open_store(name):
+    '''
+    Start keeping the database in directory name.
+    Args: directory of the sharded database
+    Return: True if the directory holds no database yet
+    '''
+
+    global directory
+    close_store()
+    directory = name
+    os.makedirs(directory, exist_ok=True)
+    data.journal_listeners.append(touch)
+    data.message_loader = find_message
+    data.trigram_loader = trigram_postings
+    return not os.path.exists(os.path.join(directory, 'core.json'))
+
+def close_store():
+    ''' Stop keeping the database in the directory and forget its segments. '''
+
+    global directory
+    global resident_count
+    global core_dirty
+    global locator_cleared
+    if touch in data.journal_listeners:
+        data.journal_listeners.remove(touch)
+    if data.message_loader is find_message:
+        data.message_loader = None
+    if data.trigram_loader is trigram_postings:
+        data.trigram_loader = None
+    directory = None
+    resident.clear()
+    resident_count = 0
+    dirty.clear()
+    writing.clear()
+    on_disk.clear()
+    core_dirty = False
+    located.clear()
+    locating.clear()
+    locator_cleared = False
+
+def touch(op, args, result):
+    '''
+    Note what a journaled data helper changed.
+    Args: name of the helper, its arguments and its return value
+    '''
+
+    global core_dirty
+    global locator_cleared
+    core_dirty = True
+    if op == 'clear':
+        with store_lock:
+            located.clear()
+            locating.clear()
+            locator_cleared = True
+    elif op in ['edit_message', 'set_pinned']:
+        touch_message(args[0])
+    elif op in ['message_react_to', 'message_unreact_to']:
+        touch_message(args[1])
+
+def touch_message(message_id):
+    ''' Note that a message was changed in place. '''
+
+    if message_id in data.message_index:
+        (channel_id, position) = data.message_index[message_id]
+        log = data.channels[channel_id]['messages']
+        if isinstance(log, MessageLog):
+            dirty[(channel_id, position // SEGMENT_SIZE)] = log
+
+def find_message(message_id):
+    ''' Read the segment holding message_id, if it is in one on disk. '''
+
+    with store_lock:
+        location = locate(message_id)
+        if location is None:
+            return
+        (channel_id, segment) = location
+        # a channel deleted since keeps its entries until the ids are reused
+        log = data.channels.get(channel_id, {}).get('messages')
+        if isinstance(log, MessageLog) and segment < len(log.segments):
+            log.segment(segment)
+
+def locator_filename(page):
+    ''' Return the file a page of the locator is kept in. '''
+    return os.path.join(directory, 'locator', f'{page}.json')
+
+def read_locator(page):
+    ''' Return the entries of a locator page on disk, {} if it has none. '''
+
+    try:
+        with open(locator_filename(page), 'r') as FILE:
+            return json.load(FILE)
+    except FileNotFoundError:
+        return {}
+
+def locate(message_id):
+    '''
+    Return [channel_id, segment] of the segment holding a message, None if
+    none does. Called with store_lock held, so a commit writing the locator
+    drops the pages it changed after any read of them.
+    Args: message_id
+    '''
+
+    if message_id in locating:
+        return locating[message_id]
+    if locator_cleared:
+        return None
+    page = message_id // LOCATOR_PAGE
+    if page in located:
+        located.move_to_end(page)
+    else:
+        located[page] = read_locator(page)
+        while len(located) > LOCATOR_CACHE:
+            located.popitem(last=False)
+    return located[page].get(str(message_id))
+
+def write_locator(changes, cleared):
+    '''
+    Write changes to the locator, by commit which is the only writer.
+    Args: {message_id: [channel_id, segment] or None}, whether a clear emptied
+        the locator first
+    '''
+
+    if cleared:
+        shutil.rmtree(os.path.join(directory, 'locator'), ignore_errors=True)
+    pages = {}
+    for (message_id, location) in changes.items():
+        pages.setdefault(message_id // LOCATOR_PAGE, {})[str(message_id)] = location
+    os.makedirs(os.path.join(directory, 'locator'), exist_ok=True)
+    for (page, entries) in pages.items():
+        content = {} if cleared else read_locator(page)
+        for (message_id, location) in entries.items():
+            if location is None:
+                content.pop(message_id, None)
+            else:
+                content[message_id] = location
+        write_file(locator_filename(page), dumps(content))
+    with store_lock:
+        for page in pages:
+            located.pop(page, None)
+        for (message_id, location) in changes.items():
+            if message_id in locating and locating[message_id] == location:
+                del locating[message_id]
+
+def core():
+    ''' Return everything but the messages, as kept in core.json. '''
+
+    saved_channels = []
+    for channel in data.channels.values():
+        saved = {key: value for (key, value) in channel.items() if key != 'messages'}
+        saved['length'] = channel['messages'].length
+        saved['removed'] = data.message_tombstones.get(channel['channel_id'], [])
+        saved_channels.append(saved)
+    return {
+        "u_id_stat": data.u_id_stat,
+        "channel_id_stat": data.channel_id_stat,
+        "message_id_stat": data.message_id_stat,
+        "journal_seq": data.journal_seq,
+        "users": data.users,
+        "sessions": list(data.sessions.values()),
+        "channels": saved_channels,
+        "reset_list": data.reset_list,
+        "scheduled": list(data.scheduled.values()),
+        "standups": [data.saved_standup(standup) for standup in data.standups.values()],
+        # the locator has every message written
+        "located": True,
+    }
+
+def write_file(filename, content):
+    ''' Write a file through a temporary one, so a crash never leaves half of it. '''
+
+    with open(filename + '.tmp', 'w') as FILE:
+        FILE.write(content)
+        FILE.flush()
+        os.fsync(FILE.fileno())
+    os.replace(filename + '.tmp', filename)
+
+def commit():
+    ''' Write the core file and the segments changed since the last commit. '''
+
+    global core_dirty
+    global locator_cleared
+    with data.write_lock, store_lock:
+        for channel in data.channels.values():
+            if isinstance(channel['messages'], list):
+                adopt(channel)
+        # directories of channels that were deleted, or whose id was reused
+        # after a clear
+        stale = [channel_id for (channel_id, log) in on_disk.items()
+                 if data.channels.get(channel_id, {}).get('messages') is not log]
+        for channel_id in stale:
+            del on_disk[channel_id]
+        for (key, log) in list(resident.items()):
+            if data.channels.get(key[0], {}).get('messages') is not log:
+                drop(key)
+        segments = {}
+        postings = {}
+        for (key, log) in dirty.items():
+            if data.channels.get(key[0], {}).get('messages') is log:
+                segments[key] = dumps(log.segments[key[1]], default=data.encode_set)
+                postings[key] = dumps(segment_postings(log.segments[key[1]]))
+                on_disk[key[0]] = log
+                writing.add(key)
+        dirty.clear()
+        content = dumps(core()) if core_dirty or segments or stale else None
+        core_dirty = False
+        (changes, cleared) = (dict(locating), locator_cleared)
+        locator_cleared = False
+
+    try:
+        for channel_id in stale:
+            shutil.rmtree(os.path.join(directory, str(channel_id)), ignore_errors=True)
+        for ((channel_id, segment), messages) in segments.items():
+            os.makedirs(os.path.join(directory, str(channel_id)), exist_ok=True)
+            # trigrams first: ones of messages not written yet only make
+            # candidates a search drops, missing ones would hide messages
+            write_file(postings_filename(channel_id, segment), postings[(channel_id, segment)])
+            write_file(segment_filename(channel_id, segment), messages)
+        # the locator only points to segments written
+        if changes or cleared:
+            write_locator(changes, cleared)
+        # the core file goes last, it must not mention segments not yet written
+        if content is not None:
+            write_file(os.path.join(directory, 'core.json'), content)
+    finally:
+        with store_lock:
+            writing.clear()
+
+def drop(key):
+    ''' Forget a segment of a log that is no longer in use. '''
+
+    global resident_count
+    log = resident.pop(key)
+    if log.segments[key[1]] is not None:
+        resident_count -= len(log.segments[key[1]])
+    dirty.pop(key, None)
+
+def save():
+    ''' Write the core file and every segment in memory. '''
+
+    global core_dirty
+    with data.write_lock, store_lock:
+        for channel in data.channels.values():
+            if isinstance(channel['messages'], list):
+                adopt(channel)
+        for (key, log) in resident.items():
+            dirty[key] = log
+        core_dirty = True
+    commit()
+
+def load():
+    '''
+    Read core.json and give every channel a log that reads its segments on
+    access.
+    Return: database as read from core.json
+    '''
+
+    global resident_count
+    with open(os.path.join(directory, 'core.json'), 'r') as FILE:
+        database = json.load(FILE)
+    logs = {}
+    for channel in database['channels']:
+        channel.pop('ranges', None)
+        log = MessageLog(channel['channel_id'], channel.pop('length'))
+        logs[channel['channel_id']] = (log, channel.pop('removed'))
+        channel['messages'] = []
+    data.restore(database)
+
+    resident.clear()
+    resident_count = 0
+    dirty.clear()
+    on_disk.clear()
+    for (channel_id, (log, removed)) in logs.items():
+        data.channels[channel_id]['messages'] = log
+        if removed:
+            data.message_tombstones[channel_id] = removed
+        on_disk[channel_id] = log
+    if not database.pop('located', False):
+        locate_everything(logs)
+    return database
+
+def locate_everything(logs):
+    '''
+    Fill the locator of a database written before it was kept, reading each
+    segment once without keeping it in memory.
+    Args: channel_id -> (log, removed positions)
+    '''
+
+    global core_dirty
+    for (channel_id, (log, _)) in logs.items():
+        for segment in range(len(log.segments)):
+            size = min(SEGMENT_SIZE, log.length - segment * SEGMENT_SIZE)
+            with open(segment_filename(channel_id, segment), 'r') as FILE:
+                for message in json.load(FILE)[:size]:
+                    if message is not None:
+                        locating[message['message_id']] = [channel_id, segment]
+    core_dirty = True
@@ -0,0 +1,542 @@
+'''
+SQLite persistence
+
+The database is only a persistence format, like the snapshot and the journal:
+load reads every table into memory, and lookups and pages are answered from
+the in-memory data as in the other modes. Commits write the rows changed since
+the last one, so a save does not rewrite everything.
+
+The only index besides the primary keys is on the channel_id of messages, for
+the deletes of a removed channel. Indexes kept by databases written before
+they were dropped are removed when the database is opened.
+'''
+import json
+import random
+import sqlite3
+from threading import Lock
+import data
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+    u_id INTEGER PRIMARY KEY,
+    email TEXT NOT NULL,
+    name_first TEXT NOT NULL,
+    name_last TEXT NOT NULL,
+    password TEXT NOT NULL,
+    handle_str TEXT NOT NULL,
+    is_global_owner INTEGER NOT NULL,
+    profile_img_url TEXT
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    token TEXT PRIMARY KEY,
+    u_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS channels (
+    channel_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    is_public INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS members (
+    channel_id INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    u_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (channel_id, role, u_id)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id INTEGER NOT NULL UNIQUE,
+    channel_id INTEGER NOT NULL,
+    u_id INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    time_created INTEGER NOT NULL,
+    is_pinned INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_channel_id ON messages (channel_id, seq);
+CREATE TABLE IF NOT EXISTS reacts (
+    message_id INTEGER NOT NULL,
+    react_id INTEGER NOT NULL,
+    u_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (message_id, react_id, u_id)
+);
+CREATE TABLE IF NOT EXISTS reset_list (
+    email TEXT PRIMARY KEY,
+    reset_code TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scheduled (
+    message_id INTEGER PRIMARY KEY,
+    u_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    time_sent INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS standups (
+    channel_id INTEGER PRIMARY KEY,
+    u_id INTEGER NOT NULL,
+    time_finish INTEGER NOT NULL,
+    msg_buffer TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    record TEXT NOT NULL
+);
+DROP INDEX IF EXISTS users_email;
+DROP INDEX IF EXISTS users_handle_str;
+DROP INDEX IF EXISTS sessions_u_id;
+DROP INDEX IF EXISTS members_u_id;
+DROP INDEX IF EXISTS reset_list_reset_code;
+'''
+
+# statistics kept in the meta table
+META_KEYS = ['u_id_stat', 'channel_id_stat', 'message_id_stat', 'journal_seq']
+
+# change records kept in the changes table for workers that are behind
+CHANGES_KEPT = 10000
+
+connection = None
+store_lock = Lock()
+# set when several server processes use the database at once, see workers.py.
+# Every commit then also adds its journal records to the changes table.
+shared = False
+
+# what changed since the last commit, collected from the journaled data helpers
+dirty = {
+    'cleared': False,
+    'everything': False,
+    'users': set(),
+    'sessions': set(),
+    'channels': set(),
+    'members': set(),
+    'member_appends': [],
+    'messages': set(),
+    'scheduled': set(),
+    'standups': set(),
+    'reset_list': False,
+}
+
+def open_store(filename):
+    '''
+    Open (and create if needed) the SQLite database and start collecting
+    changes made through the data helpers.
+    Args: filename of SQLite database
+    Return: True if the database holds no data yet
+    '''
+
+    global connection
+    if connection is not None:
+        connection.close()
+    connection = sqlite3.connect(filename, check_same_thread=False)
+    if shared:
+        # readers in the other workers do not wait for a commit
+        connection.execute('PRAGMA journal_mode=WAL')
+    connection.executescript(SCHEMA)
+    if touch not in data.journal_listeners:
+        data.journal_listeners.append(touch)
+    clear_dirty()
+    return connection.execute('SELECT COUNT(*) FROM meta').fetchone()[0] == 0
+
+def close_store():
+    ''' Close the SQLite database and stop collecting changes. '''
+
+    global connection
+    if connection is not None:
+        connection.close()
+        connection = None
+    if touch in data.journal_listeners:
+        data.journal_listeners.remove(touch)
+
+def clear_dirty():
+    ''' Forget all collected changes. '''
+
+    dirty['cleared'] = False
+    dirty['everything'] = False
+    for key in ['users', 'sessions', 'channels', 'members', 'messages', 'scheduled', 'standups']:
+        dirty[key].clear()
+    dirty['member_appends'] = []
+    dirty['reset_list'] = False
+
+def touch(op, args, result):
+    '''
+    Note which rows a journaled data helper changed.
+    Args: name of the helper, its arguments and its return value
+    '''
+
+    if op == 'clear':
+        clear_dirty()
+        dirty['cleared'] = True
+    elif op == 'new_account':
+        dirty['users'].add(args[0]['u_id'])
+    elif op in ['update_account', 'set_global_permissions', 'add_img_url']:
+        dirty['users'].add(args[0])
+    elif op in ['new_session', 'delete_session']:
+        dirty['sessions'].add(args[0]['token'])
+    elif op in ['reset_list_add', 'reset_list_remove']:
+        dirty['reset_list'] = True
+    elif op == 'add_channel':
+        dirty['channels'].add(result)
+        dirty['members'].add(result)
+    elif op == 'delete_channel_id':
+        dirty['channels'].add(args[0])
+    elif op in ['add_member', 'promote_owner']:
+        role = 'all_members' if op == 'add_member' else 'owner_members'
+        dirty['member_appends'].append((args[0], role, args[1]['u_id']))
+    elif op in ['remove_member', 'remove_ownership']:
+        dirty['members'].add(args[0])
+    elif op in ['add_message', 'add_later', 'remove_message', 'edit_message', 'set_pinned']:
+        dirty['messages'].add(args[0])
+        if op == 'add_later':
+            dirty['scheduled'].add(args[0])
+    elif op in ['schedule_message', 'unschedule_message']:
+        dirty['scheduled'].add(args[0])
+    elif op in ['standup_create', 'standup_message_add', 'standup_remove']:
+        dirty['standups'].add(args[0])
+    elif op in ['message_react_to', 'message_unreact_to']:
+        dirty['messages'].add(args[1])
+    else:
+        # a helper this store does not know about, play it safe
+        dirty['everything'] = True
+
+def commit(records=()):
+    '''
+    Write the changes collected since the last commit in one transaction.
+    Args: journal records of the changes
+    '''
+
+    with store_lock, connection:
+        if dirty['everything']:
+            write_everything()
+        else:
+            write_changes()
+        write_meta()
+        write_records(records)
+        clear_dirty()
+
+def save(records=()):
+    '''
+    Replace everything in the SQLite database with the data in memory.
+    Args: journal records of the changes since the last commit
+    '''
+
+    with store_lock, connection:
+        write_everything()
+        write_meta()
+        write_records(records)
+        clear_dirty()
+
+def write_records(records):
+    ''' Add journal records to the changes table, if the database is shared. '''
+
+    if not shared or not records:
+        return
+    connection.executemany('INSERT INTO changes (record) VALUES (?)',
+        [(record,) for record in records])
+    connection.execute('DELETE FROM changes WHERE seq <= ?', (last_change() - CHANGES_KEPT,))
+
+def last_change():
+    ''' Return the seq of the newest record in the changes table, 0 if there is none. '''
+
+    row = connection.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+    return row[0] if row else 0
+
+def shared_epoch():
+    '''
+    Return the number naming this database to the workers sharing it, made
+    the first time one of them asks, so their poll cursors can not be taken
+    for those of another database.
+    '''
+
+    with store_lock, connection:
+        connection.execute('INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)',
+            ('epoch', random.getrandbits(31)))
+        return connection.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()[0]
+
+def changes_since(seq):
+    '''
+    Return the records in the changes table newer than seq.
+    Return: list of (seq, record), oldest first
+    '''
+
+    with store_lock:
+        return connection.execute('SELECT seq, record FROM changes WHERE seq > ? ORDER BY seq',
+            (seq,)).fetchall()
+
+def write_everything():
+    ''' Rewrite every table from the data in memory. '''
+
+    for table in ['users', 'sessions', 'channels', 'members', 'messages', 'reacts', 'reset_list', 'scheduled', 'standups']:
+        connection.execute(f'DELETE FROM {table}')
+    for account in data.users:
+        write_user(account['u_id'])
+    for token in data.sessions:
+        write_session(token)
+    for channel_id in data.channels:
+        write_channel(channel_id)
+        write_members(channel_id)
+        for message in data.iter_messages(data.channels[channel_id]):
+            write_message(message['message_id'])
+    write_reset_list()
+    for message_id in data.scheduled:
+        write_scheduled(message_id)
+    for channel_id in data.standups:
+        write_standup(channel_id)
+
+def write_changes():
+    ''' Write only the rows touched since the last commit. '''
+
+    if dirty['cleared']:
+        for table in ['users', 'sessions', 'channels', 'members', 'messages', 'reacts', 'reset_list', 'scheduled', 'standups']:
+            connection.execute(f'DELETE FROM {table}')
+    for u_id in sorted(dirty['users']):
+        write_user(u_id)
+    for token in dirty['sessions']:
+        write_session(token)
+    if dirty['reset_list']:
+        write_reset_list()
+    for channel_id in sorted(dirty['channels']):
+        write_channel(channel_id)
+    for channel_id in sorted(dirty['members']):
+        write_members(channel_id)
+    for (channel_id, role, u_id) in dirty['member_appends']:
+        if channel_id not in dirty['members']:
+            append_member(channel_id, role, u_id)
+    # write new messages in the order of the channel logs, which is the order
+    # their rows will be read back in
+    for message_id in sorted(dirty['messages'], key=log_position):
+        write_message(message_id)
+    for message_id in sorted(dirty['scheduled']):
+        write_scheduled(message_id)
+    for channel_id in sorted(dirty['standups']):
+        write_standup(channel_id)
+
+def log_position(message_id):
+    ''' Return the position of a message in its channel's log, -1 if it was removed. '''
+
+    if message_id in data.message_index:
+        return data.message_index[message_id][1]
+    return -1
+
+def write_meta():
+    ''' Write the id statistics and the journal sequence number. '''
+
+    connection.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+        [(key, getattr(data, key)) for key in META_KEYS])
+
+def write_user(u_id):
+    ''' Insert or update the row of an account. '''
+
+    account = data.account_search('u_id', u_id)
+    if not account:
+        connection.execute('DELETE FROM users WHERE u_id = ?', (u_id,))
+        return
+    connection.execute('''INSERT OR REPLACE INTO users
+        (u_id, email, name_first, name_last, password, handle_str, is_global_owner, profile_img_url)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+        (u_id, account['email'], account['name_first'], account['name_last'],
+        account['password'], account['handle_str'], account['is_global_owner'],
+        account.get('profile_img_url')))
+
+def write_session(token):
+    ''' Insert or delete the row of a session. '''
+
+    session = data.session_search('token', token)
+    if session:
+        connection.execute('INSERT OR REPLACE INTO sessions (token, u_id) VALUES (?, ?)',
+            (token, session['u_id']))
+    else:
+        connection.execute('DELETE FROM sessions WHERE token = ?', (token,))
+
+def write_reset_list():
+    ''' Rewrite the list of pending password resets. '''
+
+    connection.execute('DELETE FROM reset_list')
+    connection.executemany('INSERT INTO reset_list (email, reset_code) VALUES (?, ?)',
+        [(reset['email'], reset['reset_code']) for reset in data.reset_list])
+
+def write_scheduled(message_id):
+    ''' Insert the row of a scheduled message, or delete it once sent or cancelled. '''
+
+    pending = data.scheduled.get(message_id)
+    if pending is None:
+        connection.execute('DELETE FROM scheduled WHERE message_id = ?', (message_id,))
+        return
+    connection.execute('''INSERT OR REPLACE INTO scheduled
+        (message_id, u_id, channel_id, message, time_sent) VALUES (?, ?, ?, ?, ?)''',
+        (message_id, pending['u_id'], pending['channel_id'], pending['message'], pending['time_sent']))
+
+def write_standup(channel_id):
+    ''' Insert or update the row of a standup, or delete it once it ended. '''
+
+    standup = data.standups.get(channel_id)
+    if standup is None:
+        connection.execute('DELETE FROM standups WHERE channel_id = ?', (channel_id,))
+        return
+    connection.execute('''INSERT OR REPLACE INTO standups
+        (channel_id, u_id, time_finish, msg_buffer) VALUES (?, ?, ?, ?)''',
+        (channel_id, standup['u_id'], standup['time_finish'],
+        json.dumps(data.saved_standup(standup)['msg_buffer'])))
+
+def write_channel(channel_id):
+    ''' Insert or update the row of a channel, or delete it with everything in it. '''
+
+    channel = data.channels_search('channel_id', channel_id)
+    if channel:
+        connection.execute('INSERT OR REPLACE INTO channels (channel_id, name, is_public) VALUES (?, ?, ?)',
+            (channel_id, channel['name'], channel['is_public']))
+        return
+    connection.execute('DELETE FROM channels WHERE channel_id = ?', (channel_id,))
+    connection.execute('DELETE FROM members WHERE channel_id = ?', (channel_id,))
+    connection.execute('''DELETE FROM reacts WHERE message_id IN
+        (SELECT message_id FROM messages WHERE channel_id = ?)''', (channel_id,))
+    connection.execute('DELETE FROM messages WHERE channel_id = ?', (channel_id,))
+
+def write_members(channel_id):
+    ''' Rewrite the members and owners of a channel. '''
+
+    connection.execute('DELETE FROM members WHERE channel_id = ?', (channel_id,))
+    channel = data.channels_search('channel_id', channel_id)
+    if not channel:
+        return
+    for role in ['all_members', 'owner_members']:
+        connection.executemany('INSERT INTO members (channel_id, role, u_id, position) VALUES (?, ?, ?, ?)',
+            [(channel_id, role, member['u_id'], position)
+            for (position, member) in enumerate(channel[role])])
+
+def append_member(channel_id, role, u_id):
+    ''' Insert the row of a member just added to the end of a channel's list. '''
+
+    channel = data.channels_search('channel_id', channel_id)
+    if not channel:
+        return
+    for (position, member) in enumerate(channel[role]):
+        if member['u_id'] == u_id:
+            connection.execute('''INSERT OR REPLACE INTO members
+                (channel_id, role, u_id, position) VALUES (?, ?, ?, ?)''',
+                (channel_id, role, u_id, position))
+
+def write_message(message_id):
+    ''' Insert or update the row of a message and its reacts, or delete them. '''
+
+    connection.execute('DELETE FROM reacts WHERE message_id = ?', (message_id,))
+    m_search = data.message_search(message_id)
+    if not m_search:
+        connection.execute('DELETE FROM messages WHERE message_id = ?', (message_id,))
+        return
+    (channel, message) = m_search
+    connection.execute('''INSERT INTO messages
+        (message_id, channel_id, u_id, message, time_created, is_pinned)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (message_id) DO UPDATE SET
+        message = excluded.message, is_pinned = excluded.is_pinned''',
+        (message_id, channel['channel_id'], message['u_id'], message['message'],
+        message['time_created'], message['is_pinned']))
+    for (react_id, u_ids) in message['reacts'].items():
+        connection.executemany('''INSERT INTO reacts
+            (message_id, react_id, u_id, position) VALUES (?, ?, ?, ?)''',
+            [(message_id, react_id, u_id, position)
+            for (position, u_id) in enumerate(sorted(u_ids))])
+
+def load():
+    '''
+    Read the SQLite database into the same structure save writes to a
+    JSON database.
+    Return: database
+    '''
+
+    with store_lock:
+        database = {key: 0 for key in META_KEYS}
+        for (key, value) in connection.execute('SELECT key, value FROM meta'):
+            database[key] = value
+
+        database['users'] = []
+        accounts = {}
+        for row in connection.execute('''SELECT u_id, email, name_first, name_last, password,
+                handle_str, is_global_owner, profile_img_url FROM users ORDER BY u_id'''):
+            account = {
+                'u_id': row[0],
+                'email': row[1],
+                'name_first': row[2],
+                'name_last': row[3],
+                'password': row[4],
+                'handle_str': row[5],
+                'is_global_owner': bool(row[6]),
+            }
+            if row[7] is not None:
+                account['profile_img_url'] = row[7]
+            database['users'].append(account)
+            accounts[account['u_id']] = account
+
+        database['sessions'] = [{'token': token, 'u_id': u_id}
+            for (token, u_id) in connection.execute('SELECT token, u_id FROM sessions')]
+
+        database['reset_list'] = [{'email': email, 'reset_code': reset_code}
+            for (email, reset_code) in connection.execute('SELECT email, reset_code FROM reset_list')]
+
+        database['scheduled'] = [{
+            'message_id': message_id,
+            'u_id': u_id,
+            'channel_id': channel_id,
+            'message': message,
+            'time_sent': time_sent,
+        } for (message_id, u_id, channel_id, message, time_sent) in connection.execute(
+            'SELECT message_id, u_id, channel_id, message, time_sent FROM scheduled ORDER BY message_id')]
+
+        database['standups'] = [{
+            'channel_id': channel_id,
+            'u_id': u_id,
+            'time_finish': time_finish,
+            'msg_buffer': json.loads(msg_buffer),
+        } for (channel_id, u_id, time_finish, msg_buffer) in connection.execute(
+            'SELECT channel_id, u_id, time_finish, msg_buffer FROM standups ORDER BY channel_id')]
+
+        channels = {}
+        for (channel_id, name, is_public) in connection.execute(
+                'SELECT channel_id, name, is_public FROM channels ORDER BY channel_id'):
+            channels[channel_id] = {
+                'channel_id': channel_id,
+                'name': name,
+                'owner_members': [],
+                'all_members': [],
+                'messages': [],
+                'is_public': bool(is_public),
+            }
+        for (channel_id, role, u_id) in connection.execute(
+                'SELECT channel_id, role, u_id FROM members ORDER BY channel_id, role, position'):
+            channels[channel_id][role].append(make_member(accounts[u_id]))
+
+        messages = {}
+        # the JSON database keeps messages newest first
+        for row in connection.execute('''SELECT message_id, channel_id, u_id, message,
+                time_created, is_pinned FROM messages ORDER BY seq DESC'''):
+            message = {
+                'message_id': row[0],
+                'u_id': row[2],
+                'message': row[3],
+                'time_created': row[4],
+                'reacts': {},
+                'is_pinned': bool(row[5]),
+            }
+            channels[row[1]]['messages'].append(message)
+            messages[message['message_id']] = message
+        for (message_id, react_id, u_id) in connection.execute(
+                'SELECT message_id, react_id, u_id FROM reacts ORDER BY message_id, react_id, position'):
+            messages[message_id]['reacts'].setdefault(react_id, []).append(u_id)
+        database['channels'] = list(channels.values())
+
+    return database
+
+def make_member(account):
+    ''' Build the member entry of a channel from an account row. '''
+
+    member = {
+        'u_id': account['u_id'],
+        'name_first': account['name_first'],
+        'name_last': account['name_last'],
+    }
+    if 'profile_img_url' in account:
+        member['profile_img_url'] = account['profile_img_url']
+    return member
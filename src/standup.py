@@ -3,17 +3,22 @@ from datetime import timezone, datetime
 from message import message_send
 from time import sleep
 from error import AccessError, InputError
-from threading import Timer
+import scheduler
+import workers
 
-open_timers = []
+# longest message the standup summary is sent in
+MESSAGE_LIMIT = 1000
 
-def standup_close(u_id, channel_id):
+def standup_close(channel_id, time_finish):
     '''
-    Close the standup on the channel with channel_id channel_id
+    Close the standup on the channel with channel_id channel_id and send its
+    summary, split over several messages if it is too long for one. Nothing
+    is done if that standup has been closed already.
     
     Args:
-        c_id (int): c_id of the standup to be closed.
-        duration (int): duration after which to close the standup (seconds).
+        channel_id (int): channel_id of the standup to be closed.
+        time_finish (timestamp): time the standup ends, telling it apart from
+            a later standup on the same channel.
         
     Return:
         None
@@ -22,40 +27,65 @@ def standup_close(u_id, channel_id):
         NA
     '''
     
-    standup = data.standup_search(channel_id)
-    message = ''
-    for msg in standup['msg_buffer']:
-        message += f"\n{msg[0]}: {msg[1]}"
-    
-    if message != '':
-        message = message[1:]
+    with workers.writing():
+        standup = data.standup_search(channel_id)
+        if standup.get('time_finish') != time_finish:
+            return
         # Note: Needs to be added directly since the message should still be
         # sent even if the user is logged out in the middle of the standup.
         time = int(datetime.utcnow().replace(tzinfo = timezone.utc).timestamp())
-        data.add_message(data.message_id_stat, u_id, message, time, channel_id)
-    
-    data.standup_remove(channel_id)
-    
-def standup_cancel_timers():
+        for message in standup_summary(data.standup_remove(channel_id)):
+            data.post_message(standup['u_id'], message, time, channel_id)
+
+def standup_resume():
     '''
-    Cancel all currently waiting timers started by standup_start.
+    Give the scheduler the end of every standup, after they were restored by
+    data.load. Standups that should have ended already end straight away.
     
     Args:
         NA
         
     Return:
         None
-        
-    Raises:
-        NA
     '''
     
-    global open_timers
+    for standup in list(data.standups.values()):
+        scheduler.call_at(standup['time_finish'], standup_close,
+            standup['channel_id'], standup['time_finish'])
+    scheduler.start()
+
+def standup_summary(msg_buffer):
+    '''
+    Build the summary of a standup, one "handle: message" line per buffered
+    message, in linear time.
     
-    for timer in open_timers:
-        timer.cancel()
-    open_timers = []
+    Args:
+        msg_buffer (list): (handle, message) sent to the standup, oldest first.
         
+    Return:
+        messages (list): the summary split into messages of at most
+            MESSAGE_LIMIT chars, breaking between lines where possible.
+    '''
+    
+    messages = []
+    lines = []
+    length = -1
+    for (handle, msg) in msg_buffer:
+        line = f"{handle}: {msg}"
+        if lines and length + 1 + len(line) > MESSAGE_LIMIT:
+            messages.append('\n'.join(lines))
+            lines = []
+            length = -1
+        # a single line too long for a message is cut into pieces
+        while len(line) > MESSAGE_LIMIT:
+            messages.append(line[:MESSAGE_LIMIT])
+            line = line[MESSAGE_LIMIT:]
+        lines.append(line)
+        length += 1 + len(line)
+    if lines:
+        messages.append('\n'.join(lines))
+    return messages
+    
 def standup_start(token, channel_id, length):
     '''
     Start a standup on channel with channel_id channel_id of length length 
@@ -76,8 +106,6 @@ def standup_start(token, channel_id, length):
             channel_id.
     '''
     
-    global open_timers
-    
     # Checks for invalid token
     session = data.session_search('token', token)
     if session == None:
@@ -87,22 +115,20 @@ def standup_start(token, channel_id, length):
     if data.channels_search('channel_id', channel_id) == {}:
         raise InputError(description = 'Channel does not exist.')
         
-    # Checks that there is not already a standup running on the channel.
-    standup = data.standup_search(channel_id)
-    if standup != {}:
-        raise InputError(description = 'Standup already active.')
-        
-    # Calculate end_time and add the standup.
+    # Calculate end_time and add the standup, unless there is already a
+    # standup running on the channel.
     timestamp = int(datetime.utcnow().replace(tzinfo = timezone.utc).timestamp())
     time_finish = timestamp + length
-    data.standup_create(channel_id, time_finish)
+    if not data.standup_create(channel_id, session['u_id'], time_finish):
+        raise InputError(description = 'Standup already active.')
         
-    # Start the timer to close the standup at the appropriate time.
-    if length <= 0: length = 0
-    close_timer = Timer(length, standup_close, [session['u_id'], channel_id])
-    close_timer.daemon = True
-    open_timers.append(close_timer)
-    close_timer.start()
+    # Close the standup at the appropriate time, a standup without a length
+    # ends straight away.
+    if length <= 0:
+        standup_close(channel_id, time_finish)
+    else:
+        scheduler.call_later(length, standup_close, channel_id, time_finish)
+        scheduler.start()
     
     return {'time_finish': time_finish}
     
@@ -173,24 +199,16 @@ def standup_send(token, channel_id, message):
         raise InputError(description = 'Channel does not exist.')
     
     # Check that the user is a member of the channel.
-    is_member = False
-    for member in channel['all_members']:
-        if member['u_id'] == session['u_id']:
-            is_member = True
-            break
-    if not is_member:
+    if not data.is_member(session['u_id'], channel_id):
         raise AccessError (description = 'User is not a member of this channel.')
     
     # Message is not more than 1000 chars.
     if len(message) > 1000:
         raise InputError (description = 'Message is over 1000 chars in length.')
     
-    # Checks that there is not already a standup running on the channel.
-    standup = data.standup_search(channel_id)
-    if standup == {}:
-        raise InputError(description = 'Standup not active.')
-        
+    # Checks that there is a standup running on the channel.
     handle = data.account_search('u_id', session['u_id'])['handle_str']
-    data.standup_message_add(channel_id, handle, message)
+    if not data.standup_message_add(channel_id, handle, message):
+        raise InputError(description = 'Standup not active.')
     return {}
     
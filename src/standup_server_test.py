@@ -229,7 +229,7 @@ def test_send_single_messsage(url, standup_fixture):
         'channel_id': c_id, 'message': 'Test Message'})
     sleep(2)
     m = {
-        'message_id': 0,
+        'message_id': 1,
         'u_id': u1['u_id'],
         'message': 'first1last1: Test Message',
         'time_created': get_current_timestamp(),
@@ -258,7 +258,7 @@ def test_send_multi_messsage(url, standup_fixture):
         'channel_id': c_id, 'message': 'Test Message 4'})
     sleep(2)
     m = {
-        'message_id': 0,
+        'message_id': 1,
         'u_id': u1['u_id'],
         'message': '''first1last1: Test Message 1
 first2last2: Test Message 2
@@ -4,9 +4,11 @@ import auth
 import channel
 import channels
 import other
+import data
 from datetime import timezone, datetime
 from error import AccessError, InputError
 from time import sleep
+from threading import Thread
 
 MARGIN = 2
 
@@ -200,7 +202,7 @@ def test_send_single_messsage(standup_fixture):
     standup.standup_send(u1['token'], c_id, 'Test Message')
     sleep(2)
     m = {
-        'message_id': 0,
+        'message_id': 1,
         'u_id': u1['u_id'],
         'message': 'first1last1: Test Message',
         'time_created': get_current_timestamp(),
@@ -221,7 +223,7 @@ def test_send_multi_messsage(standup_fixture):
     standup.standup_send(u2['token'], c_id, 'Test Message 4')
     sleep(2)
     m = {
-        'message_id': 0,
+        'message_id': 1,
         'u_id': u1['u_id'],
         'message': '''first1last1: Test Message 1
 first2last2: Test Message 2
@@ -233,3 +235,62 @@ first2last2: Test Message 4''',
     }
     messages = channel.channel_messages(u1['token'], c_id, 0)['messages']
     assert(margin_compare(messages, [m]))
+
+def test_send_many_channels(standup_fixture):
+    '''Sends to standups of different channels at once are all kept.'''
+    (_, u1, _, _) = standup_fixture
+    c_ids = [channels.channels_create(u1['token'], f'channel{i}', True)['channel_id']
+             for i in range(2, 10)]
+    for c_id in c_ids:
+        standup.standup_start(u1['token'], c_id, 2)
+    def send(c_id):
+        for i in range(50):
+            standup.standup_send(u1['token'], c_id, f'{c_id} {i}')
+    threads = [Thread(target=send, args=(c_id,)) for c_id in c_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sleep(3)
+    for c_id in c_ids:
+        messages = channel.channel_messages(u1['token'], c_id, 0)['messages']
+        assert messages[0]['message'] == '\n'.join(f'first1last1: {c_id} {i}' for i in range(50))
+        assert standup.standup_active(u1['token'], c_id)['is_active'] == False
+        with pytest.raises(InputError):
+            standup.standup_send(u1['token'], c_id, 'too late')
+
+def test_send_long_summary(standup_fixture):
+    '''A summary over 1000 chars is split between lines into several messages.'''
+    (_, u1, _, c_id) = standup_fixture
+    standup.standup_start(u1['token'], c_id, 1)
+    sent = [f'{i:02}' * 50 for i in range(30)]
+    for msg in sent:
+        standup.standup_send(u1['token'], c_id, msg)
+    sleep(2)
+    messages = channel.channel_messages(u1['token'], c_id, 0)['messages'][::-1]
+    assert [m['message_id'] for m in messages] == [1, 2, 3, 4]
+    assert all(len(m['message']) <= 1000 for m in messages)
+    lines = '\n'.join(m['message'] for m in messages).split('\n')
+    assert lines == [f'first1last1: {msg}' for msg in sent]
+
+def test_summary_long_line():
+    '''A line too long for one message is cut into pieces.'''
+    summary = standup.standup_summary([('a', 'x' * 10), ('b', 'y' * 2500), ('c', 'z')])
+    assert summary == ['a: ' + 'x' * 10, 'b: ' + 'y' * 997, 'y' * 1000, 'y' * 503 + '\nc: z']
+    assert standup.standup_summary([]) == []
+
+def test_send_channels_do_not_wait(standup_fixture):
+    '''A send waits neither for readers of the data nor for sends to other channels.'''
+    (_, u1, _, c_id) = standup_fixture
+    c_id2 = channels.channels_create(u1['token'], 'channel2', True)['channel_id']
+    standup.standup_start(u1['token'], c_id, 2)
+    standup.standup_start(u1['token'], c_id2, 2)
+    standup.standup_send(u1['token'], c_id, 'first')
+
+    with data.read_lock, data.standup_locks[c_id]:
+        thread = Thread(target=standup.standup_send, args=(u1['token'], c_id2, 'second'))
+        thread.start()
+        thread.join(MARGIN)
+        assert not thread.is_alive()
+    assert data.standups[c_id2]['msg_buffer'] == [('first1last1', 'second')]
+    sleep(3)
@@ -0,0 +1,192 @@
+'''
+Message updates
+
+Clients can wait on /channel/messages/poll for the messages of a channel to
+change, instead of fetching a page of messages every second. Each change heard
+from data.message_listeners gets the next update seq. The last UPDATES_KEPT
+updates of every channel are kept, and the polls waiting on that channel are
+woken.
+
+A cursor "<epoch>:<seq>" names the last update a client has seen. The epoch is
+new for every process and after every clear. A client whose cursor is from
+another epoch, or too old to be served from the kept updates, is told to load
+the channel again instead.
+
+In multi-worker mode the seq of an update is that of its change in the changes
+table and the epoch names the shared database, so a cursor from one worker is
+good with all of them. Cursors from before a clear, or from before a worker
+last read the whole database, are below floor.
+'''
+from collections import deque
+from threading import Condition, Lock
+from time import time
+from uuid import uuid4
+import data
+import workers
+
+# updates kept per channel
+UPDATES_KEPT = 1000
+# longest a poll waits for an update, in seconds
+POLL_TIMEOUT = 30
+# how often a waiting poll applies the changes of the other workers, in seconds
+CATCH_UP_INTERVAL = 0.2
+
+lock = Lock()
+epoch = uuid4().hex[:8]
+seq = 0
+# lowest cursor seq that can be served
+floor = 0
+# (seq, message_id) of the updates to each channel, oldest first
+updates = {}
+# highest seq dropped from each channel's updates
+dropped = {}
+# Condition (on lock) notified on an update to each channel
+conditions = {}
+# functions called on an update to each channel, for waiters that are not threads
+watchers = {}
+
+def message_changed(channel_id, message_id):
+    '''
+    Record an update to a message and wake whoever waits on its channel,
+    called by the data helpers. A clear starts a new epoch and wakes everyone.
+
+    Args:
+        channel_id (int): channel of the message, None after a clear.
+        message_id (int): message that changed, None after a clear.
+
+    Return:
+        None
+    '''
+    global epoch
+    global seq
+    global floor
+    with lock:
+        if channel_id is None:
+            if workers.enabled:
+                epoch = str(workers.epoch)
+                seq = floor = workers.change_seq()
+            else:
+                epoch = uuid4().hex[:8]
+                floor = 0
+            updates.clear()
+            dropped.clear()
+            woken = set(conditions) | set(watchers)
+        else:
+            seq = workers.change_seq() if workers.enabled else seq + 1
+            log = updates.setdefault(channel_id, deque())
+            log.append((seq, message_id))
+            if len(log) > UPDATES_KEPT:
+                dropped[channel_id] = log.popleft()[0]
+            woken = {channel_id}
+        for woken_id in woken:
+            if woken_id in conditions:
+                conditions[woken_id].notify_all()
+        callbacks = [callback for woken_id in woken for callback in watchers.get(woken_id, ())]
+    for callback in callbacks:
+        callback()
+
+data.message_listeners.append(message_changed)
+
+def updates_since(channel_id, cursor):
+    '''
+    Find the messages of a channel updated after a cursor.
+
+    Args:
+        channel_id (int): channel to look at.
+        cursor (str): cursor the client has seen, '' if none.
+
+    Return:
+        (message_ids updated after cursor, oldest update first, or None if
+        the cursor can not be served; cursor of the newest update)
+    '''
+    with lock:
+        return unlocked_updates_since(channel_id, cursor)
+
+def unlocked_updates_since(channel_id, cursor):
+    ''' updates_since, for a caller holding lock. '''
+    # seq only counts this worker's message updates, the cursor of a client
+    # that polled another worker can be up to the last change applied
+    newest = workers.applied if workers.enabled else seq
+    current = f'{epoch}:{newest}'
+    try:
+        (cursor_epoch, cursor_seq) = cursor.split(':')
+        cursor_seq = int(cursor_seq)
+    except (AttributeError, ValueError):
+        return (None, current)
+    if (cursor_epoch != epoch or cursor_seq > newest or cursor_seq < floor
+            or cursor_seq < dropped.get(channel_id, 0)):
+        return (None, current)
+    message_ids = [message_id for (update, message_id) in updates.get(channel_id, ())
+                   if update > cursor_seq]
+    return (message_ids, current)
+
+def has_updates(channel_id, cursor):
+    '''
+    Tell whether a poll from cursor can be answered straight away.
+
+    Args:
+        channel_id (int): channel polled.
+        cursor (str): cursor the client has seen.
+
+    Return:
+        bool
+    '''
+    return updates_since(channel_id, cursor)[0] != []
+
+def wait(channel_id, cursor, timeout):
+    '''
+    Block until the channel has updates after cursor, or timeout seconds pass.
+
+    Args:
+        channel_id (int): channel polled.
+        cursor (str): cursor the client has seen.
+        timeout (float): longest wait in seconds.
+
+    Return:
+        None
+    '''
+    deadline = time() + timeout
+    while True:
+        # changes made by the other workers are only seen once applied here
+        workers.catch_up()
+        with lock:
+            if unlocked_updates_since(channel_id, cursor)[0] != []:
+                return
+            remaining = deadline - time()
+            if remaining <= 0:
+                return
+            if workers.enabled:
+                remaining = min(remaining, CATCH_UP_INTERVAL)
+            conditions.setdefault(channel_id, Condition(lock)).wait(remaining)
+
+def watch(channel_id, callback):
+    '''
+    Call callback() on every update to a channel, from the thread making it,
+    until unwatch is called.
+
+    Args:
+        channel_id (int): channel to watch.
+        callback (function): function to call.
+
+    Return:
+        None
+    '''
+    with lock:
+        watchers.setdefault(channel_id, set()).add(callback)
+
+def unwatch(channel_id, callback):
+    '''
+    Stop calling a callback given to watch.
+
+    Args:
+        channel_id (int): channel watched.
+        callback (function): function given to watch.
+
+    Return:
+        None
+    '''
+    with lock:
+        callbacks = watchers.get(channel_id, set())
+        callbacks.discard(callback)
+        if not callbacks:
+            watchers.pop(channel_id, None)
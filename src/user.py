@@ -3,8 +3,9 @@ from error import AccessError, InputError
 import hashlib
 import data
 import re
-import urllib
 import requests
+import workers
+from io import BytesIO
 from PIL import Image
 import uuid
 from flask import request
@@ -172,10 +173,10 @@ def user_profile_uploadphoto(token, img_url, x_start, y_start, x_end, y_end):
     if photo.status_code != 200:
         raise InputError(description='Image could not be found.')
 
-    # save image locally in directory /src/static/ as 'image.jpg'
+    # open the image already fetched, rather than fetching it again into a
+    # file every upload shares
     try:
-        urllib.request.urlretrieve(img_url, "./src/static/image.jpg")
-        image = Image.open("./src/static/image.jpg")
+        image = Image.open(BytesIO(photo.content))
     except:
         raise InputError(description='Image could not be found.')
 
@@ -201,7 +202,8 @@ def user_profile_uploadphoto(token, img_url, x_start, y_start, x_end, y_end):
     
     # does nothing if no server is running
     try:
-        data.update_account(session['u_id'], 'profile_img_url', request.host_url + profile_img_url)
+        with workers.writing():
+            data.update_account(session['u_id'], 'profile_img_url', request.host_url + profile_img_url)
     except:
         pass
 
@@ -72,6 +72,18 @@ def test_user_setemail(user_login):
     user.user_profile_setemail(user_login['token'], "name3@gmail.com")
     assert(user.user_profile(user_login['token'], user_login['u_id']) == {"user": {'u_id': 2, 'email': "name3@gmail.com", 'name_first': "name_first2", 'name_last': "name_last2", 'handle_str': "name_first2name_last"}})
 
+def test_user_setemail_login(user_login):
+    '''
+    user can log in with the updated email address but not the old one
+    '''
+
+    user.user_profile_setemail(user_login['token'], "name3@gmail.com")
+    assert(auth.auth_login("name3@gmail.com", "password2")['u_id'] == user_login['u_id'])
+    with pytest.raises(InputError):
+        auth.auth_login("name2@gmail.com", "password2")
+    # the old email address is free to be used again
+    auth.auth_register("name2@gmail.com", "password4", "name_first4", "name_last4")
+
 def test_user_setemail_InputError_invalidFormat(user_login):
     '''
     expected InputError due to invalid email format
@@ -115,3 +127,14 @@ def test_user_sethanle_InputError_handleDuplicate(user_login):
     
     with pytest.raises(InputError):
         user.user_profile_sethandle(user_login['token'], "name_first1name_last")
+
+def test_user_sethandle_release(user_login):
+    '''
+    a handle string given up by one user can be taken by another
+    '''
+
+    user.user_profile_sethandle(user_login['token'], "handle_str3")
+    session = auth.auth_login("name1@gmail.com", "password1")
+    user.user_profile_sethandle(session['token'], "name_first2name_last")
+    with pytest.raises(InputError):
+        user.user_profile_sethandle(user_login['token'], "name_first2name_last")
@@ -0,0 +1,197 @@
+'''
+Multi-worker mode
+
+Several server processes, such as the workers of a pre-fork WSGI server, can
+serve one database when FLOCKR_MULTI_WORKER=1 is set, e.g. from the top of
+the repository:
+
+    FLOCKR_MULTI_WORKER=1 gunicorn --workers 4 --threads 8 --pythonpath src server:APP
+
+Every worker keeps the whole database in memory as usual, and they share the
+SQLite database, in WAL mode. A change takes an exclusive lock on
+<database>.lock, applies what the other workers committed since this worker
+last looked, is made, and is committed to SQLite before the lock is let go,
+so changes from all the workers happen one after another.
+
+Each commit also adds the journal records of its changes to the changes
+table. Before a request a worker replays the records it has not seen through
+the same data helpers that made them, which keeps its indexes and caches in
+step. A worker so far behind that its records were pruned reads the whole
+database again.
+
+The seqs of the changes table are the same in every worker, so they also
+number the message updates long polls wait for (see updates.py), and a
+client can poll any of the workers.
+'''
+from contextlib import contextmanager
+from threading import local
+import fcntl
+import data
+import sqlite_store
+
+enabled = False
+database = None
+lock_file = None
+# seq of the last record of the changes table applied to this worker's data
+applied = 0
+# seq of the record being applied, None while this worker makes its own changes
+applying = None
+# number naming the shared database, see sqlite_store.shared_epoch
+epoch = None
+# how deep each thread is in writing, only the outermost takes the file lock
+state = local()
+
+def start(filename):
+    '''
+    Load the database shared by the workers into memory.
+
+    Args:
+        filename (str): filename of the JSON database, the SQLite database
+            and lock file are kept next to it.
+
+    Return:
+        None
+    '''
+    global database
+    global lock_file
+    global applied
+    global epoch
+    database = filename
+    data.persistence_mode = 'sqlite'
+    sqlite_store.shared = True
+    lock_file = open(filename + '.lock', 'a')
+    with data.commit_lock, data.write_lock:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            data.load(filename)
+            applied = sqlite_store.last_change()
+            epoch = sqlite_store.shared_epoch()
+            reloaded()
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def change_seq():
+    '''
+    Return the seq the changes table gives the change being made or applied,
+    which is the same in every worker.
+
+    Args:
+        NA
+
+    Return:
+        seq (int)
+    '''
+    if applying is not None:
+        return applying
+    # the records of this change are added after the ones made so far
+    return applied + len(data.journal_pending) + 1
+
+def reloaded():
+    '''
+    Tell the message listeners the data was read again up to applied, as
+    after a clear, since the changes before it were not heard one by one.
+    '''
+    global applying
+    applying = applied
+    try:
+        data.message_changed(None, None)
+    finally:
+        applying = None
+
+def catch_up():
+    '''
+    Apply the changes the other workers committed since the last catch up.
+
+    Args:
+        NA
+
+    Return:
+        None
+    '''
+    global applied
+    global applying
+    if not enabled:
+        return
+    with sqlite_store.store_lock:
+        if sqlite_store.last_change() == applied:
+            return
+    with data.write_lock:
+        changes = sqlite_store.changes_since(applied)
+        if not changes:
+            return
+        if changes[0][0] != applied + 1:
+            # the records in between were pruned
+            data.restore(sqlite_store.load())
+            applied = changes[-1][0]
+            reloaded()
+            return
+        try:
+            for (seq, record) in changes:
+                applying = seq
+                data.replay([record])
+                applied = seq
+        finally:
+            applying = None
+
+def begin_write():
+    '''
+    Start a change of the data, which ends with end_write. In multi-worker
+    mode no other worker changes the data until then, and this worker has
+    seen every change they made.
+
+    Args:
+        NA
+
+    Return:
+        None
+    '''
+    depth = getattr(state, 'depth', 0)
+    if enabled:
+        # the order data.commit takes them in
+        data.commit_lock.acquire()
+    data.write_lock.acquire()
+    state.depth = depth + 1
+    if enabled and depth == 0:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            catch_up()
+        except BaseException:
+            end_write()
+            raise
+
+def end_write():
+    '''
+    End a change started by begin_write. In multi-worker mode the change is
+    committed for the other workers to see.
+
+    Args:
+        NA
+
+    Return:
+        None
+    '''
+    global applied
+    state.depth -= 1
+    try:
+        if enabled and state.depth == 0:
+            try:
+                data.commit(database)
+                with sqlite_store.store_lock:
+                    applied = sqlite_store.last_change()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    finally:
+        data.write_lock.release()
+        if enabled:
+            data.commit_lock.release()
+
+@contextmanager
+def writing():
+    '''
+    Change the data inside a with statement, see begin_write.
+    '''
+    begin_write()
+    try:
+        yield
+    finally:
+        end_write()
@@ -0,0 +1,70 @@
+import other
+import auth
+import channels
+import data
+import json
+import sqlite3
+import sqlite_store
+import updates
+import workers
+import pytest
+
+@pytest.fixture
+def worker(tmp_path, monkeypatch):
+    '''
+    load a database in multi-worker mode and connect to it as another worker
+    would
+    '''
+
+    other.clear()
+    monkeypatch.setattr(data, 'persistence_mode', data.persistence_mode)
+    monkeypatch.setattr(sqlite_store, 'shared', False)
+    monkeypatch.setattr(workers, 'enabled', True)
+    workers.start(str(tmp_path / "database.json"))
+    connection = sqlite3.connect(str(tmp_path / "database.sqlite3"))
+    yield connection
+    connection.close()
+    sqlite_store.close_store()
+    other.clear()
+
+def other_worker_adds(connection, channel_id, name):
+    '''
+    add a channel the way another worker commits it, returning the seq of its
+    record
+    '''
+
+    with connection:
+        connection.execute('INSERT INTO channels (channel_id, name, is_public) VALUES (?, ?, ?)',
+            (channel_id, name, True))
+        connection.execute('INSERT INTO members (channel_id, role, u_id, position) VALUES (?, ?, ?, ?)',
+            (channel_id, 'all_members', 1, 0))
+        connection.execute('INSERT INTO members (channel_id, role, u_id, position) VALUES (?, ?, ?, ?)',
+            (channel_id, 'owner_members', 1, 0))
+        record = json.dumps([None, 0, 'add_channel', [name, 1, True, channel_id]])
+        return connection.execute('INSERT INTO changes (record) VALUES (?)', (record,)).lastrowid
+
+def test_workers_catch_up(worker):
+    '''
+    changes committed by another worker are replayed, or the database is read
+    again if some of them were pruned
+    '''
+
+    with workers.writing():
+        token = auth.auth_register('user1@gmail.com', 'password1', 'name_1', 'surname_1')['token']
+        c_id = channels.channels_create(token, 'channel1', True)['channel_id']
+    assert workers.applied == sqlite_store.last_change()
+
+    other_worker_adds(worker, 500, 'other1')
+    workers.catch_up()
+    assert workers.applied == sqlite_store.last_change()
+    assert [c['channel_id'] for c in channels.channels_list(token)['channels']] == [c_id, 500]
+
+    pruned = other_worker_adds(worker, 501, 'other2')
+    other_worker_adds(worker, 502, 'other3')
+    with worker:
+        worker.execute('DELETE FROM changes WHERE seq <= ?', (pruned,))
+    workers.catch_up()
+    assert workers.applied == sqlite_store.last_change()
+    assert [c['channel_id'] for c in channels.channels_list(token)['channels']] == [c_id, 500, 501, 502]
+    # message updates from before the read are not known one by one
+    assert updates.floor == workers.applied